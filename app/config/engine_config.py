@@ -0,0 +1,133 @@
+# app/config/engine_config.py
+import json
+import os
+from dataclasses import dataclass, fields
+
+DEFAULT_MODEL_PATH = os.getenv(
+    "LLM_MODEL_PATH",
+    "models/mistral-7b-instruct-v0.2.Q5_K_M.gguf"
+)
+N_THREADS = int(os.getenv("LLM_N_THREADS", "8"))
+N_BATCH = int(os.getenv("LLM_N_BATCH", "512"))
+
+# Context window per task. Contexts of the same GGUF share its mmap'd weights,
+# so only the KV cache is paid per context size.
+TASK_CONTEXT_WINDOWS = {
+    "infer": int(os.getenv("LLM_CONTEXT_WINDOW", "32768")),
+    "categorize": int(os.getenv("CATEGORIZE_CONTEXT_WINDOW", "4096")),
+    "scenario": int(os.getenv("SCENARIO_CONTEXT_WINDOW", "4096")),
+}
+
+# Speculative decoding per task: "off", "prompt-lookup" (drafts copied from n-grams already in
+# the prompt or output, no second model) or "draft" (a small GGUF sharing the main model's
+# vocabulary). Accepted tokens are the ones the main model would have sampled anyway.
+TASK_SPECULATIVE = {
+    "infer": os.getenv("LLM_INFER_SPECULATIVE", "off"),
+    "categorize": os.getenv("CATEGORIZE_SPECULATIVE", "prompt-lookup"),
+    "scenario": os.getenv("SCENARIO_SPECULATIVE", "off"),
+}
+DRAFT_MODEL_PATH = os.getenv("LLM_DRAFT_MODEL_PATH")
+DRAFT_TOKENS = int(os.getenv("LLM_DRAFT_TOKENS", "4"))
+PROMPT_LOOKUP_TOKENS = int(os.getenv("LLM_PROMPT_LOOKUP_TOKENS", "10"))
+PROMPT_LOOKUP_NGRAM = int(os.getenv("LLM_PROMPT_LOOKUP_NGRAM", "3"))
+
+# Engine profile per task: the settings above, unless LLM_ENGINE_PROFILES names a JSON file of
+# named profiles. A profile named after a task overrides that task's settings field by field;
+# LLM_INFER_PROFILE / CATEGORIZE_PROFILE / SCENARIO_PROFILE select a differently named one.
+ENGINE_PROFILES_PATH = os.getenv("LLM_ENGINE_PROFILES")
+TASK_PROFILE_NAMES = {
+    "infer": os.getenv("LLM_INFER_PROFILE", "infer"),
+    "categorize": os.getenv("CATEGORIZE_PROFILE", "categorize"),
+    "scenario": os.getenv("SCENARIO_PROFILE", "scenario"),
+}
+# Sampling a task gets unless its profile says otherwise. Categorization is greedy, so the
+# same transactions always get the same categories (and speculation cannot change them).
+TASK_SAMPLING = {
+    "infer": {},
+    "categorize": {"temperature": 0.0},
+    "scenario": {},
+}
+
+
+@dataclass(frozen=True)
+class EngineProfile:
+    """Which GGUF serves a task, how its contexts are built and how it samples."""
+
+    model_path: str
+    # e.g. "Q4_K_M"; fills a "{quantization}" placeholder in model_path
+    quantization: str = None
+    n_ctx: int = 4096
+    n_threads: int = N_THREADS
+    n_batch: int = N_BATCH
+    speculative: str = "off"
+    # None leaves llama.cpp's default
+    temperature: float = None
+    top_p: float = None
+    top_k: int = None
+    repeat_penalty: float = None
+
+    @property
+    def path(self) -> str:
+        if self.quantization and "{quantization}" in self.model_path:
+            return self.model_path.replace("{quantization}", self.quantization)
+        return self.model_path
+
+    def load_key(self) -> tuple:
+        # Profiles that differ only in sampling share contexts
+        return (self.path, self.n_ctx, self.speculative, self.n_threads, self.n_batch)
+
+    def sampling(self) -> dict:
+        values = {"temperature": self.temperature, "top_p": self.top_p, "top_k": self.top_k,
+                  "repeat_penalty": self.repeat_penalty}
+        return {name: value for name, value in values.items() if value is not None}
+
+
+def _read_profiles(path: str) -> dict:
+    if not path:
+        return {}
+    with open(path) as f:
+        profiles = json.load(f)
+    known = {field.name for field in fields(EngineProfile)}
+    for name, settings in profiles.items():
+        unknown = set(settings) - known
+        if unknown:
+            raise ValueError(f"Engine profile '{name}' has unknown settings: {', '.join(sorted(unknown))}")
+    return profiles
+
+
+NAMED_PROFILES = _read_profiles(ENGINE_PROFILES_PATH)
+
+
+def engine_profile(name: str, task: str) -> EngineProfile:
+    """The named profile, with anything it leaves out taken from task's defaults."""
+    if name not in NAMED_PROFILES and name != task:
+        raise ValueError(f"Unknown engine profile '{name}' (not in {ENGINE_PROFILES_PATH or 'LLM_ENGINE_PROFILES'})")
+    defaults = {
+        "model_path": DEFAULT_MODEL_PATH,
+        "n_ctx": TASK_CONTEXT_WINDOWS[task],
+        "speculative": TASK_SPECULATIVE[task],
+        **TASK_SAMPLING[task],
+    }
+    return EngineProfile(**{**defaults, **NAMED_PROFILES.get(name, {})})
+
+
+TASK_PROFILES = {task: engine_profile(name, task) for task, name in TASK_PROFILE_NAMES.items()}
+
+# Embeddings of transaction descriptions for the category kNN index. Defaults to the main
+# GGUF (mean-pooled); a small dedicated embedding GGUF is much cheaper per description.
+EMBEDDING_MODEL_PATH = os.getenv("LLM_EMBEDDING_MODEL_PATH", DEFAULT_MODEL_PATH)
+EMBEDDING_CONTEXT_WINDOW = int(os.getenv("LLM_EMBEDDING_CONTEXT_WINDOW", "512"))
+
+# Contexts per task loaded on demand when all existing ones are busy, so
+# independent requests (or chunks of one request) can decode in parallel
+TASK_REPLICAS = int(os.getenv("LLM_TASK_REPLICAS", "1"))
+
+# Bounded LRU for models requested through ?model_override=
+OVERRIDE_CACHE_MAX_MODELS = int(os.getenv("LLM_OVERRIDE_CACHE_MAX_MODELS", "2"))
+OVERRIDE_CACHE_BUDGET_MB = int(os.getenv("LLM_OVERRIDE_CACHE_BUDGET_MB", "16384"))
+
+# Loaded in the background after the port opens; readiness waits for all of them
+WARMUP_TASKS = [t.strip() for t in os.getenv("LLM_WARMUP_TASKS", ",".join(TASK_CONTEXT_WINDOWS)).split(",") if t.strip()]
+# A short generation per task once loaded, so the first real request does not pay for cold caches
+WARMUP_GENERATION = os.getenv("LLM_WARMUP_GENERATION", "true").lower() in ("1", "true", "yes")
+WARMUP_MAX_TOKENS = int(os.getenv("LLM_WARMUP_MAX_TOKENS", "4"))
@@ -0,0 +1,276 @@
+# app/db/log_writer.py
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+
+import asyncpg
+
+from app.db.pool import get_pool
+from app.metrics import time_db
+
+LOG_QUEUE_SIZE = int(os.getenv("CONVERSATION_LOG_QUEUE_SIZE", "1000"))
+LOG_BATCH_SIZE = int(os.getenv("CONVERSATION_LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_LOG_FLUSH_INTERVAL", "1.0"))
+# Records that cannot reach Postgres (queue full or DB down) are appended to a file of this
+# process's own here and replayed later; records Postgres rejects are dead-lettered next to it
+LOG_SPILL_DIR = os.getenv("CONVERSATION_LOG_SPILL_DIR", "log_spill")
+# Records turned away by a full queue that wait in memory for the flush loop to spill them;
+# beyond this they are dropped
+LOG_OVERFLOW_SIZE = int(os.getenv("CONVERSATION_LOG_OVERFLOW_SIZE", "10000"))
+
+COLUMNS = ["user_id", "input_text", "llm_response", "task_type", "source_model", "session_id"]
+
+# conversation_logs-<pid>.spill.jsonl, plus .replay... while being replayed
+SPILL_NAME = re.compile(r"conversation_logs-(\d+)\.spill\.jsonl(\.replay.*)?")
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _rejected(e: Exception) -> bool:
+    # Postgres (or asyncpg's encoder) refused the data itself, as opposed to being unreachable
+    return isinstance(e, (asyncpg.PostgresError, asyncpg.DataError)) and not isinstance(
+        e, asyncpg.PostgresConnectionError)
+
+
+class ConversationLogWriter:
+    """Takes conversation_logs rows off the request path and COPYs them in batches."""
+
+    def __init__(self, queue_size: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL, spill_dir: str = LOG_SPILL_DIR,
+                 overflow_size: int = LOG_OVERFLOW_SIZE):
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._spill_dir = spill_dir
+        self._spill_path = os.path.join(spill_dir, f"conversation_logs-{os.getpid()}.spill.jsonl")
+        self._dead_letter_path = os.path.join(spill_dir, f"conversation_logs-{os.getpid()}.dead.jsonl")
+        self._file_lock = threading.Lock()
+        # Records the full queue turned away, written out by the flush loop rather than on the request path
+        self._overflow = []
+        self._overflow_size = overflow_size
+        self._dropped = 0
+        # Whether there may be spilled records to replay: at start, those of processes that died
+        self._spilled = True
+        self._task = None
+        self._closing = False
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, record: tuple):
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            if len(self._overflow) >= self._overflow_size:
+                # The flush loop is not keeping up (or not running): losing logs beats growing without bound
+                self._dropped += 1
+                return
+            if not self._overflow:
+                logging.warning("Conversation log queue full, spilling records to disk")
+            self._overflow.append(record)
+
+    async def stop(self):
+        # Drain everything still queued before the pool goes away
+        if self._task is None:
+            return
+        self._closing = True
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while not (self._closing and self._queue.empty() and not self._overflow):
+            try:
+                batch = await self._collect()
+                if self._dropped:
+                    logging.error(f"Dropped {self._dropped} conversation logs: the overflow was full")
+                    self._dropped = 0
+                if self._overflow:
+                    overflow, self._overflow = self._overflow, []
+                    await self._spill(overflow)
+                if batch:
+                    await self._flush(batch)
+            except Exception:
+                # E.g. a full disk: this iteration's records are lost, but logging goes on
+                logging.exception("Conversation log writer iteration failed")
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._flush_interval
+        batch = []
+        while len(batch) < self._batch_size:
+            if self._closing:
+                if self._queue.empty():
+                    break
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: list):
+        unsent = await self._insert(batch)
+        if unsent:
+            await self._spill(unsent)
+            return
+
+        # Postgres is healthy again: push anything spilled earlier
+        if self._spilled:
+            await self._replay_spill()
+
+    async def _insert(self, records: list) -> list:
+        """COPYs records in batches and returns those left over because Postgres could not be reached.
+
+        A batch Postgres rejects is retried row by row, so one bad record is dead-lettered
+        instead of taking its batch with it.
+        """
+        try:
+            pool = await get_pool()
+        except Exception as e:
+            logging.error(f"Conversation log flush of {len(records)} rows failed, spilling to disk: {str(e)}")
+            return records
+
+        for i in range(0, len(records), self._batch_size):
+            batch = records[i:i + self._batch_size]
+            try:
+                await self._copy(pool, batch)
+                continue
+            except Exception as e:
+                if not _rejected(e):
+                    logging.error(f"Conversation log flush of {len(records) - i} rows failed, spilling to disk: {str(e)}")
+                    return records[i:]
+
+            for j, record in enumerate(batch):
+                try:
+                    await self._copy(pool, [record])
+                except Exception as e:
+                    if not _rejected(e):
+                        logging.error(f"Conversation log flush failed, spilling to disk: {str(e)}")
+                        return batch[j:] + records[i + self._batch_size:]
+                    logging.error(f"Conversation log record rejected, dead-lettering it: {str(e)}")
+                    await asyncio.to_thread(self._append, self._dead_letter_path, [record])
+        return []
+
+    async def _copy(self, pool, records: list):
+        async with pool.acquire() as conn, time_db("conversation_log_copy"):
+            await conn.copy_records_to_table("conversation_logs", records=records, columns=COLUMNS)
+
+    async def _spill(self, records: list):
+        await asyncio.to_thread(self._append, self._spill_path, records)
+        self._spilled = True
+
+    def _append(self, path: str, records: list):
+        self._append_lines(path, [json.dumps(list(record), default=str) + "\n" for record in records])
+
+    def _append_lines(self, path: str, lines: list):
+        os.makedirs(self._spill_dir, exist_ok=True)
+        with self._file_lock, open(path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def _claim_spills(self) -> list:
+        """Moves this process's spill file, and those of processes that died, aside for replay."""
+        own_replay = self._spill_path + ".replay"
+        claimed = []
+        with self._file_lock:
+            try:
+                os.replace(self._spill_path, own_replay)
+            except FileNotFoundError:
+                pass
+        if os.path.exists(own_replay):
+            claimed.append(own_replay)
+
+        try:
+            names = os.listdir(self._spill_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            match = SPILL_NAME.fullmatch(name)
+            if match is None:
+                continue
+            path = os.path.join(self._spill_dir, name)
+            if int(match[1]) == os.getpid():
+                # Adopted earlier by this process, but not finished with
+                if match[2] and path != own_replay:
+                    claimed.append(path)
+                continue
+            if _process_alive(int(match[1])):
+                continue
+            target = f"{own_replay}.{name}"
+            try:
+                # Atomic: when several processes notice the same orphan, one of them gets it
+                os.replace(path, target)
+            except FileNotFoundError:
+                continue
+            claimed.append(target)
+        return claimed
+
+    def _read_spill(self, path: str):
+        """The records in a spill file, or None if it cannot be read (it is then moved out of the way).
+
+        Lines that do not decode, like the last one of a process that died mid-write, are dead-lettered.
+        """
+        records = []
+        undecodable = []
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        records.append(tuple(json.loads(line)))
+                    except (ValueError, TypeError):
+                        undecodable.append(line if line.endswith("\n") else line + "\n")
+        except OSError as e:
+            # No longer named like a spill file, so no process claims it again
+            aside = os.path.join(self._spill_dir, f"conversation_logs-{os.getpid()}.unreadable-{os.path.basename(path)}")
+            logging.error(f"Spilled conversation logs in {path} could not be read, moved to {aside}: {str(e)}")
+            os.replace(path, aside)
+            return None
+
+        if undecodable:
+            logging.error(f"Dead-lettering {len(undecodable)} undecodable lines from {path}")
+            self._append_lines(self._dead_letter_path, undecodable)
+        return records
+
+    async def _replay_spill(self):
+        self._spilled = False
+        reachable = True
+        for path in await asyncio.to_thread(self._claim_spills):
+            records = await asyncio.to_thread(self._read_spill, path)
+            if records is None:
+                continue
+            # Batches commit one at a time; only what did not go in is spilled again
+            unsent = await self._insert(records) if reachable else records
+            if unsent:
+                reachable = False
+                await self._spill(unsent)
+            if len(unsent) < len(records):
+                logging.info(f"Replayed {len(records) - len(unsent)} spilled conversation logs")
+            await asyncio.to_thread(os.remove, path)
+
+
+_writer = None
+
+
+def get_log_writer() -> ConversationLogWriter:
+    global _writer
+    if _writer is None:
+        _writer = ConversationLogWriter()
+    return _writer
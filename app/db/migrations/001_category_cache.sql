@@ -0,0 +1,18 @@
+-- Normalized merchant description -> category, shared by every API process
+CREATE TABLE IF NOT EXISTS merchant_category_cache (
+    description_key TEXT PRIMARY KEY,
+    category        TEXT NOT NULL,
+    confidence      REAL NOT NULL,
+    source          TEXT NOT NULL DEFAULT 'llm',   -- 'llm' or 'feedback'
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- User corrections of a transaction's category
+CREATE TABLE IF NOT EXISTS category_feedback (
+    id             BIGSERIAL PRIMARY KEY,
+    user_id        INTEGER NOT NULL,
+    transaction_id INTEGER,
+    description    TEXT NOT NULL,
+    category       TEXT NOT NULL,
+    created_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+);
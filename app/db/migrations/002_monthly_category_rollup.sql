@@ -0,0 +1,83 @@
+-- Per-user monthly totals by category, kept in step with `transactions` by the
+-- statement-level triggers below. Backfill / verify with: python -m app.db.rollup
+CREATE TABLE IF NOT EXISTS monthly_category_rollup (
+    user_id      INTEGER NOT NULL,
+    month        DATE    NOT NULL,              -- first day of the month
+    category     TEXT    NOT NULL,              -- NULL categories roll up as 'uncategorized'
+    total_amount NUMERIC NOT NULL DEFAULT 0,
+    txn_count    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month, category)
+);
+
+CREATE OR REPLACE FUNCTION monthly_rollup_on_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO monthly_category_rollup AS r (user_id, month, category, total_amount, txn_count)
+    SELECT user_id, date_trunc('month', date)::date, COALESCE(category, 'uncategorized'), SUM(amount), COUNT(*)
+    FROM new_rows
+    GROUP BY 1, 2, 3
+    ON CONFLICT (user_id, month, category) DO UPDATE
+    SET total_amount = r.total_amount + EXCLUDED.total_amount,
+        txn_count    = r.txn_count + EXCLUDED.txn_count;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION monthly_rollup_on_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE monthly_category_rollup r
+    SET total_amount = r.total_amount - d.total_amount,
+        txn_count    = r.txn_count - d.txn_count
+    FROM (
+        SELECT user_id, date_trunc('month', date)::date AS month,
+               COALESCE(category, 'uncategorized') AS category,
+               SUM(amount) AS total_amount, COUNT(*) AS txn_count
+        FROM old_rows
+        GROUP BY 1, 2, 3
+    ) d
+    WHERE r.user_id = d.user_id AND r.month = d.month AND r.category = d.category;
+
+    DELETE FROM monthly_category_rollup
+    WHERE txn_count <= 0 AND user_id IN (SELECT DISTINCT user_id FROM old_rows);
+    RETURN NULL;
+END $$;
+
+-- Recategorization, amount or date edits: remove the old contribution, add the new one
+CREATE OR REPLACE FUNCTION monthly_rollup_on_update() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO monthly_category_rollup AS r (user_id, month, category, total_amount, txn_count)
+    SELECT user_id, month, category, SUM(amount), SUM(n)
+    FROM (
+        SELECT user_id, date_trunc('month', date)::date AS month,
+               COALESCE(category, 'uncategorized') AS category, amount, 1 AS n
+        FROM new_rows
+        UNION ALL
+        SELECT user_id, date_trunc('month', date)::date,
+               COALESCE(category, 'uncategorized'), -amount, -1
+        FROM old_rows
+    ) d
+    GROUP BY 1, 2, 3
+    ON CONFLICT (user_id, month, category) DO UPDATE
+    SET total_amount = r.total_amount + EXCLUDED.total_amount,
+        txn_count    = r.txn_count + EXCLUDED.txn_count;
+
+    DELETE FROM monthly_category_rollup
+    WHERE txn_count <= 0 AND user_id IN (SELECT DISTINCT user_id FROM old_rows);
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS transactions_rollup_insert ON transactions;
+CREATE TRIGGER transactions_rollup_insert
+    AFTER INSERT ON transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION monthly_rollup_on_insert();
+
+DROP TRIGGER IF EXISTS transactions_rollup_delete ON transactions;
+CREATE TRIGGER transactions_rollup_delete
+    AFTER DELETE ON transactions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION monthly_rollup_on_delete();
+
+DROP TRIGGER IF EXISTS transactions_rollup_update ON transactions;
+CREATE TRIGGER transactions_rollup_update
+    AFTER UPDATE ON transactions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION monthly_rollup_on_update();
@@ -0,0 +1,29 @@
+-- Bulk categorization of transactions.category, run by the API processes' background
+-- worker (app/services/categorization_jobs.py). Progress is committed with every batch,
+-- so a job interrupted by a restart resumes from its cursor.
+CREATE TABLE IF NOT EXISTS categorization_jobs (
+    id             BIGSERIAL PRIMARY KEY,
+    user_id        INTEGER,                        -- NULL: every user
+    date_from      DATE,
+    date_to        DATE,                           -- inclusive
+    status         TEXT NOT NULL DEFAULT 'queued', -- queued, running, done, failed, cancelled
+    total          INTEGER,                        -- uncategorized rows when the job started
+    processed      INTEGER NOT NULL DEFAULT 0,
+    categorized    INTEGER NOT NULL DEFAULT 0,
+    low_confidence INTEGER NOT NULL DEFAULT 0,
+    -- Keyset position: the last (user_id, id) whose batch was written back
+    cursor_user_id INTEGER,
+    cursor_id      INTEGER,
+    error          TEXT,
+    created_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at     TIMESTAMPTZ,
+    heartbeat_at   TIMESTAMPTZ,                    -- a running job whose heartbeat is stale is reclaimed
+    finished_at    TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS categorization_jobs_pending_idx
+    ON categorization_jobs (id) WHERE status IN ('queued', 'running');
+
+-- The keyset scan over uncategorized rows
+CREATE INDEX IF NOT EXISTS transactions_uncategorized_idx
+    ON transactions (user_id, id) WHERE category IS NULL;
@@ -0,0 +1,11 @@
+-- A correction only reaches the shared merchant cache (and the kNN index) once
+-- CATEGORY_FEEDBACK_MIN_USERS distinct users agree on it. Corrections are grouped by the
+-- same normalized description the cache uses.
+ALTER TABLE category_feedback ADD COLUMN IF NOT EXISTS description_key TEXT;
+
+-- Rows written before this migration have no key and do not count towards agreement
+CREATE INDEX IF NOT EXISTS category_feedback_key_idx
+    ON category_feedback (description_key, category);
+
+-- Overrides promoted from a single user's correction; the model refills these merchants
+DELETE FROM merchant_category_cache WHERE source = 'feedback';
@@ -0,0 +1,3 @@
+-- The worker that claimed a running job. Every update a worker makes to its job matches this,
+-- so a worker whose job was taken over (or cancelled and resumed) can no longer write to it.
+ALTER TABLE categorization_jobs ADD COLUMN IF NOT EXISTS claimed_by TEXT;
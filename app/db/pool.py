@@ -1,14 +1,74 @@
 import asyncpg
+import logging
 import os
 
+from app.metrics import time_db
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "10"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
+
 _pool = None
+# sql -> short name used as the db_query_seconds label
+_statement_names = {}
 
-async def get_pool():
+
+class PreparedConnection(asyncpg.Connection):
+    # asyncpg.Connection uses __slots__; this subclass gets a __dict__ to hold statements
+    def statements(self) -> dict:
+        return self.__dict__.setdefault("_prepared_statements", {})
+
+
+def prepared_statement(sql: str, name: str) -> str:
+    _statement_names[sql] = name
+    return sql
+
+
+async def fetch_prepared(conn, sql: str, *args):
+    # Prepared on first use per connection, not on connect: a statement that cannot be
+    # prepared (e.g. its table's migration has not run) fails only its own queries
+    statements = conn.statements()
+    name = _statement_names.get(sql, "unnamed")
+    if sql not in statements:
+        try:
+            statements[sql] = await conn.prepare(sql)
+        except asyncpg.PostgresError as e:
+            logging.warning(f"Could not prepare {name}, running it unprepared: {str(e)}")
+            with time_db(name):
+                return await conn.fetch(sql, *args)
+    with time_db(name):
+        return await statements[sql].fetch(*args)
+
+
+async def init_pool():
     global _pool
     if _pool is None:
         _pool = await asyncpg.create_pool(
             dsn=os.getenv("DATABASE_URL"),
-            min_size=1,
-            max_size=5
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            timeout=DB_CONNECT_TIMEOUT,
+            max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+            connection_class=PreparedConnection
         )
-    return _pool
\ No newline at end of file
+        logging.info(f"DB pool ready ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections)")
+    return _pool
+
+
+async def get_pool():
+    # Normally created by the app lifespan; lazily here for scripts or if startup could not connect
+    if _pool is None:
+        return await init_pool()
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
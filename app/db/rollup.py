@@ -0,0 +1,84 @@
+# app/db/rollup.py
+#
+# Maintenance for monthly_category_rollup (see migrations/002_monthly_category_rollup.sql).
+#
+#   python -m app.db.rollup backfill [--user-id N]
+#   python -m app.db.rollup check [--user-id N]
+import argparse
+import asyncio
+import os
+import sys
+
+import asyncpg
+from dotenv import load_dotenv
+
+EXPECTED_SQL = """
+    SELECT user_id, date_trunc('month', date)::date AS month,
+           COALESCE(category, 'uncategorized') AS category,
+           SUM(amount) AS total_amount, COUNT(*) AS txn_count
+    FROM transactions
+    WHERE ($1::int IS NULL OR user_id = $1)
+    GROUP BY 1, 2, 3
+"""
+
+
+async def backfill(conn, user_id: int = None) -> int:
+    async with conn.transaction():
+        # Block writers (not readers) so the triggers cannot race the rebuild
+        await conn.execute("LOCK TABLE transactions IN SHARE MODE")
+        await conn.execute("""
+            DELETE FROM monthly_category_rollup WHERE ($1::int IS NULL OR user_id = $1)
+        """, user_id)
+        status = await conn.execute(f"""
+            INSERT INTO monthly_category_rollup (user_id, month, category, total_amount, txn_count)
+            {EXPECTED_SQL}
+        """, user_id)
+    return int(status.split()[-1])
+
+
+async def check(conn, user_id: int = None) -> list:
+    """Returns rows where the rollup disagrees with the raw transactions."""
+    return await conn.fetch(f"""
+        WITH expected AS ({EXPECTED_SQL})
+        SELECT COALESCE(e.user_id, r.user_id) AS user_id,
+               COALESCE(e.month, r.month) AS month,
+               COALESCE(e.category, r.category) AS category,
+               e.total_amount AS expected_amount, r.total_amount AS rollup_amount,
+               e.txn_count AS expected_count, r.txn_count AS rollup_count
+        FROM expected e
+        FULL OUTER JOIN (
+            SELECT * FROM monthly_category_rollup WHERE ($1::int IS NULL OR user_id = $1)
+        ) r USING (user_id, month, category)
+        WHERE e.total_amount IS DISTINCT FROM r.total_amount
+           OR e.txn_count IS DISTINCT FROM r.txn_count
+        ORDER BY 1, 2, 3
+    """, user_id)
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the monthly category rollup")
+    parser.add_argument("command", choices=["backfill", "check"])
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    conn = await asyncpg.connect(dsn=os.getenv("DATABASE_URL"))
+    try:
+        if args.command == "backfill":
+            rows = await backfill(conn, args.user_id)
+            print(f"✅ Rebuilt {rows} rollup rows")
+            return 0
+
+        mismatches = await check(conn, args.user_id)
+        for row in mismatches:
+            print(f"❌ user {row['user_id']} {row['month']:%Y-%m} {row['category']}: "
+                  f"expected £{row['expected_amount']} ({row['expected_count']}), "
+                  f"rollup £{row['rollup_amount']} ({row['rollup_count']})")
+        print(f"{'❌' if mismatches else '✅'} {len(mismatches)} mismatched rollup rows")
+        return 1 if mismatches else 0
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,119 @@
+# app/engine/cancellation.py
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from app import metrics
+
+# Seconds a request may take end to end, unless the client sends X-Request-Timeout
+REQUEST_DEADLINES = {
+    "infer": float(os.getenv("LLM_INFER_DEADLINE_SECONDS", "120")),
+    "categorize": float(os.getenv("CATEGORIZE_DEADLINE_SECONDS", "60")),
+    "scenario": float(os.getenv("SCENARIO_DEADLINE_SECONDS", "90")),
+}
+# Upper bound on what a client may ask for through the header
+MAX_REQUEST_DEADLINE = float(os.getenv("LLM_MAX_DEADLINE_SECONDS", "600"))
+DEADLINE_HEADER = "X-Request-Timeout"
+DISCONNECT_POLL_SECONDS = float(os.getenv("LLM_DISCONNECT_POLL_SECONDS", "0.25"))
+
+# The token of the request being handled; the executor picks it up when a job is submitted
+current_cancel = ContextVar("current_cancel", default=None)
+
+
+class GenerationCancelled(Exception):
+    def __init__(self, reason: str = "cancelled"):
+        super().__init__(reason)
+        self.reason = reason
+
+    def __str__(self):
+        return f"Generation cancelled ({self.reason})"
+
+
+class CancelToken:
+    """Set when the client disconnects; expires at its deadline (wall clock, so it means
+    the same thing in the inference worker processes)."""
+
+    def __init__(self, deadline: float = None, endpoint: str = None):
+        self.deadline = deadline
+        self.endpoint = endpoint
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.cancel("deadline")
+            return True
+        return False
+
+
+class SharedCancelToken(CancelToken):
+    """For one generation serving several requests: cancelled only once all of them are."""
+
+    def __init__(self, tokens: list):
+        super().__init__(endpoint=next((t.endpoint for t in tokens if t is not None), None))
+        self._tokens = []
+        for token in tokens:
+            self.join(token)
+
+    def join(self, token: CancelToken):
+        # None: a caller without a token, so no deadline either
+        self._tokens.append(token)
+        if any(t is None or t.deadline is None for t in self._tokens):
+            self.deadline = None
+        else:
+            self.deadline = max(t.deadline for t in self._tokens)
+
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        # A caller without a token waits however long it takes
+        if self._tokens and all(t is not None and t.cancelled() for t in self._tokens):
+            self.cancel(self._tokens[-1].reason)
+            return True
+        return False
+
+
+def raise_if_cancelled(token: CancelToken, stage: str, endpoint: str = None):
+    if token is not None and token.cancelled():
+        metrics.generation_cancelled(endpoint or token.endpoint or "unknown", token.reason, stage)
+        raise GenerationCancelled(token.reason)
+
+
+def request_timeout(request, endpoint: str) -> float:
+    value = request.headers.get(DEADLINE_HEADER)
+    try:
+        timeout = float(value) if value else REQUEST_DEADLINES[endpoint]
+    except ValueError:
+        timeout = REQUEST_DEADLINES[endpoint]
+    return min(max(timeout, 0.0), MAX_REQUEST_DEADLINE)
+
+
+async def _watch_disconnect(request, token: CancelToken):
+    while not token.cancelled():
+        if await request.is_disconnected():
+            token.cancel("disconnect")
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+@asynccontextmanager
+async def request_cancellation(request, endpoint: str):
+    """Deadline and disconnect handling for the inference submitted inside the block."""
+    token = CancelToken(deadline=time.time() + request_timeout(request, endpoint), endpoint=endpoint)
+    reset = current_cancel.set(token)
+    watcher = asyncio.create_task(_watch_disconnect(request, token))
+    try:
+        yield token
+    finally:
+        watcher.cancel()
+        current_cancel.reset(reset)
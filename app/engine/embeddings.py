@@ -0,0 +1,41 @@
+# app/engine/embeddings.py
+import logging
+import os
+import threading
+
+from app.config.engine_config import EMBEDDING_MODEL_PATH, EMBEDDING_CONTEXT_WINDOW, N_THREADS
+
+_embedder = None
+_lock = threading.Lock()
+
+
+def _load(model_path: str, n_ctx: int):
+    from llama_cpp import Llama, LLAMA_POOLING_TYPE_MEAN
+
+    logging.info(f"Loading embedding model {model_path} (n_ctx={n_ctx})")
+    return Llama(
+        model_path=model_path,
+        n_ctx=n_ctx,
+        n_threads=N_THREADS,
+        n_threads_batch=N_THREADS,
+        use_mmap=True,
+        embedding=True,
+        # One vector per text, also for causal LMs that have no pooling of their own
+        pooling_type=LLAMA_POOLING_TYPE_MEAN,
+        verbose=False,
+    )
+
+
+def embedding_model_name() -> str:
+    # Stored with a persisted index: vectors from another model are not comparable
+    return f"{os.path.basename(EMBEDDING_MODEL_PATH)}-{EMBEDDING_CONTEXT_WINDOW}"
+
+
+def embed_texts(texts: list) -> list:
+    """Unit-length embeddings, one list of floats per text. Runs on an inference worker."""
+    global _embedder
+    # One context, used by one worker at a time, like the task models
+    with _lock:
+        if _embedder is None:
+            _embedder = _load(EMBEDDING_MODEL_PATH, EMBEDDING_CONTEXT_WINDOW)
+        return _embedder.embed(texts, normalize=True, truncate=True)
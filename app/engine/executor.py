@@ -0,0 +1,207 @@
+# app/engine/executor.py
+import asyncio
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+
+from app.engine.registry import checkout
+from app.engine.prefix_cache import warm_prefixes
+from app.engine.generation import InferenceRequest, generate_tokens, complete, current_job
+from app.engine.cancellation import CancelToken, current_cancel, raise_if_cancelled
+from app.engine.worker_pool import RemoteBackend, WORKER_PROCESSES
+
+INFERENCE_WORKERS = int(os.getenv("LLM_INFERENCE_WORKERS", "2"))
+INFERENCE_QUEUE_DEPTH = int(os.getenv("LLM_INFERENCE_QUEUE_DEPTH", "16"))
+RETRY_AFTER_SECONDS = int(os.getenv("LLM_RETRY_AFTER_SECONDS", "5"))
+
+# Lower runs first: queued background jobs wait for every queued interactive one
+INTERACTIVE, BACKGROUND = 0, 1
+current_priority = ContextVar("inference_priority", default=INTERACTIVE)
+# Jobs with the same affinity key (a session id) run in the same worker process, where its
+# KV state is kept; without worker processes every context can use it
+current_affinity = ContextVar("inference_affinity", default=None)
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int = RETRY_AFTER_SECONDS):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class LocalBackend:
+    """Runs jobs right on the executor thread, in this process."""
+
+    def call(self, fn, args, kwargs):
+        return fn(*args, **kwargs)
+
+    def iterate(self, fn, args, kwargs):
+        return fn(*args, **kwargs)
+
+    def broadcast(self, fn, *args):
+        fn(*args)
+
+
+class InferenceExecutor:
+    """Runs blocking llama.cpp calls on worker threads behind a bounded queue.
+
+    Jobs submitted with current_priority set to BACKGROUND only start when no interactive
+    job is waiting. With LLM_WORKER_PROCESSES set, the threads only relay jobs to the inference worker
+    processes (see worker_pool.py); the queue and back-pressure stay here.
+    """
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, queue_depth: int = INFERENCE_QUEUE_DEPTH, backend=None):
+        self._backend = backend or (RemoteBackend() if WORKER_PROCESSES else LocalBackend())
+        self._workers = workers
+        self._queue = queue.PriorityQueue(maxsize=queue_depth)
+        # FIFO within a priority
+        self._sequence = itertools.count()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f"inference-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def _enqueue(self, fn, args, kwargs, cancel: CancelToken = None):
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            job = (fn, args, kwargs, cancel, current_affinity.get(), loop, future, time.perf_counter())
+            self._queue.put_nowait((current_priority.get(), next(self._sequence), job))
+        except queue.Full:
+            logging.warning(f"Inference queue full ({self._queue.maxsize} waiting), rejecting request")
+            raise QueueFullError()
+        return future
+
+    async def submit(self, fn, *args, **kwargs):
+        """Returns (result, timings) where timings splits queue wait from run time.
+
+        The job is abandoned, queued or mid-generation, once the request's cancel token fires.
+        """
+        return await self._enqueue(self._backend.call, (fn, args, kwargs), {}, current_cancel.get())
+
+    def stream(self, fn, *args, **kwargs) -> "InferenceStream":
+        """Runs generator function fn on a worker and relays what it yields.
+
+        Enqueues immediately, so QueueFullError is raised before any response is sent.
+        """
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        # Its own token even outside a request scope: the consumer leaving cancels it
+        cancel = current_cancel.get() or CancelToken()
+
+        def pump():
+            gen = self._backend.iterate(fn, args, kwargs)
+            try:
+                for item in gen:
+                    loop.call_soon_threadsafe(items.put_nowait, item)
+                    if cancel.cancelled():
+                        break
+            finally:
+                gen.close()
+                loop.call_soon_threadsafe(items.put_nowait, _DONE)
+
+        future = self._enqueue(pump, (), {}, cancel)
+        return InferenceStream(items, future, cancel)
+
+    def broadcast(self, fn, *args):
+        """Blocking: runs fn(*args) once per inference process, e.g. to load and warm models."""
+        self._backend.broadcast(fn, *args)
+
+    def _run(self):
+        while True:
+            _, _, (fn, args, kwargs, cancel, affinity, loop, future, enqueued_at) = self._queue.get()
+            started_at = time.perf_counter()
+            current_job.queue_wait = started_at - enqueued_at
+            current_job.cancel = cancel
+            current_job.affinity = affinity
+            result, error = None, None
+            try:
+                # Timed out or abandoned while queued: skip straight to the next job
+                raise_if_cancelled(cancel, "queued")
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                error = e
+            timings = {
+                "queue_wait": started_at - enqueued_at,
+                "generation": time.perf_counter() - started_at,
+            }
+            loop.call_soon_threadsafe(_resolve, future, result, error, timings)
+
+
+_DONE = object()
+
+
+class InferenceStream:
+    def __init__(self, items: asyncio.Queue, future: asyncio.Future, cancel: CancelToken):
+        self._items = items
+        self._future = future
+        self._cancel = cancel
+        self.timings = None
+
+    async def __aiter__(self):
+        finished = False
+        try:
+            while True:
+                item = await self._items.get()
+                if item is _DONE:
+                    break
+                yield item
+            finished = True
+            # Re-raise anything the worker failed with
+            _, self.timings = await self._future
+        finally:
+            if not finished:
+                # The client went away mid-stream: stop generating between tokens
+                self._cancel.cancel("disconnect")
+            # Nobody awaits the worker once the consumer has left early
+            self._future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+def _resolve(future, result, error, timings):
+    # The awaiting request may have been cancelled while we were generating
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result((result, timings))
+
+
+def run_completion(request: InferenceRequest) -> dict:
+    # Runs on an inference worker: loading and generation both stay off the event loop
+    with checkout(request.task) as llm:
+        warm_prefixes(llm, request.task)
+        return complete(llm, request)
+
+
+def stream_completion(request: InferenceRequest):
+    with checkout(request.task) as llm:
+        warm_prefixes(llm, request.task)
+        yield from generate_tokens(llm, request)
+
+
+_executor = None
+
+
+def get_executor() -> InferenceExecutor:
+    global _executor
+    if _executor is None:
+        _executor = InferenceExecutor()
+    return _executor
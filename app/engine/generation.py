@@ -0,0 +1,153 @@
+# app/engine/generation.py
+import threading
+import time
+from dataclasses import dataclass, field
+
+from app import metrics
+from app.config.engine_config import EngineProfile, TASK_PROFILES
+from app.engine.cancellation import GenerationCancelled, raise_if_cancelled
+from app.engine.grammar import grammar_from_schema, schema_token_budget
+from app.engine.registry import model_name
+from app.engine.session_cache import restore_session, save_session
+
+# Set by the executor for the job running on this worker thread
+current_job = threading.local()
+
+
+@dataclass
+class InferenceRequest:
+    """One generation. The prompt is tokenized once, on the worker, and those tokens go to llama.cpp."""
+
+    task: str
+    prompt: str
+    # None: sized from json_schema if there is one, else whatever context is left
+    max_tokens: int = None
+    json_schema: str = None
+    # False for schemas built per request (e.g. an enum of this batch's ids): nothing to reuse
+    cache_grammar: bool = True
+    stop: list = None
+    # End as soon as the top-level JSON value closes instead of waiting for EOS
+    stop_at_json_end: bool = False
+    # None: the profile's sampling; 0 is greedy
+    temperature: float = None
+    # None: the task's profile (only its sampling applies; the context is the caller's)
+    profile: EngineProfile = None
+    # Keeps the KV state between turns of a conversation; see app/engine/session_cache.py
+    session_id: str = None
+    tokens: list = field(default=None, repr=False)
+
+    def tokenize(self, llm) -> list:
+        if self.tokens is None:
+            self.tokens = llm.tokenize(self.prompt.encode("utf-8"), add_bos=True, special=True)
+        return self.tokens
+
+    def output_budget(self, llm) -> int:
+        available = llm.context_params.n_ctx - len(self.tokenize(llm))
+        budget = self.max_tokens
+        if budget is None and self.json_schema:
+            budget = schema_token_budget(llm, self.json_schema)
+        if budget is None:
+            budget = available
+        return max(1, min(budget, available))
+
+
+class JsonEndDetector:
+    """Incrementally scans generated text for the end of the first top-level object or array."""
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> int:
+        """Offset in text just past the closing bracket, or -1 while the value is still open."""
+        for i, ch in enumerate(text):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    return i + 1
+        return -1
+
+
+def generate_tokens(llm, request: InferenceRequest):
+    """Streams completion text and records inference metrics, even if stopped early.
+
+    Generation always streams internally: the time to the first token is the prompt
+    evaluation time, the rest is decoding. The job's cancel token is checked between
+    tokens, so a cancelled request frees the worker after at most one more token.
+    """
+    cancel = getattr(current_job, "cancel", None)
+    # Waiting for a free context counts as queueing too
+    raise_if_cancelled(cancel, "queued", request.task)
+
+    model = model_name(llm)
+    tokens = request.tokenize(llm)
+    if request.session_id:
+        restore_session(llm, request.session_id, tokens)
+    kwargs = {"max_tokens": request.output_budget(llm), "stop": request.stop}
+    if request.json_schema:
+        kwargs["grammar"] = grammar_from_schema(request.json_schema, cache=request.cache_grammar)
+    profile = request.profile or TASK_PROFILES.get(request.task)
+    if profile is not None:
+        kwargs.update(profile.sampling())
+    if request.temperature is not None:
+        kwargs["temperature"] = request.temperature
+    detector = JsonEndDetector() if request.stop_at_json_end else None
+
+    start = time.perf_counter()
+    first_token_at = None
+    pieces = []
+    finished = False
+    stream = llm(tokens, stream=True, **kwargs)
+    try:
+        for chunk in stream:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            if cancel is not None and cancel.cancelled():
+                raise GenerationCancelled(cancel.reason)
+            text = chunk["choices"][0]["text"]
+            pieces.append(text)
+            if detector is not None:
+                end = detector.feed(text)
+                if end >= 0:
+                    # Anything after the closing bracket is padding the grammar still allows
+                    finished = True
+                    yield text[:end]
+                    break
+            yield text
+        finished = True
+    finally:
+        stream.close()
+        if finished and request.session_id:
+            save_session(llm, request.session_id)
+        if not finished and cancel is not None and cancel.cancelled():
+            metrics.generation_cancelled(request.task, cancel.reason, "generating")
+        end = time.perf_counter()
+        first_token_at = first_token_at or end
+        # A chunk can hold several tokens (text held back while it might start a stop string)
+        completion_tokens = len(llm.tokenize("".join(pieces).encode("utf-8"), add_bos=False, special=True))
+        metrics.observe_inference(
+            request.task, model,
+            queue_wait=getattr(current_job, "queue_wait", 0.0),
+            prompt_eval=first_token_at - start,
+            generation=end - first_token_at,
+            prompt_tokens=len(tokens),
+            completion_tokens=completion_tokens,
+        )
+
+
+def complete(llm, request: InferenceRequest) -> dict:
+    # Same shape as a non-streaming llama.cpp completion, plus the model's display name
+    text = "".join(generate_tokens(llm, request))
+    return {"choices": [{"text": text}], "model": model_name(llm)}
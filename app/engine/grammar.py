@@ -0,0 +1,61 @@
+# app/engine/grammar.py
+import json
+import os
+from functools import lru_cache
+
+# Output allowance per free-text string field when a budget is derived from a schema
+SCHEMA_STRING_TOKENS = int(os.getenv("LLM_SCHEMA_STRING_TOKENS", "256"))
+
+
+@lru_cache(maxsize=16)
+def _cached_gbnf(schema_json: str) -> str:
+    from llama_cpp.llama_grammar import json_schema_to_gbnf
+
+    return json_schema_to_gbnf(schema_json)
+
+
+def grammar_from_schema(schema_json: str, cache: bool = True):
+    """A new LlamaGrammar for every generation, so no parse state is shared between threads.
+
+    Converting the schema is the expensive part; with cache it is done once per schema, which
+    only pays off for schemas that repeat (scenario's, not categorize's per-batch id enum).
+    """
+    from llama_cpp import LlamaGrammar
+    from llama_cpp.llama_grammar import json_schema_to_gbnf
+
+    gbnf = _cached_gbnf(schema_json) if cache else json_schema_to_gbnf(schema_json)
+    return LlamaGrammar.from_string(gbnf, verbose=False)
+
+
+def _skeleton(schema: dict, root: dict):
+    # The structure the grammar forces, with the widest numbers and empty strings
+    if "$ref" in schema:
+        return _skeleton(root["$defs"][schema["$ref"].split("/")[-1]], root)
+    if "anyOf" in schema:
+        return _skeleton(schema["anyOf"][0], root)
+    if "enum" in schema:
+        return max(schema["enum"], key=lambda v: len(json.dumps(v)))
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _skeleton(prop, root) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_skeleton(schema.get("items", {}), root)]
+    if kind == "string":
+        return ""
+    if kind in ("number", "integer"):
+        return -1234567.89
+    return None
+
+
+@lru_cache(maxsize=64)
+def schema_skeleton(schema_json: str) -> tuple:
+    """(skeleton JSON text, number of string fields) for a schema."""
+    skeleton = json.dumps(_skeleton(json.loads(schema_json), json.loads(schema_json)))
+    return skeleton, skeleton.count('""')
+
+
+def schema_token_budget(llm, schema_json: str) -> int:
+    """Output tokens needed for one schema instance: its structure plus an allowance per string."""
+    skeleton, strings = schema_skeleton(schema_json)
+    structure = len(llm.tokenize(skeleton.encode("utf-8"), add_bos=False, special=True))
+    return structure + strings * SCHEMA_STRING_TOKENS
@@ -0,0 +1,77 @@
+# app/engine/prefix_cache.py
+import logging
+import os
+import threading
+
+PREFIX_CACHE_MB = int(os.getenv("LLM_PREFIX_CACHE_MB", "1024"))
+# When set, KV states are persisted here so static prefixes survive restarts
+PREFIX_CACHE_DIR = os.getenv("LLM_PREFIX_CACHE_DIR")
+
+# task -> static prompt prefixes registered by the prompt builders
+_prefixes = {}
+# Guards each Llama's set of prefixes already evaluated into its cache (kept on the Llama itself)
+_warmed_lock = threading.Lock()
+
+
+def register_prefix(task: str, prefix: str):
+    _prefixes.setdefault(task, [])
+    if prefix not in _prefixes[task]:
+        _prefixes[task].append(prefix)
+
+
+def attach_cache(llm, model_path: str, n_ctx: int):
+    from llama_cpp import LlamaRAMCache
+
+    cache = None
+    if PREFIX_CACHE_DIR:
+        try:
+            from llama_cpp import LlamaDiskCache
+            # Token ids are only meaningful for one model, so keep one directory per model/context
+            name = f"{os.path.basename(model_path)}-{n_ctx}"
+            if getattr(llm, "draft_model", None) is not None:
+                # Speculative contexts save logits for every position: a different state layout
+                name += "-speculative"
+            cache = LlamaDiskCache(cache_dir=os.path.join(PREFIX_CACHE_DIR, name))
+        except ImportError:
+            logging.warning("diskcache is not installed, falling back to an in-memory prefix cache")
+
+    if cache is None:
+        cache = LlamaRAMCache(capacity_bytes=PREFIX_CACHE_MB * 1024 * 1024)
+    llm.set_cache(cache)
+
+
+def warm_prefixes(llm, task: str):
+    # Must be called with the model lock held: evaluation mutates the context
+    with _warmed_lock:
+        warmed = getattr(llm, "_warmed_prefixes", None)
+        if warmed is None:
+            warmed = llm._warmed_prefixes = set()
+    for prefix in _prefixes.get(task, []):
+        with _warmed_lock:
+            if prefix in warmed:
+                continue
+        _cache_prefix(llm, prefix)
+        with _warmed_lock:
+            warmed.add(prefix)
+
+
+def _cache_prefix(llm, prefix: str):
+    if llm.cache is None:
+        return
+
+    from llama_cpp import Llama
+
+    tokens = llm.tokenize(prefix.encode("utf-8"), add_bos=True, special=True)
+    try:
+        cached = llm.cache[tokens]
+        if Llama.longest_token_prefix(cached.input_ids.tolist(), tokens) == len(tokens):
+            return
+    except KeyError:
+        pass
+
+    # llama.cpp restores the longest cached prefix of each prompt, so later calls
+    # only evaluate the per-request tail
+    llm.reset()
+    llm.eval(tokens)
+    llm.cache[tokens] = llm.save_state()
+    logging.info(f"Cached KV state for a {len(tokens)}-token static prefix")
@@ -0,0 +1,228 @@
+# app/engine/registry.py
+import itertools
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from app.config.engine_config import (
+    N_BATCH,
+    N_THREADS,
+    TASK_PROFILE_NAMES,
+    TASK_PROFILES,
+    TASK_REPLICAS,
+    OVERRIDE_CACHE_MAX_MODELS,
+    OVERRIDE_CACHE_BUDGET_MB,
+)
+from app.engine.prefix_cache import attach_cache
+from app.engine.speculative import draft_model
+
+# EngineProfile.load_key() -> [Llama, ...] replicas. Task models stay loaded for the process lifetime.
+_models = {}
+# model_path -> vocab-only Llama used for token counting
+_tokenizers = {}
+_round_robin = itertools.count()
+# (model_path, n_ctx) -> (Llama, estimated_bytes), least recently used first
+_overrides = OrderedDict()
+_load_errors = {}
+_lock = threading.Lock()
+# Guards creating a model's lock. A llama.cpp context is not thread-safe, so workers take turns
+# per model; the lock lives on the Llama object, so it exists exactly as long as the context does.
+_model_locks_guard = threading.Lock()
+
+
+def _load(model_path: str, n_ctx: int, speculative: str = "off", n_threads: int = N_THREADS, n_batch: int = N_BATCH):
+    # Imported here so the weights (and llama.cpp itself) are only touched on first use
+    from llama_cpp import Llama
+
+    logging.info(f"Loading model {model_path} (n_ctx={n_ctx}, speculative={speculative}, "
+                 f"n_threads={n_threads}, n_batch={n_batch})")
+    llm = Llama(
+        model_path=model_path,
+        n_ctx=n_ctx,
+        n_threads=n_threads,
+        n_threads_batch=n_threads,
+        n_batch=n_batch,
+        use_mmap=True,
+        draft_model=draft_model(speculative, n_ctx),
+    )
+    attach_cache(llm, model_path, n_ctx)
+    return llm
+
+
+def _estimate_bytes(llm, model_path: str) -> int:
+    # Weights are mmap'd, so count the file once plus this context's KV cache
+    weights = os.path.getsize(model_path)
+    meta = getattr(llm, "metadata", None) or {}
+    arch = meta.get("general.architecture", "llama")
+    try:
+        layers = int(meta[f"{arch}.block_count"])
+        heads = int(meta[f"{arch}.attention.head_count"])
+        kv_heads = int(meta.get(f"{arch}.attention.head_count_kv", heads))
+        embd = int(meta[f"{arch}.embedding_length"])
+        # K and V, f16, per layer, per token
+        kv = 2 * 2 * layers * (embd // heads) * kv_heads * llm.context_params.n_ctx
+    except (KeyError, ValueError, ZeroDivisionError):
+        kv = 0
+    return weights + kv
+
+
+def model_name(llm) -> str:
+    return llm.metadata.get("general.name", "unknown-model")
+
+
+def model_lock(llm) -> threading.Lock:
+    lock = getattr(llm, "_inference_lock", None)
+    if lock is None:
+        with _model_locks_guard:
+            lock = getattr(llm, "_inference_lock", None)
+            if lock is None:
+                lock = llm._inference_lock = threading.Lock()
+    return lock
+
+
+def _task_key(task: str) -> tuple:
+    # Tasks whose profiles load the same way share replicas. Speculative contexts keep logits
+    # for every position, so they are not shared with plain ones.
+    return TASK_PROFILES[task].load_key()
+
+
+def _add_replica(key: tuple, task: str):
+    # Caller holds _lock
+    try:
+        llm = _load(*key)
+    except Exception as e:
+        _load_errors[key] = str(e)
+        logging.error(f"Model failed to load for task '{task}': {str(e)}")
+        raise
+    _load_errors.pop(key, None)
+    _models.setdefault(key, []).append(llm)
+    logging.info(f"Model ready for task '{task}': {model_name(llm)} (replica {len(_models[key])})")
+
+
+def get_llm(task: str):
+    key = _task_key(task)
+
+    replicas = _models.get(key)
+    if replicas:
+        return replicas[0]
+
+    with _lock:
+        if not _models.get(key):
+            _add_replica(key, task)
+        return _models[key][0]
+
+
+@contextmanager
+def checkout(task: str):
+    """Yields a context for task with its lock held.
+
+    When every loaded replica is busy another one is loaded, up to LLM_TASK_REPLICAS;
+    replicas share the mmap'd weights, so each extra one only costs a KV cache.
+    """
+    key = _task_key(task)
+    get_llm(task)
+
+    while True:
+        for llm in list(_models[key]):
+            lock = model_lock(llm)
+            if lock.acquire(blocking=False):
+                try:
+                    yield llm
+                finally:
+                    lock.release()
+                return
+
+        with _lock:
+            if len(_models[key]) < TASK_REPLICAS:
+                _add_replica(key, task)
+                continue
+
+        # Everything is busy and we cannot grow: queue behind one replica
+        replicas = _models[key]
+        llm = replicas[next(_round_robin) % len(replicas)]
+        with model_lock(llm):
+            yield llm
+        return
+
+
+def _load_tokenizer(model_path: str):
+    from llama_cpp import Llama
+
+    return Llama(model_path=model_path, vocab_only=True, verbose=False)
+
+
+def get_tokenizer(task: str):
+    # Vocabulary only: cheap to load and safe to use outside the inference workers
+    model_path = TASK_PROFILES[task].path
+    tokenizer = _tokenizers.get(model_path)
+    if tokenizer is None:
+        with _lock:
+            if model_path not in _tokenizers:
+                _tokenizers[model_path] = _load_tokenizer(model_path)
+            tokenizer = _tokenizers[model_path]
+    return tokenizer
+
+
+def get_override_llm(model_path: str, n_ctx: int):
+    key = (model_path, n_ctx)
+    budget = OVERRIDE_CACHE_BUDGET_MB * 1024 * 1024
+
+    with _lock:
+        if key in _overrides:
+            _overrides.move_to_end(key)
+            return _overrides[key][0]
+
+        # Make room for the weights before loading, then re-check with the KV cache included
+        needed = os.path.getsize(model_path)
+        _evict_overrides(budget - needed, OVERRIDE_CACHE_MAX_MODELS - 1)
+
+        llm = _load(model_path, n_ctx)
+        _overrides[key] = (llm, _estimate_bytes(llm, model_path))
+        _evict_overrides(budget, OVERRIDE_CACHE_MAX_MODELS, keep=key)
+        return llm
+
+
+@contextmanager
+def checkout_override(model_path: str, n_ctx: int):
+    llm = get_override_llm(model_path, n_ctx)
+    with model_lock(llm):
+        yield llm
+
+
+def _evict_overrides(budget: int, max_models: int, keep=None):
+    def used():
+        return sum(size for _, size in _overrides.values())
+
+    for key in list(_overrides.keys()):
+        if len(_overrides) <= max_models and used() <= budget:
+            break
+        if key == keep:
+            continue
+        # In-flight requests keep their reference (and its lock); the model is freed once they finish
+        _overrides.pop(key)
+        logging.info(f"Evicted override model {key[0]} (n_ctx={key[1]})")
+
+
+def status() -> dict:
+    return {
+        "tasks": {
+            task: {"profile": TASK_PROFILE_NAMES[task], "model_path": profile.path,
+                   "quantization": profile.quantization, **profile.sampling()}
+            for task, profile in TASK_PROFILES.items()
+        },
+        "loaded": [
+            {"model_path": path, "n_ctx": n_ctx, "speculative": speculative, "n_threads": n_threads,
+             "n_batch": n_batch, "model": model_name(replicas[0]), "replicas": len(replicas)}
+            for (path, n_ctx, speculative, n_threads, n_batch), replicas in _models.items()
+        ],
+        "overrides": [
+            {"model_path": path, "n_ctx": n_ctx, "estimated_mb": size // (1024 * 1024)}
+            for (path, n_ctx), (_, size) in _overrides.items()
+        ],
+        "errors": [
+            {"model_path": path, "n_ctx": n_ctx, "error": error}
+            for (path, n_ctx, *_), error in _load_errors.items()
+        ],
+    }
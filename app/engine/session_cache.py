@@ -0,0 +1,236 @@
+# app/engine/session_cache.py
+#
+# llama.cpp state snapshots per conversation session. A follow-up turn resends nearly the
+# same transaction context, so restoring the previous turn's state leaves only the tokens
+# after the shared history to evaluate.
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from app import metrics
+
+SESSION_CACHE_MB = int(os.getenv("LLM_SESSION_CACHE_MB", "2048"))
+# When set, states evicted from memory are written here (one subdirectory per process)
+SESSION_SPILL_DIR = os.getenv("LLM_SESSION_SPILL_DIR")
+SESSION_SPILL_MB = int(os.getenv("LLM_SESSION_SPILL_MB", "16384"))
+SESSION_IDLE_SECONDS = float(os.getenv("LLM_SESSION_IDLE_SECONDS", "900"))
+# Restoring a state costs a copy of it; a short shared history is cheaper to evaluate again
+SESSION_MIN_REUSE_TOKENS = int(os.getenv("LLM_SESSION_MIN_REUSE_TOKENS", "128"))
+
+
+def _common_prefix(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def _state_bytes(state) -> int:
+    # The KV cells plus, for contexts that keep logits for every position, the logits
+    scores = getattr(state, "scores", None)
+    return state.llama_state_size + (scores.nbytes if scores is not None else 0)
+
+
+def _model_key(llm) -> tuple:
+    # A state only loads into a context of the same model, size and layout
+    return (llm.model_path, llm.n_ctx(), getattr(llm, "draft_model", None) is not None)
+
+
+class SessionStateCache:
+    """Least recently used states in memory up to capacity_bytes, then on disk up to spill_bytes.
+
+    Entries not used for idle_seconds are dropped from both.
+    """
+
+    def __init__(self, capacity_bytes: int = SESSION_CACHE_MB * 1024 * 1024, spill_dir: str = SESSION_SPILL_DIR,
+                 spill_bytes: int = SESSION_SPILL_MB * 1024 * 1024, idle_seconds: float = SESSION_IDLE_SECONDS):
+        self._capacity_bytes = capacity_bytes
+        self._spill_bytes = spill_bytes
+        self._idle_seconds = idle_seconds
+        # key -> (state, bytes, last_used) / (path, bytes, last_used), least recently used first
+        self._ram = OrderedDict()
+        self._disk = OrderedDict()
+        self._ram_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._spill_dir = None
+        if spill_dir:
+            # Spilled states are only indexed in this process's memory: anything left by a
+            # previous process with this pid is unreachable
+            self._spill_dir = os.path.join(spill_dir, f"sessions-{os.getpid()}")
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            os.makedirs(self._spill_dir, exist_ok=True)
+
+    def get(self, key: tuple):
+        with self._lock:
+            self._expire()
+            if key in self._ram:
+                state, size, _ = self._ram.pop(key)
+                self._ram[key] = (state, size, time.monotonic())
+                return state
+            entry = self._disk.pop(key, None)
+            if entry is None:
+                return None
+            self._disk_bytes -= entry[1]
+
+        path = entry[0]
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logging.warning(f"Spilled session state {path} could not be read: {str(e)}")
+            return None
+        finally:
+            _remove(path)
+        self.put(key, state)
+        return state
+
+    def put(self, key: tuple, state):
+        size = _state_bytes(state)
+        evicted = []
+        with self._lock:
+            self._discard(key)
+            self._ram[key] = (state, size, time.monotonic())
+            self._ram_bytes += size
+            while self._ram_bytes > self._capacity_bytes and self._ram:
+                old_key, (old_state, old_size, last_used) = self._ram.popitem(last=False)
+                self._ram_bytes -= old_size
+                evicted.append((old_key, old_state, old_size, last_used))
+        # Pickling a state takes a while: not under the lock
+        for entry in evicted:
+            self._spill(*entry)
+
+    def expire(self):
+        with self._lock:
+            self._expire()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions_in_memory": len(self._ram), "memory_mb": self._ram_bytes // (1024 * 1024),
+                    "sessions_on_disk": len(self._disk), "disk_mb": self._disk_bytes // (1024 * 1024)}
+
+    def _spill(self, key: tuple, state, size: int, last_used: float):
+        if self._spill_dir is None or size > self._spill_bytes:
+            return
+        name = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        path = os.path.join(self._spill_dir, f"{name}.state")
+        try:
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logging.warning(f"Session state could not be spilled to {path}: {str(e)}")
+            _remove(path + ".tmp")
+            return
+
+        with self._lock:
+            if key in self._ram:
+                # Used again while it was being written: the newer state in memory wins
+                _remove(path)
+                return
+            self._disk[key] = (path, size, last_used)
+            self._disk_bytes += size
+            while self._disk_bytes > self._spill_bytes and self._disk:
+                _, (old_path, old_size, _) = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                _remove(old_path)
+
+    def _discard(self, key: tuple):
+        # Caller holds _lock
+        if key in self._ram:
+            self._ram_bytes -= self._ram.pop(key)[1]
+        if key in self._disk:
+            path, size, _ = self._disk.pop(key)
+            self._disk_bytes -= size
+            _remove(path)
+
+    def _expire(self):
+        # Caller holds _lock
+        cutoff = time.monotonic() - self._idle_seconds
+        for entries in (self._ram, self._disk):
+            for key in [key for key, entry in entries.items() if entry[2] < cutoff]:
+                self._discard(key)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def restore_session(llm, session_id: str, tokens: list) -> int:
+    """Loads the session's last state into llm if that saves evaluating part of tokens.
+
+    Must be called with the model lock held. Returns how many leading tokens need no evaluation.
+    """
+    current = _common_prefix(llm.input_ids, tokens)
+    state = get_session_cache().get((session_id, *_model_key(llm)))
+    if state is None:
+        metrics.session_state_lookup("miss", current)
+        return current
+
+    shared = _common_prefix(state.input_ids, tokens)
+    if shared <= current or shared < SESSION_MIN_REUSE_TOKENS:
+        # This context still holds the previous turn (or as much of the prompt) anyway
+        metrics.session_state_lookup("resident" if current >= shared else "skipped", current)
+        return current
+
+    llm.load_state(state)
+    metrics.session_state_lookup("restored", shared)
+    return shared
+
+
+def save_session(llm, session_id: str):
+    # Prompt and completion: the next turn's prompt usually diverges before the completion
+    get_session_cache().put((session_id, *_model_key(llm)), _current_state(llm))
+
+
+def _current_state(llm):
+    """llm's state, shared with its in-memory prefix cache when that has just saved the same one.
+
+    llama.cpp saves every completion that runs to its end into llm.cache, so otherwise such a
+    turn would copy the whole state twice. A disk prefix cache still means a second copy.
+    """
+    cache = getattr(llm, "cache", None)
+    if cache is not None:
+        from llama_cpp import LlamaRAMCache
+
+        if isinstance(cache, LlamaRAMCache):
+            tokens = list(llm.input_ids)
+            try:
+                state = cache[tokens]
+            except KeyError:
+                state = None
+            if state is not None and state.n_tokens == len(tokens) and list(state.input_ids) == tokens:
+                return state
+    return llm.save_state()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _sweep(cache: SessionStateCache):
+    # Idle sessions give their memory back even when no request comes along to notice
+    while True:
+        time.sleep(max(1.0, SESSION_IDLE_SECONDS / 4))
+        cache.expire()
+
+
+def get_session_cache() -> SessionStateCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                cache = SessionStateCache()
+                threading.Thread(target=_sweep, args=(cache,), name="session-state-sweeper", daemon=True).start()
+                _cache = cache
+    return _cache
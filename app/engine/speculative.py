@@ -0,0 +1,64 @@
+# app/engine/speculative.py
+import logging
+
+from app.config.engine_config import (
+    DRAFT_MODEL_PATH,
+    DRAFT_TOKENS,
+    N_THREADS,
+    PROMPT_LOOKUP_NGRAM,
+    PROMPT_LOOKUP_TOKENS,
+)
+
+SPECULATIVE_MODES = ("off", "prompt-lookup", "draft")
+
+
+class GGUFDraftModel:
+    """Proposes the next tokens by greedy decoding with a small model of the same vocabulary.
+
+    Implements llama.cpp's draft model interface: called with every token so far, returns
+    the guessed continuation. Each main-model context gets its own draft context, used
+    under the main context's lock.
+    """
+
+    def __init__(self, llm, num_pred_tokens: int = DRAFT_TOKENS):
+        self._llm = llm
+        self._num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, **kwargs):
+        import numpy as np
+
+        draft = []
+        # reset=True still reuses the KV state of the longest common prefix
+        for token in self._llm.generate(input_ids.tolist(), top_k=1, temp=0.0, reset=True):
+            draft.append(token)
+            if len(draft) >= self._num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+
+def draft_model(mode: str, n_ctx: int):
+    """The llama.cpp draft_model for a speculative mode, or None when it is off."""
+    if mode not in SPECULATIVE_MODES:
+        raise ValueError(f"Unknown speculative mode '{mode}', expected one of {', '.join(SPECULATIVE_MODES)}")
+    if mode == "off":
+        return None
+
+    if mode == "prompt-lookup":
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+        return LlamaPromptLookupDecoding(max_ngram_size=PROMPT_LOOKUP_NGRAM, num_pred_tokens=PROMPT_LOOKUP_TOKENS)
+
+    if not DRAFT_MODEL_PATH:
+        raise ValueError("Speculative mode 'draft' needs LLM_DRAFT_MODEL_PATH")
+    from llama_cpp import Llama
+
+    logging.info(f"Loading draft model {DRAFT_MODEL_PATH} (n_ctx={n_ctx})")
+    draft = Llama(
+        model_path=DRAFT_MODEL_PATH,
+        n_ctx=n_ctx,
+        n_threads=N_THREADS,
+        n_threads_batch=N_THREADS,
+        use_mmap=True,
+        verbose=False,
+    )
+    return GGUFDraftModel(draft)
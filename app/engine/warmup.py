@@ -0,0 +1,54 @@
+# app/engine/warmup.py
+import asyncio
+import logging
+import time
+
+from app.config.engine_config import WARMUP_TASKS, WARMUP_GENERATION, WARMUP_MAX_TOKENS
+from app.engine.registry import checkout
+from app.engine.prefix_cache import warm_prefixes
+from app.engine.executor import get_executor
+
+# starting -> ready | failed, then stopping on shutdown
+_state = {"status": "starting", "tasks": {task: "pending" for task in WARMUP_TASKS}, "error": None}
+
+
+def _warm_task(task: str):
+    with checkout(task) as llm:
+        warm_prefixes(llm, task)
+        if WARMUP_GENERATION:
+            llm("Hello", max_tokens=WARMUP_MAX_TOKENS)
+
+
+async def load_engines():
+    """Loads and warms every task's model off the event loop; run as a background task."""
+    started = time.perf_counter()
+    for task in WARMUP_TASKS:
+        _state["tasks"][task] = "loading"
+        task_started = time.perf_counter()
+        try:
+            # Once here, or once in every worker process
+            await asyncio.to_thread(get_executor().broadcast, _warm_task, task)
+        except Exception as e:
+            _state["tasks"][task] = "failed"
+            _state["status"] = "failed"
+            _state["error"] = f"{task}: {str(e)}"
+            logging.error(f"Inference engine for '{task}' failed to load: {str(e)}")
+            return
+        _state["tasks"][task] = "ready"
+        logging.info(f"Inference engine for '{task}' ready in {time.perf_counter() - task_started:.1f}s")
+
+    _state["status"] = "ready"
+    logging.info(f"All inference engines ready in {time.perf_counter() - started:.1f}s")
+
+
+def is_ready() -> bool:
+    return _state["status"] == "ready"
+
+
+def mark_stopping():
+    # Load balancers stop routing here while in-flight requests drain
+    _state["status"] = "stopping"
+
+
+def status() -> dict:
+    return {"status": _state["status"], "tasks": dict(_state["tasks"]), "error": _state["error"]}
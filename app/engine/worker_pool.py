@@ -0,0 +1,405 @@
+# app/engine/worker_pool.py
+#
+# Inference worker processes, each pinned to its own slice of cores, serving the API
+# processes over Unix sockets. Every worker mmaps the same GGUF read-only, so the
+# weights sit in the page cache once however many workers (and contexts) there are.
+#
+#   LLM_WORKER_PROCESSES=4 python -m app.engine.worker_pool [--cores 0-31]
+#
+# Start the API with the same LLM_WORKER_PROCESSES and LLM_WORKER_SOCKET_DIR and its
+# executor sends jobs here instead of running llama.cpp itself. Jobs and results are pickles,
+# so the socket directory must be private to this user and connections are authenticated.
+#
+# Only the standard library is imported at module level: a worker sets its thread
+# count before anything reads app.config.engine_config.
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import stat
+import sys
+import threading
+import time
+import zlib
+from multiprocessing.connection import Client, Listener
+
+WORKER_PROCESSES = int(os.getenv("LLM_WORKER_PROCESSES", "0"))
+WORKER_SOCKET_DIR = os.getenv("LLM_WORKER_SOCKET_DIR") or os.path.join(
+    os.getenv("XDG_RUNTIME_DIR") or os.path.expanduser("~/.cache"), "server-d-inference")
+# Unset: the supervisor generates a key and leaves it in the socket directory for the API
+WORKER_AUTHKEY = os.getenv("LLM_WORKER_AUTHKEY")
+# How long the API waits for a worker socket to appear before failing a job
+WORKER_CONNECT_TIMEOUT = float(os.getenv("LLM_WORKER_CONNECT_TIMEOUT", "120"))
+# How often a waiting API thread checks whether its request was cancelled
+CANCEL_POLL_SECONDS = 0.05
+
+
+def socket_path(index: int, socket_dir: str = WORKER_SOCKET_DIR) -> str:
+    return os.path.join(socket_dir, f"worker-{index}.sock")
+
+
+def authkey_path(socket_dir: str) -> str:
+    return os.path.join(socket_dir, "authkey")
+
+
+def check_socket_dir(socket_dir: str):
+    """Refuses a socket directory another user could reach: whoever can, can run code in the workers."""
+    st = os.lstat(socket_dir)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) != 0o700:
+        raise RuntimeError(f"Worker socket directory {socket_dir} must be a directory owned by uid "
+                           f"{os.getuid()} with mode 0700")
+
+
+def read_authkey(socket_dir: str) -> bytes:
+    if WORKER_AUTHKEY:
+        return WORKER_AUTHKEY.encode("utf-8")
+    with open(authkey_path(socket_dir), "rb") as f:
+        return f.read()
+
+
+def write_authkey(socket_dir: str) -> bytes:
+    if WORKER_AUTHKEY:
+        return WORKER_AUTHKEY.encode("utf-8")
+    key = secrets.token_bytes(32)
+    path = authkey_path(socket_dir)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def parse_cores(spec: str) -> list:
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cores = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            low, high = part.split("-")
+            cores.extend(range(int(low), int(high) + 1))
+        elif part:
+            cores.append(int(part))
+    return sorted(set(cores))
+
+
+def available_cores() -> list:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(cores: list, workers: int) -> list:
+    """Contiguous, near-equal slices so each worker keeps to neighbouring cores."""
+    workers = max(1, min(workers, len(cores)))
+    size, extra = divmod(len(cores), workers)
+    slices, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+# --- worker process ---------------------------------------------------------
+
+def _connection_cancel_token(conn, job_id: int, deadline: float):
+    # Imported here, after the worker has set LLM_N_THREADS
+    from app.engine.cancellation import CancelToken
+
+    class ConnectionCancelToken(CancelToken):
+        """Also cancelled by a ("cancel", job_id, reason) from the API side, read between tokens."""
+
+        def cancelled(self) -> bool:
+            while not self._event.is_set() and conn.poll():
+                message = conn.recv()
+                if message[0] == "cancel" and message[1] == job_id:
+                    self.cancel(message[2])
+            return super().cancelled()
+
+    return ConnectionCancelToken(deadline)
+
+
+def _serve_connection(conn):
+    from app import metrics
+    from app.engine.generation import current_job
+
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == "cancel":
+                # Arrived after the job it was meant for had already ended
+                continue
+
+            kind, job_id, fn, args, kwargs, queue_wait, deadline = message
+            current_job.queue_wait = queue_wait
+            current_job.cancel = cancel = _connection_cancel_token(conn, job_id, deadline)
+            with metrics.capture() as observations:
+                try:
+                    if kind == "call":
+                        reply = ("result", fn(*args, **kwargs))
+                    else:
+                        gen = fn(*args, **kwargs)
+                        try:
+                            for item in gen:
+                                conn.send(("item", item))
+                                # The API side stopped listening: stop generating between tokens
+                                if cancel.cancelled():
+                                    break
+                        finally:
+                            gen.close()
+                        reply = ("end", None)
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    reply = ("error", e)
+
+            try:
+                # Recorded by the API process, whose /metrics is the one scraped
+                if observations:
+                    conn.send(("metrics", observations))
+                try:
+                    conn.send(reply)
+                except Exception:
+                    if reply[0] != "error":
+                        raise
+                    # Not every exception pickles
+                    conn.send(("error", RuntimeError(f"{type(reply[1]).__name__}: {str(reply[1])}")))
+            except (EOFError, OSError):
+                return
+
+
+def _worker_main(index: int, cores: list, path: str, authkey: bytes):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    # One llama.cpp thread per core this worker owns
+    os.environ["LLM_N_THREADS"] = str(len(cores))
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s - worker-{index} - %(levelname)s - %(message)s")
+
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = Listener(path, family="AF_UNIX", authkey=authkey)
+    logging.info(f"Inference worker {index} listening on {path} (cores {cores[0]}-{cores[-1]})")
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            # A client that fails the handshake must not take the worker down
+            logging.warning(f"Rejected connection: {str(e)}")
+            continue
+        threading.Thread(target=_serve_connection, args=(conn,), daemon=True).start()
+
+
+# --- API side ---------------------------------------------------------------
+
+class RemoteBackend:
+    """Runs executor jobs in the worker processes. Each executor thread keeps its own connections.
+
+    A thread sends jobs to its own worker, except jobs with an affinity key: those always go to
+    the worker the key hashes to.
+    """
+
+    def __init__(self, workers: int = WORKER_PROCESSES, socket_dir: str = WORKER_SOCKET_DIR,
+                 authkey: bytes = None, connect_timeout: float = WORKER_CONNECT_TIMEOUT):
+        self._paths = [socket_path(i, socket_dir) for i in range(workers)]
+        self._socket_dir = socket_dir
+        self._authkey = authkey
+        self._connect_timeout = connect_timeout
+        self._local = threading.local()
+        self._next = 0
+        self._next_lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+
+    def _connect(self, path: str):
+        deadline = time.monotonic() + self._connect_timeout
+        while True:
+            try:
+                # Workers' replies are unpickled here: never talk to a socket someone else could have put there
+                check_socket_dir(self._socket_dir)
+                authkey = self._authkey or read_authkey(self._socket_dir)
+                return Client(path, family="AF_UNIX", authkey=authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The supervisor or the worker is still starting, or restarting after a crash
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _path(self) -> str:
+        from app.engine.generation import current_job
+
+        affinity = getattr(current_job, "affinity", None)
+        if affinity is not None:
+            # crc32, not hash(): every API process must pick the same worker
+            return self._paths[zlib.crc32(affinity.encode("utf-8")) % len(self._paths)]
+        path = getattr(self._local, "home", None)
+        if path is None:
+            # Spread executor threads over the workers
+            with self._next_lock:
+                path = self._local.home = self._paths[self._next % len(self._paths)]
+                self._next += 1
+        return path
+
+    def _connections(self) -> dict:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        return conns
+
+    def _connection(self):
+        path = self._path()
+        conns = self._connections()
+        if path not in conns:
+            conns[path] = self._connect(path)
+        return conns[path]
+
+    def _drop_connection(self, conn):
+        conns = self._connections()
+        for path in [path for path, c in conns.items() if c is conn]:
+            del conns[path]
+        conn.close()
+
+    def _send(self, kind: str, fn, args, kwargs):
+        from app.engine.generation import current_job
+
+        cancel = getattr(current_job, "cancel", None)
+        job_id = next(self._job_ids)
+        conn = self._connection()
+        try:
+            conn.send((kind, job_id, fn, args, kwargs, getattr(current_job, "queue_wait", 0.0),
+                       cancel.deadline if cancel is not None else None))
+        except (EOFError, OSError):
+            self._drop_connection(conn)
+            raise
+        return conn, job_id, cancel
+
+    def _receive(self, conn):
+        from app import metrics
+
+        while True:
+            try:
+                kind, value = conn.recv()
+            except (EOFError, OSError):
+                # The worker died mid-job; the next job reconnects
+                self._drop_connection(conn)
+                raise RuntimeError("Inference worker connection lost")
+            if kind != "metrics":
+                return kind, value
+            metrics.replay(value)
+
+    def _send_cancel(self, conn, job_id: int, reason: str):
+        try:
+            conn.send(("cancel", job_id, reason))
+        except (EOFError, OSError):
+            self._drop_connection(conn)
+
+    def call(self, fn, args, kwargs):
+        conn, job_id, cancel = self._send("call", fn, args, kwargs)
+        if cancel is not None:
+            # Relay a disconnect while the worker generates; it checks between tokens
+            while not conn.poll(CANCEL_POLL_SECONDS):
+                if cancel.cancelled():
+                    self._send_cancel(conn, job_id, cancel.reason)
+                    break
+        kind, value = self._receive(conn)
+        if kind == "error":
+            raise value
+        return value
+
+    def iterate(self, fn, args, kwargs):
+        conn, job_id, cancel = self._send("iter", fn, args, kwargs)
+        finished = False
+        try:
+            while True:
+                kind, value = self._receive(conn)
+                if kind == "item":
+                    yield value
+                elif kind == "end":
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise value
+        finally:
+            if not finished and conn in self._connections().values():
+                # Closed early: tell the worker, then drain so the connection is reusable
+                try:
+                    self._send_cancel(conn, job_id, (cancel and cancel.reason) or "disconnect")
+                    while self._receive(conn)[0] == "item":
+                        pass
+                except Exception:
+                    self._drop_connection(conn)
+
+    def broadcast(self, fn, *args):
+        """Runs fn(*args) once in every worker, e.g. to load and warm its models."""
+        for path in self._paths:
+            with self._connect(path) as conn:
+                conn.send(("call", 0, fn, args, {}, 0.0, None))
+                kind, value = self._receive(conn)
+                if kind == "error":
+                    raise value
+
+
+# --- supervisor -------------------------------------------------------------
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the inference worker processes")
+    parser.add_argument("--workers", type=int, default=WORKER_PROCESSES or 1)
+    parser.add_argument("--cores", help="cores to split between workers, e.g. 0-31 (default: all available)")
+    parser.add_argument("--socket-dir", default=WORKER_SOCKET_DIR)
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - supervisor - %(levelname)s - %(message)s")
+
+    cores = parse_cores(args.cores) if args.cores else available_cores()
+    slices = partition_cores(cores, args.workers)
+    if len(slices) < args.workers:
+        logging.warning(f"Only {len(cores)} cores available, running {len(slices)} workers; "
+                        f"set LLM_WORKER_PROCESSES={len(slices)} for the API too")
+    os.makedirs(args.socket_dir, mode=0o700, exist_ok=True)
+    check_socket_dir(args.socket_dir)
+    authkey = write_authkey(args.socket_dir)
+
+    # Spawned, not forked: workers start clean instead of inheriting this process's threads
+    context = multiprocessing.get_context("spawn")
+
+    def start(index: int):
+        process = context.Process(
+            target=_worker_main,
+            args=(index, slices[index], socket_path(index, args.socket_dir), authkey),
+            name=f"inference-worker-{index}",
+        )
+        process.start()
+        return process
+
+    processes = [start(i) for i in range(len(slices))]
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    while not stopping.wait(1.0):
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                logging.error(f"Worker {i} exited with {process.exitcode}, restarting")
+                processes[i] = start(i)
+
+    for process in processes:
+        process.terminate()
+    for i, process in enumerate(processes):
+        process.join(timeout=10)
+        path = socket_path(i, args.socket_dir)
+        if os.path.exists(path):
+            os.unlink(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,94 @@
 # app/main.py
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import logging
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from dotenv import load_dotenv
 
+# Load environment variables before any module reads its config at import time
+load_dotenv()
+
 # Import routers
 from app.routers.llm_router import router as llm_router
 #from app.routers.scenario_router import router as scenario_router
-from app.routers import scenario, categorize, feedback
+from app.routers import scenario, categorize, feedback, jobs
+from app.engine.executor import QueueFullError
+from app.engine.cancellation import GenerationCancelled
+from app.engine import warmup
+from app.db.pool import init_pool, close_pool
+from app.db.log_writer import get_log_writer
+from app.services.category_index import get_category_index
+from app.services.categorization_jobs import get_job_worker, JOBS_ENABLED
+from app import metrics
 
-# Load environment variables
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pool's minimum connections before serving; statements are prepared on first use
+    try:
+        await init_pool()
+    except Exception as e:
+        logging.error(f"DB pool could not be created at startup, will retry on first use: {str(e)}")
+    get_log_writer().start()
+    get_category_index().start()
+    if JOBS_ENABLED:
+        get_job_worker().start()
+    # Models load after the port opens; /health/ready stays 503 until they are warm
+    loading = asyncio.create_task(warmup.load_engines())
+    yield
+    warmup.mark_stopping()
+    loading.cancel()
+    with suppress(asyncio.CancelledError):
+        await loading
+    await get_job_worker().stop()
+    await get_category_index().stop()
+    await get_log_writer().stop()
+    await close_pool()
 
 # Create FastAPI app
-app = FastAPI(title="Financial Assistant Engine", version="1.0")
+app = FastAPI(title="Financial Assistant Engine", version="1.0", lifespan=lifespan)
 
 # Register routers with appropriate prefixes
 app.include_router(llm_router, tags=["LLM Inference"])
 app.include_router(scenario.router, prefix="/scenario", tags=["Scenario Simulation"])
 app.include_router(categorize.router, prefix="/categorize", tags=["Transaction Categorization"])
 app.include_router(feedback.router, prefix="/feedback", tags=["User Feedback"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Categorization Jobs"])
 
-@app.get("/health")
-async def health_check():
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Inference queue is full, retry later."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(GenerationCancelled)
+async def generation_cancelled_handler(request: Request, exc: GenerationCancelled):
+    # 499: nginx's "client closed request"; nobody reads it, but it shows up in access logs
+    if exc.reason == "disconnect":
+        return JSONResponse(status_code=499, content={"error": "Client closed request."})
+    return JSONResponse(status_code=504, content={"error": "Request deadline exceeded."})
+
+@app.get("/health/live")
+async def liveness():
+    # Slow model loads are fine; a load that failed will not recover without a restart
+    if warmup.status()["status"] == "failed":
+        return JSONResponse(status_code=503, content={"status": "failed"})
     return {"status": "ok"}
 
+@app.get("/health/ready")
+async def readiness():
+    engines = warmup.status()
+    return JSONResponse(status_code=200 if warmup.is_ready() else 503, content=engines)
+
+@app.get("/health")
+async def health_check():
+    return await readiness()
 
-for route in app.routes:
-    print(f" Registered route: {route.path}")
\ No newline at end of file
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
@@ -0,0 +1,151 @@
+# app/metrics.py
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+LABELS = ["endpoint", "model"]
+
+QUEUE_WAIT_SECONDS = Histogram(
+    "llm_queue_wait_seconds", "Time a request waited for an inference worker", LABELS, buckets=LATENCY_BUCKETS
+)
+PROMPT_EVAL_SECONDS = Histogram(
+    "llm_prompt_eval_seconds", "Time to evaluate the prompt (until the first token)", LABELS, buckets=LATENCY_BUCKETS
+)
+GENERATION_SECONDS = Histogram(
+    "llm_generation_seconds", "Time spent generating after the first token", LABELS, buckets=LATENCY_BUCKETS
+)
+TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second", "Completion tokens per second of generation time", LABELS, buckets=RATE_BUCKETS
+)
+PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens", "Prompt length in tokens", LABELS, buckets=TOKEN_BUCKETS
+)
+COMPLETION_TOKENS = Histogram(
+    "llm_completion_tokens", "Completion length in tokens", LABELS, buckets=TOKEN_BUCKETS
+)
+JSON_PARSE_FAILURES = Counter(
+    "llm_json_parse_failures_total", "Model outputs that could not be parsed as the expected JSON", LABELS
+)
+CANCELLATIONS = Counter(
+    "llm_cancellations_total", "Generations abandoned on a client disconnect or deadline",
+    ["endpoint", "reason", "stage"]
+)
+SESSION_STATE_LOOKUPS = Counter(
+    "llm_session_state_lookups_total", "Session KV state lookups before a generation", ["result"]
+)
+SESSION_REUSED_TOKENS = Histogram(
+    "llm_session_reused_tokens", "Prompt tokens a session turn did not have to evaluate", buckets=TOKEN_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Database statement latency", ["statement"], buckets=DB_BUCKETS
+)
+
+# Inference worker processes (see worker_pool) capture these observations instead of recording
+# them, and send them back with the job's result for the API process to record
+_capture = threading.local()
+_relayed = {}
+
+
+def relayed(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        observations = getattr(_capture, "observations", None)
+        if observations is not None:
+            observations.append((fn.__name__, args, kwargs))
+            return
+        fn(*args, **kwargs)
+
+    _relayed[fn.__name__] = fn
+    return wrapper
+
+
+@contextmanager
+def capture():
+    _capture.observations = observations = []
+    try:
+        yield observations
+    finally:
+        _capture.observations = None
+
+
+def replay(observations: list):
+    for name, args, kwargs in observations:
+        _relayed[name](*args, **kwargs)
+
+
+@relayed
+def observe_inference(endpoint: str, model: str, queue_wait: float, prompt_eval: float,
+                      generation: float, prompt_tokens: int, completion_tokens: int):
+    QUEUE_WAIT_SECONDS.labels(endpoint, model).observe(queue_wait)
+    PROMPT_EVAL_SECONDS.labels(endpoint, model).observe(prompt_eval)
+    GENERATION_SECONDS.labels(endpoint, model).observe(generation)
+    PROMPT_TOKENS.labels(endpoint, model).observe(prompt_tokens)
+    COMPLETION_TOKENS.labels(endpoint, model).observe(completion_tokens)
+    if generation > 0 and completion_tokens > 1:
+        # The first token is part of prompt evaluation
+        TOKENS_PER_SECOND.labels(endpoint, model).observe((completion_tokens - 1) / generation)
+
+
+@relayed
+def json_parse_failed(endpoint: str, model: str):
+    JSON_PARSE_FAILURES.labels(endpoint, model).inc()
+
+
+@relayed
+def generation_cancelled(endpoint: str, reason: str, stage: str):
+    # stage: "queued" (never started) or "generating" (stopped between tokens)
+    CANCELLATIONS.labels(endpoint, reason, stage).inc()
+
+
+@relayed
+def session_state_lookup(result: str, reused_tokens: int):
+    # result: "restored", "resident" (the context already held it), "skipped" (too short) or "miss"
+    SESSION_STATE_LOOKUPS.labels(result).inc()
+    SESSION_REUSED_TOKENS.observe(reused_tokens)
+
+
+class time_db:
+    """Times a DB call: `with time_db("name"):` or `async with pool.acquire() as conn, time_db("name"):`"""
+
+    def __init__(self, statement: str):
+        self._statement = statement
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        DB_QUERY_SECONDS.labels(self._statement).observe(time.perf_counter() - self._start)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+def render() -> tuple:
+    # With several uvicorn workers, PROMETHEUS_MULTIPROC_DIR makes every process report into one view
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,20 +1,26 @@
 #app/routers/categorize.py
 
-from fastapi import APIRouter, Body
+from fastapi import APIRouter, Body, Request
 from typing import List
 from app.schemas import TransactionUpdate, CategorizeResponse
 from app.services.categorize import categorize_transactions
+from app.engine.cancellation import request_cancellation
 
 router = APIRouter()
 
 @router.post("/", response_model=CategorizeResponse)
-async def categorize_route(transactions: List[TransactionUpdate] = Body(...)):
-    categorized = await categorize_transactions([tx.dict() for tx in transactions])
+async def categorize_route(request: Request, transactions: List[TransactionUpdate] = Body(...)):
+    async with request_cancellation(request, "categorize"):
+        result = await categorize_transactions([tx.dict() for tx in transactions])
+    categorized = result["transactions"]
     low_conf = sum(1 for tx in categorized if tx["needs_review"])
     return CategorizeResponse(
         status="success",
         transactions=categorized,
-        low_confidence_count=low_conf
+        low_confidence_count=low_conf,
+        cache_hits=result["cache_hits"],
+        cache_misses=result["cache_misses"],
+        knn_hits=result["knn_hits"]
     )
 
 @router.get("/health")
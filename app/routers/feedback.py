@@ -1,9 +1,19 @@
 from fastapi import APIRouter, HTTPException
-from app.schemas import FeedbackRequest, FeedbackResponse
-from app.db.pool import get_pool
+import os
+from app.schemas import (
+    FeedbackRequest,
+    FeedbackResponse,
+    CategoryFeedbackRequest,
+    FeedbackBatchRequest,
+    FeedbackBatchResponse,
+)
+from app.services.categorize import VALID_CATEGORIES
+from app.services.feedback import submit_feedback, submit_feedback_batch, submit_category_feedback
 
 router = APIRouter()
 
+FEEDBACK_BATCH_MAX_ITEMS = int(os.getenv("FEEDBACK_BATCH_MAX_ITEMS", "1000"))
+
 @router.get("/health")
 async def health_check():
     return {"status": "ok"}
@@ -15,20 +25,34 @@ async def ping():
 
 
 @router.post("/", response_model=FeedbackResponse)
-async def submit_feedback(payload: FeedbackRequest):
-    pool = await get_pool()
+async def submit_feedback_route(payload: FeedbackRequest):
+    if not await submit_feedback(payload):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    return FeedbackResponse(status="success", message="Feedback submitted")
+
+
+@router.post("/batch", response_model=FeedbackBatchResponse)
+async def submit_feedback_batch_route(payload: FeedbackBatchRequest):
+    if len(payload.items) > FEEDBACK_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {FEEDBACK_BATCH_MAX_ITEMS} items per batch")
+    if not payload.items:
+        return FeedbackBatchResponse(status="success", accepted=0, rejected=0, items=[])
 
-    async with pool.acquire() as conn:
-        convo = await conn.fetchrow("""
-            SELECT id FROM conversation_logs WHERE id = $1 AND user_id = $2
-        """, payload.conversation_id, payload.user_id)
+    statuses = await submit_feedback_batch(payload.items)
+    accepted = sum(1 for item in statuses if item.status == "success")
+    return FeedbackBatchResponse(
+        status="success" if accepted == len(statuses) else "partial",
+        accepted=accepted,
+        rejected=len(statuses) - accepted,
+        items=statuses
+    )
 
-        if not convo:
-            raise HTTPException(status_code=404, detail="Conversation not found")
 
-        await conn.execute("""
-            INSERT INTO conversation_feedback (user_id, conversation_id, feedback_text, rating)
-            VALUES ($1, $2, $3, $4)
-        """, payload.user_id, payload.conversation_id, payload.feedback_text, payload.rating)
+@router.post("/category", response_model=FeedbackResponse)
+async def submit_category_correction(payload: CategoryFeedbackRequest):
+    if payload.category not in VALID_CATEGORIES:
+        raise HTTPException(status_code=400, detail=f"Category must be one of: {', '.join(sorted(VALID_CATEGORIES))}")
 
-    return FeedbackResponse(status="success", message="Feedback submitted")
\ No newline at end of file
+    await submit_category_feedback(payload)
+    return FeedbackResponse(status="success", message="Category correction recorded")
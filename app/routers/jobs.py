@@ -0,0 +1,59 @@
+from fastapi import APIRouter, HTTPException
+from app.schemas import CategorizationJobRequest, CategorizationJob
+from app.services.categorization_jobs import create_job, get_job, cancel_job, resume_job
+
+router = APIRouter()
+
+def _job_response(job: dict) -> CategorizationJob:
+    progress = job["processed"] / job["total"] if job["total"] else None
+    if job["status"] == "done":
+        progress = 1.0
+    return CategorizationJob(**job, progress=progress)
+
+@router.get("/health")
+async def health_check():
+    return {"status": "ok"}
+
+@router.get("/")
+async def ping():
+    return {"status": "jobs router active"}
+
+
+@router.post("/categorize", response_model=CategorizationJob, status_code=202)
+async def submit_categorization_job(payload: CategorizationJobRequest):
+    # A job over every user's whole history has to be asked for explicitly by date
+    if payload.user_id is None and payload.date_from is None and payload.date_to is None:
+        raise HTTPException(status_code=400, detail="Give a user_id, a date range, or both")
+    if payload.date_from and payload.date_to and payload.date_from > payload.date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+
+    job = await create_job(payload.user_id, payload.date_from, payload.date_to)
+    return _job_response(job)
+
+
+@router.get("/{job_id}", response_model=CategorizationJob)
+async def get_categorization_job(job_id: int):
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
+
+
+@router.post("/{job_id}/cancel", response_model=CategorizationJob)
+async def cancel_categorization_job(job_id: int):
+    job = await cancel_job(job_id)
+    if job is None:
+        if await get_job(job_id) is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail="Job already finished")
+    return _job_response(job)
+
+
+@router.post("/{job_id}/resume", response_model=CategorizationJob)
+async def resume_categorization_job(job_id: int):
+    job = await resume_job(job_id)
+    if job is None:
+        if await get_job(job_id) is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail="Only failed or cancelled jobs can be resumed")
+    return _job_response(job)
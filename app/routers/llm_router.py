@@ -1,13 +1,20 @@
 
 
 from fastapi import APIRouter, Request, Query
-from fastapi.responses import JSONResponse
-from llama_cpp import Llama
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 import os
 import time
 import logging
 
+from app.config.engine_config import TASK_PROFILES
+from app.engine import registry
+from app.engine.executor import get_executor, QueueFullError
+from app.engine.cancellation import GenerationCancelled, request_cancellation
+from app.engine.prefix_cache import register_prefix, warm_prefixes
+from app.engine.generation import InferenceRequest, complete, generate_tokens
+from app.services.sse import sse_event
+
 load_dotenv()
 router = APIRouter(prefix="/llm", tags=["LLM Inference"])
 
@@ -17,34 +24,17 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Environment config
-DEFAULT_MODEL_PATH = os.getenv(
-    "LLM_MODEL_PATH",
-    "/home/ubuntu/server-d-llm-inference/models/mistral-7b-instruct-v0.2.Q5_K_M.gguf"
-)
-DEFAULT_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "32768"))
-
-# Global model instance (lazy-loaded)
-llm = None
-model_name = "unknown-model"
-context_window = DEFAULT_CONTEXT_WINDOW
-
-try:
-    llm = Llama(model_path=DEFAULT_MODEL_PATH, n_ctx=DEFAULT_CONTEXT_WINDOW)
-    model_name = llm.metadata.get("general.name", "unknown-model")
-    context_window = llm.context_params.n_ctx
-    logging.info(f"Model loaded: {model_name} with context window {context_window}")
-except Exception as e:
-    logging.error(f"Model failed to load at startup: {str(e)}")
-    llm = None
+DEFAULT_CONTEXT_WINDOW = TASK_PROFILES["infer"].n_ctx
+INFER_MAX_TOKENS = int(os.getenv("LLM_INFER_MAX_TOKENS", "1024"))
 
 # Health check
 @router.get("/health")
 def health_check():
+    models = registry.status()
     return {
-        "status": "ok" if llm else "model unavailable",
-        "model": model_name,
-        "context_window": context_window,
+        "status": "model unavailable" if models["errors"] else "ok",
+        "models": models,
+        "context_window": DEFAULT_CONTEXT_WINDOW,
         "engine": "llama.cpp"
     }
 
@@ -52,61 +42,102 @@ def health_check():
 async def ping():
     return {"status": "llm router active"}
 
-# Inference route
-@router.post("/infer")
-async def infer_llm(request: Request, model_override: str = Query(None)):
-    start_time = time.time()
-
-    try:
-        data = await request.json()
-        prompt = data.get("prompt", "")
-        caller = data.get("caller", "unknown")
+class ModelLoadError(Exception):
+    pass
 
-        if not prompt:
-            return JSONResponse(status_code=400, content={"error": "No prompt provided."})
 
-        logging.info(f"Inference triggered by: {caller}")
-        logging.info(f"Prompt received: {prompt[:60]}...")
+def _checkout_instance(model_override: str):
+    # Load up front so failures are reported as load errors rather than inference errors
+    try:
+        if model_override:
+            registry.get_override_llm(model_override, DEFAULT_CONTEXT_WINDOW)
+        else:
+            registry.get_llm("infer")
+    except Exception as e:
+        raise ModelLoadError(str(e)) from e
 
-        # Load model (override or fallback)
-        try:
-            llm_instance = Llama(model_path=model_override, n_ctx=DEFAULT_CONTEXT_WINDOW) if model_override else llm
-            if llm_instance is None:
-                raise RuntimeError("Model not initialized")
-        except Exception as e:
-            logging.error(f"Model load failed: {str(e)}")
-            return JSONResponse(status_code=500, content={"error": "Model load failed", "details": str(e)})
+    # Override models come from the bounded cache, everything else from the shared replicas
+    if model_override:
+        return registry.checkout_override(model_override, DEFAULT_CONTEXT_WINDOW)
+    return registry.checkout("infer")
 
-        model_used = llm_instance.metadata.get("general.name", "unknown-model")
 
-        # Prompt construction
-        structured_prompt = f"""
+# Static instructions come first so their KV state is reused across requests
+INFER_PREFIX = """
 You are a financial assistant. Analyze the following scenario and provide:
 - Recommendations
 - Tax implications
 - Cash flow projection for next month
 
-Scenario: {prompt}
+"""
+register_prefix("infer", INFER_PREFIX)
+
+
+def _build_prompt(prompt: str) -> str:
+    return INFER_PREFIX + f"""Scenario: {prompt}
 
 Response:
 """
 
-        # Tokenization
-        token_start = time.time()
-        prompt_tokens = llm_instance.tokenize(structured_prompt.encode("utf-8"), add_bos=True, special=True)
-        prompt_length = len(prompt_tokens)
-        logging.info(f"Tokenization took {time.time() - token_start:.2f}s ({prompt_length} tokens)")
 
-        # Token budgeting
-        buffer = 500
-        available_output = llm_instance.context_params.n_ctx - prompt_length - buffer
-        max_tokens = max(128, min(available_output, 1024))
-        logging.info(f"Max tokens allocated: {max_tokens}")
+def _infer_request(structured_prompt: str) -> InferenceRequest:
+    # Free text: up to INFER_MAX_TOKENS, clamped to whatever context the prompt leaves
+    return InferenceRequest(task="infer", prompt=structured_prompt, max_tokens=INFER_MAX_TOKENS, stop=["</s>"])
+
+
+def _run_inference(structured_prompt: str, model_override: str):
+    with _checkout_instance(model_override) as llm_instance:
+        warm_prefixes(llm_instance, "infer")
+        infer_request = _infer_request(structured_prompt)
+        logging.info(f"Max tokens allocated: {infer_request.output_budget(llm_instance)} "
+                     f"({len(infer_request.tokenize(llm_instance))} prompt tokens)")
 
         # Inference
         infer_start = time.time()
-        output = llm_instance(structured_prompt, max_tokens=max_tokens, stop=["</s>"])
+        output = complete(llm_instance, infer_request)
         logging.info(f"Inference took {time.time() - infer_start:.2f}s")
+        model_used = registry.model_name(llm_instance)
+
+    return output, model_used
+
+
+def _stream_inference(structured_prompt: str, model_override: str):
+    with _checkout_instance(model_override) as llm_instance:
+        yield "model", registry.model_name(llm_instance)
+        warm_prefixes(llm_instance, "infer")
+        for text in generate_tokens(llm_instance, _infer_request(structured_prompt)):
+            yield "token", text
+
+
+# Inference route
+@router.post("/infer")
+async def infer_llm(request: Request, model_override: str = Query(None)):
+    start_time = time.time()
+
+    try:
+        data = await request.json()
+        prompt = data.get("prompt", "")
+        caller = data.get("caller", "unknown")
+
+        if not prompt:
+            return JSONResponse(status_code=400, content={"error": "No prompt provided."})
+
+        logging.info(f"Inference triggered by: {caller}")
+        logging.info(f"Prompt received: {prompt[:60]}...")
+
+        # Prompt construction
+        structured_prompt = _build_prompt(prompt)
+
+        # Loading, tokenization and inference run on an inference worker
+        try:
+            async with request_cancellation(request, "infer"):
+                (output, model_used), timings = await get_executor().submit(
+                    _run_inference, structured_prompt, model_override
+                )
+        except ModelLoadError as e:
+            logging.error(f"Model load failed: {str(e)}")
+            return JSONResponse(status_code=500, content={"error": "Model load failed", "details": str(e)})
+        logging.info(f"Queue wait {timings['queue_wait']:.2f}s, generation {timings['generation']:.2f}s")
 
         # Parsing
         parse_start = time.time()
@@ -134,9 +165,66 @@ Response:
                 "cash_flow_projection": {"next_month": "To be estimated"}
             },
             "confidence": 0.87,
-            "source_model": model_used
+            "source_model": model_used,
+            "timings": {
+                "queue_wait_s": round(timings["queue_wait"], 3),
+                "generation_s": round(timings["generation"], 3)
+            }
         }
 
+    except (QueueFullError, GenerationCancelled):
+        # Surfaced as 503 + Retry-After / 504 by the app-level handlers
+        raise
     except Exception as e:
         logging.error(f"LLM inference failed: {str(e)}")
-        return JSONResponse(status_code=500, content={"error": "LLM inference failed", "details": str(e)})
\ No newline at end of file
+        return JSONResponse(status_code=500, content={"error": "LLM inference failed", "details": str(e)})
+
+
+# Streaming inference route (Server-Sent Events)
+@router.post("/infer/stream")
+async def stream_llm(request: Request, model_override: str = Query(None)):
+    data = await request.json()
+    prompt = data.get("prompt", "")
+    caller = data.get("caller", "unknown")
+
+    if not prompt:
+        return JSONResponse(status_code=400, content={"error": "No prompt provided."})
+
+    logging.info(f"Streaming inference triggered by: {caller}")
+
+    # Enqueue before the response starts so a full queue is still a 503
+    async with request_cancellation(request, "infer"):
+        stream = get_executor().stream(_stream_inference, _build_prompt(prompt), model_override)
+
+    async def events():
+        start_time = time.time()
+        model_used = "unknown-model"
+        first_token_time = None
+        try:
+            async for kind, value in stream:
+                if kind == "model":
+                    model_used = value
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                    logging.info(f"Time to first token: {first_token_time:.2f}s")
+                yield sse_event("token", {"text": value})
+        except ModelLoadError as e:
+            logging.error(f"Model load failed: {str(e)}")
+            yield sse_event("error", {"error": "Model load failed", "details": str(e)})
+            return
+        except Exception as e:
+            logging.error(f"LLM streaming inference failed: {str(e)}")
+            yield sse_event("error", {"error": "LLM inference failed", "details": str(e)})
+            return
+
+        yield sse_event("done", {
+            "source_model": model_used,
+            "timings": {
+                "queue_wait_s": round(stream.timings["queue_wait"], 3),
+                "time_to_first_token_s": round(first_token_time, 3) if first_token_time is not None else None,
+                "total_s": round(time.time() - start_time, 3)
+            }
+        })
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -1,15 +1,55 @@
 # app/routers/scenario.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from datetime import datetime, timedelta
 from app.schemas import ScenarioRequest, ScenarioResponse, Scenario, CashFlowProjection
-from app.services.scenario import build_scenario_prompt, generate_scenario
-from app.db.pool import get_pool
+from app.services.scenario import (
+    pack_scenario_prompt,
+    generate_scenario_cached,
+    scenario_cache_key,
+    stream_scenario,
+    extract_json_block,
+    fallback_scenario,
+    SOURCE_MODEL,
+)
+from app.services.sse import sse_event
+from app.services.scenario_cache import scenario_cache
+from app.db.pool import get_pool, fetch_prepared, prepared_statement
+from app.db.log_writer import get_log_writer
+from app.engine.executor import QueueFullError
+from app.engine.cancellation import GenerationCancelled, request_cancellation
+from app import metrics
 from pydantic import ValidationError
+import asyncio
 import json
+import os
 import uuid
 
 router = APIRouter()
 
+# Fetched generously: the prompt packer summarises whatever does not fit the context
+SCENARIO_RECENT_ROWS = int(os.getenv("SCENARIO_RECENT_ROWS", "200"))
+SCENARIO_AGGREGATE_ROWS = int(os.getenv("SCENARIO_AGGREGATE_ROWS", "240"))
+
+# Fetch recent transactions from DB
+RECENT_TRANSACTIONS_SQL = prepared_statement("""
+    SELECT date, description, amount, COALESCE(category,'uncategorized') AS category
+    FROM transactions
+    WHERE user_id = $1 AND date >= $2
+    ORDER BY date DESC
+    LIMIT $3
+""", "scenario_recent_transactions")
+
+# Fetch aggregated transactions from the incrementally maintained rollup.
+# It is monthly, so the window covers whole months older than the recent one.
+AGGREGATED_TRANSACTIONS_SQL = prepared_statement("""
+    SELECT to_char(month, 'YYYY-MM') AS month, category, total_amount
+    FROM monthly_category_rollup
+    WHERE user_id = $1 AND month >= $2 AND month < $3
+    ORDER BY month DESC
+    LIMIT $4
+""", "scenario_monthly_rollup")
+
 def validate_flat_scenario(scenario: dict) -> bool:
     required_keys = {"recommendations", "tax_implications", "cash_flow_projection"}
     projection_keys = {"initial_impact", "estimated_tax_savings", "net_effect"}
@@ -30,140 +70,120 @@ async def health_check():
 async def ping():
     return {"status": "scenario router active"}
 
-@router.post("/", response_model=ScenarioResponse)
-async def generate_financial_scenario(payload: ScenarioRequest):
-    print(f" Server D received scenario request from user {payload.user_id}")
-    print(f" Server D received payload:\n{payload.dict()}")
-
+async def build_scenario_context(payload: ScenarioRequest) -> str:
     user_id = payload.user_id
-    session_id = payload.session_id or str(uuid.uuid4())
-    scenario_type = payload.scenario_type
     timeframe_days = payload.timeframe_days
     aggregation_days = payload.aggregation_days
     transactions = payload.request
     hypothetical_changes = payload.hypothetical_changes or []
 
+    recent_cutoff = datetime.now() - timedelta(days=timeframe_days)
+    aggregation_cutoff = datetime.now() - timedelta(days=aggregation_days)
+
+    # Both reads run at once on their own pooled connections
     pool = await get_pool()
-    async with pool.acquire() as conn:
-        recent_cutoff = datetime.now() - timedelta(days=timeframe_days)
-        aggregation_cutoff = datetime.now() - timedelta(days=aggregation_days)
-
-        # Fetch recent transactions from DB if needed
-        recent_transactions = await conn.fetch("""
-            SELECT date, description, amount, COALESCE(category,'uncategorized') AS category
-            FROM transactions
-            WHERE user_id = $1 AND date >= $2
-            ORDER BY date DESC
-            LIMIT 20
-        """, user_id, recent_cutoff)
-
-        # Fetch aggregated transactions
-        aggregated_transactions = await conn.fetch("""
-            SELECT to_char(date, 'YYYY-MM') AS month, category,
-                   SUM(amount) AS total_amount
-            FROM transactions
-            WHERE user_id = $1 AND date >= $2 AND date < $3
-            GROUP BY month, category
-            ORDER BY month DESC
-            LIMIT 12
-        """, user_id, aggregation_cutoff, recent_cutoff)
-
-    # Build summaries
-    recent_summary = "\n".join([
-        f"- {tx['date'].strftime('%Y-%m-%d')}: {tx['description']} (£{tx['amount']}) [{tx['category']}]"
-        for tx in recent_transactions
-    ]) if recent_transactions else "No recent transactions."
-
-    agg_summary = "\n".join([
-        f"- {row['month']} | {row['category']}: £{row['total_amount']}"
-        for row in aggregated_transactions
-    ]) if aggregated_transactions else "No older transactions."
-
-    # Handle hypothetical changes
-    total_income = sum(tx['amount'] for tx in recent_transactions if tx['amount'] > 0)
-    total_expenses = sum(-tx['amount'] for tx in recent_transactions if tx['amount'] < 0)
-    change_texts = []
-
-    for change in hypothetical_changes:
-        amt = change.amount
-        cat = change.tax_category.lower()
-        if amt > 0:
-            total_income += amt
-        else:
-            total_expenses += -amt
-        change_texts.append(f"- {change.description} (£{amt}) [{cat}]")
-
-    hypothetical_summary = "\n".join(change_texts) if change_texts else "No hypothetical changes."
+
+    async def fetch(sql, *args):
+        async with pool.acquire() as conn:
+            return await fetch_prepared(conn, sql, *args)
+
+    recent_transactions, aggregated_transactions = await asyncio.gather(
+        fetch(RECENT_TRANSACTIONS_SQL, user_id, recent_cutoff, SCENARIO_RECENT_ROWS),
+        fetch(AGGREGATED_TRANSACTIONS_SQL, user_id,
+              aggregation_cutoff.date().replace(day=1), recent_cutoff.date().replace(day=1),
+              SCENARIO_AGGREGATE_ROWS)
+    )
+
+    # Totals cover every fetched row, even where the prompt only shows category totals
+    amounts = [float(tx['amount']) for tx in recent_transactions] + [change.amount for change in hypothetical_changes]
+    total_income = sum(amt for amt in amounts if amt > 0)
+    total_expenses = sum(-amt for amt in amounts if amt < 0)
     net_balance = total_income - total_expenses
 
     summary_text = (
-        f"Total income over last {timeframe_days} days + hypothetical changes: £{total_income}\n"
-        f"Total expenses over last {timeframe_days} days + hypothetical changes: £{total_expenses}\n"
-        f"Net balance over this period: £{net_balance}\n"
+        f"Total income over last {timeframe_days} days + hypothetical changes: £{total_income:.2f}\n"
+        f"Total expenses over last {timeframe_days} days + hypothetical changes: £{total_expenses:.2f}\n"
+        f"Net balance over this period: £{net_balance:.2f}\n"
     )
 
-    # Build LLM prompt
-    full_prompt = build_scenario_prompt(
+    # Build LLM prompt, packed to the context with the model tokenizer
+    return await asyncio.to_thread(
+        pack_scenario_prompt,
         transactions,
-        recent_summary,
-        agg_summary,
-        hypothetical_summary,
+        recent_transactions,
+        aggregated_transactions,
+        hypothetical_changes,
         summary_text
     )
 
-    scenario_result = {}
-    try:
-        scenario_result = await generate_scenario(full_prompt)
-        scenario_response = scenario_result.get("response", {})
-        confidence_score = scenario_result.get("confidence", None)
 
-        if not validate_flat_scenario(scenario_response):
-            print("⚠️ Scenario format drift detected. Falling back to default.")
-            scenario_response = {
-                "recommendations": "Unable to validate scenario.",
-                "tax_implications": "Model returned unexpected format.",
-                "cash_flow_projection": {
-                    "initial_impact": 0.0,
-                    "estimated_tax_savings": None,
-                    "net_effect": None
-                }
+def to_validated_scenario(scenario_response: dict) -> Scenario:
+    if not validate_flat_scenario(scenario_response):
+        print("⚠️ Scenario format drift detected. Falling back to default.")
+        scenario_response = {
+            "recommendations": "Unable to validate scenario.",
+            "tax_implications": "Model returned unexpected format.",
+            "cash_flow_projection": {
+                "initial_impact": 0.0,
+                "estimated_tax_savings": None,
+                "net_effect": None
             }
+        }
+
+    return Scenario(**scenario_response)
+
+
+def failed_scenario(recommendations: str, tax_implications: str) -> Scenario:
+    return Scenario(
+        recommendations=recommendations,
+        tax_implications=tax_implications,
+        cash_flow_projection=CashFlowProjection(
+            initial_impact=0.0,
+            estimated_tax_savings=None,
+            net_effect=None
+        )
+    )
+
+
+def log_conversation(user_id: int, full_prompt: str, scenario: Scenario, scenario_type: str, source_model: str, session_id: str):
+    # Written in the background; a slow or unavailable DB no longer fails the response
+    get_log_writer().submit(
+        (user_id, full_prompt, json.dumps(scenario.dict()), scenario_type, source_model, session_id)
+    )
+
+
+@router.post("/", response_model=ScenarioResponse)
+async def generate_financial_scenario(payload: ScenarioRequest, request: Request):
+    print(f" Server D received scenario request from user {payload.user_id}")
+    print(f" Server D received payload:\n{payload.dict()}")
 
-        validated_scenario = Scenario(**scenario_response)
+    session_id = payload.session_id or str(uuid.uuid4())
+    scenario_type = payload.scenario_type
+    full_prompt = await build_scenario_context(payload)
+
+    scenario_result = {}
+    try:
+        async with request_cancellation(request, "scenario"):
+            # KV state is only kept for conversations the client continues, not for one-off requests
+            scenario_result = await generate_scenario_cached(payload.user_id, full_prompt, payload.session_id)
+        confidence_score = scenario_result.get("confidence", None)
+        validated_scenario = to_validated_scenario(scenario_result.get("response", {}))
 
     except ValidationError as ve:
         print(" Scenario validation failed:", ve)
-        validated_scenario = Scenario(
-            recommendations="Unable to validate scenario.",
-            tax_implications="The model returned an unexpected format.",
-            cash_flow_projection=CashFlowProjection(
-                initial_impact=0.0,
-                estimated_tax_savings=None,
-                net_effect=None
-            )
-        )
+        validated_scenario = failed_scenario("Unable to validate scenario.", "The model returned an unexpected format.")
         confidence_score = None
 
+    except (QueueFullError, GenerationCancelled):
+        raise
+
     except Exception as e:
         print(" LLM generation failed:", e)
-        validated_scenario = Scenario(
-            recommendations="Scenario generation failed.",
-            tax_implications=str(e),
-            cash_flow_projection=CashFlowProjection(
-                initial_impact=0.0,
-                estimated_tax_savings=None,
-                net_effect=None
-            )
-        )
+        validated_scenario = failed_scenario("Scenario generation failed.", str(e))
         confidence_score = None
 
     # Log conversation
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO conversation_logs (
-                user_id, input_text, llm_response, task_type, source_model, session_id
-            ) VALUES ($1, $2, $3, $4, $5, $6)
-        """, user_id, full_prompt, json.dumps(validated_scenario.dict()), scenario_type, scenario_result.get("source_model", "unknown"), session_id)
+    log_conversation(payload.user_id, full_prompt, validated_scenario, scenario_type, scenario_result.get("source_model", "unknown"), session_id)
 
     return ScenarioResponse(
         status="success",
@@ -172,3 +192,63 @@ async def generate_financial_scenario(payload: ScenarioRequest):
         scenario_type=scenario_type,
         session_id=session_id
     )
+
+
+@router.post("/stream")
+async def stream_financial_scenario(payload: ScenarioRequest, request: Request):
+    print(f" Server D received streaming scenario request from user {payload.user_id}")
+
+    session_id = payload.session_id or str(uuid.uuid4())
+    scenario_type = payload.scenario_type
+    full_prompt = await build_scenario_context(payload)
+    cache_key = scenario_cache_key(full_prompt)
+    cached = scenario_cache.get(cache_key)
+    # Enqueue before the response starts so a full queue is still a 503
+    stream = None
+    if cached is None:
+        async with request_cancellation(request, "scenario"):
+            stream = stream_scenario(full_prompt, payload.session_id)
+
+    async def events():
+        pieces = []
+        try:
+            if cached is not None:
+                # Same prompt already answered: skip straight to the final event
+                parsed = cached["response"]
+            else:
+                async for text in stream:
+                    pieces.append(text)
+                    yield sse_event("token", {"text": text})
+
+                parsed = extract_json_block("".join(pieces))
+                if not parsed:
+                    metrics.json_parse_failed("scenario", SOURCE_MODEL)
+                if parsed:
+                    scenario_cache.put(cache_key, payload.user_id, {
+                        "response": parsed,
+                        "parsed": True,
+                        "source_model": SOURCE_MODEL,
+                        "confidence": None
+                    })
+                parsed = parsed or fallback_scenario()
+            try:
+                validated_scenario = to_validated_scenario(parsed)
+            except ValidationError as ve:
+                print(" Scenario validation failed:", ve)
+                validated_scenario = failed_scenario("Unable to validate scenario.", "The model returned an unexpected format.")
+        except Exception as e:
+            print(" LLM generation failed:", e)
+            yield sse_event("error", {"error": "Scenario generation failed.", "details": str(e)})
+            return
+
+        response = ScenarioResponse(
+            status="success",
+            scenario=validated_scenario,
+            confidence=None,
+            scenario_type=scenario_type,
+            session_id=session_id
+        )
+        yield sse_event("scenario", response.dict())
+        log_conversation(payload.user_id, full_prompt, validated_scenario, scenario_type, SOURCE_MODEL, session_id)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
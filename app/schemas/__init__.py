@@ -1,5 +1,13 @@
-from .categorize import TransactionUpdate, CategorizeResponse
+from .categorize import TransactionUpdate, CategorizeResponse, CategoryPrediction, CategoryName
 from .scenario import ScenarioRequest, ScenarioResponse, Scenario, CashFlowProjection
-from .feedback import FeedbackRequest, FeedbackResponse
+from .feedback import (
+    FeedbackRequest,
+    FeedbackResponse,
+    CategoryFeedbackRequest,
+    FeedbackBatchRequest,
+    FeedbackBatchResponse,
+    FeedbackItemStatus,
+)
+from .jobs import CategorizationJobRequest, CategorizationJob
 #from .review import ReviewResponse
 from .feedback import FeedbackRequest, FeedbackResponse
\ No newline at end of file
@@ -1,7 +1,9 @@
 from pydantic import BaseModel, Field
 from typing import Annotated
 from datetime import date
-from typing import List, Optional
+from typing import List, Literal, Optional
+
+CategoryName = Literal["Grocery", "Technology", "Entertainment", "Other"]
 
 class TransactionUpdate(BaseModel):
     id: int
@@ -27,7 +29,17 @@ class TransactionUpdate(BaseModel):
 
 
 
+class CategoryPrediction(BaseModel):
+    # Exactly what the model is allowed to emit per transaction
+    id: int
+    category: CategoryName
+    confidence: float
+
+
 class CategorizeResponse(BaseModel):
     status: str
     transactions: List[TransactionUpdate]
-    low_confidence_count: int
\ No newline at end of file
+    low_confidence_count: int
+    cache_hits: int = 0  # answered from the merchant cache without the LLM
+    cache_misses: int = 0
+    knn_hits: int = 0  # of the cache misses, answered by the kNN index without the LLM
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 class FeedbackRequest(BaseModel):
     user_id: int
@@ -9,4 +9,25 @@ class FeedbackRequest(BaseModel):
 
 class FeedbackResponse(BaseModel):
     status: str
-    message: Optional[str] = None
\ No newline at end of file
+    message: Optional[str] = None
+
+class FeedbackBatchRequest(BaseModel):
+    items: List[FeedbackRequest]
+
+class FeedbackItemStatus(BaseModel):
+    index: int  # position in the submitted items
+    conversation_id: int
+    status: str  # "success" or "not_found"
+    message: Optional[str] = None
+
+class FeedbackBatchResponse(BaseModel):
+    status: str
+    accepted: int
+    rejected: int
+    items: List[FeedbackItemStatus]
+
+class CategoryFeedbackRequest(BaseModel):
+    user_id: int
+    description: str
+    category: str
+    transaction_id: Optional[int] = None
@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import date, datetime
+
+class CategorizationJobRequest(BaseModel):
+    # A user id, a date range (inclusive), or both
+    user_id: Optional[int] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+class CategorizationJob(BaseModel):
+    id: int
+    user_id: Optional[int] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    status: str  # queued, running, done, failed or cancelled
+    total: Optional[int] = None  # known once the job starts
+    processed: int
+    categorized: int  # written back to transactions.category
+    low_confidence: int  # needs review: skipped, left uncategorized
+    progress: Optional[float] = None  # processed / total
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,282 @@
+# app/services/categorization_jobs.py
+#
+# Bulk categorization of a user's (or a date range's) uncategorized transactions, written
+# back to transactions.category. Jobs live in categorization_jobs (migrations/003 and 005); any
+# API process's worker may claim one, and progress is committed with every batch.
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from app.db.pool import get_pool
+from app.engine import warmup
+from app.engine.executor import QueueFullError, current_priority, BACKGROUND, RETRY_AFTER_SECONDS
+from app.metrics import time_db
+from app.services.categorize import categorize_transactions, VALID_CATEGORIES
+from app.services.scenario_cache import scenario_cache
+
+JOBS_ENABLED = os.getenv("CATEGORIZATION_JOBS_ENABLED", "true").lower() in ("1", "true", "yes")
+JOB_BATCH_SIZE = int(os.getenv("CATEGORIZATION_JOB_BATCH_SIZE", "50"))
+JOB_POLL_SECONDS = float(os.getenv("CATEGORIZATION_JOB_POLL_SECONDS", "5"))
+# A running job that has not checked in for this long (its process died) is taken over
+JOB_LEASE_SECONDS = float(os.getenv("CATEGORIZATION_JOB_LEASE_SECONDS", "300"))
+
+# $1 job id, $2 the claiming worker's token: a worker only ever changes a job it still owns
+OWNED_JOB = "id = $1 AND status = 'running' AND claimed_by = $2"
+
+JOB_COLUMNS = """
+    id, user_id, date_from, date_to, status, total, processed, categorized, low_confidence,
+    error, created_at, started_at, finished_at
+"""
+
+# $1 user_id, $2 date_from, $3 date_to; rows without a description cannot be categorized
+ROWS_FILTER = """
+    category IS NULL
+    AND description IS NOT NULL
+    AND ($1::int IS NULL OR user_id = $1)
+    AND ($2::date IS NULL OR date >= $2)
+    AND ($3::date IS NULL OR date < $3 + 1)
+"""
+
+NEXT_BATCH_SQL = f"""
+    SELECT id, user_id, description, amount, date
+    FROM transactions
+    WHERE {ROWS_FILTER}
+      AND ($4::int IS NULL OR (user_id, id) > ($4, $5))
+    ORDER BY user_id, id
+    LIMIT $6
+"""
+
+
+async def create_job(user_id: int = None, date_from=None, date_to=None) -> dict:
+    pool = await get_pool()
+    async with pool.acquire() as conn, time_db("categorization_job_create"):
+        row = await conn.fetchrow(f"""
+            INSERT INTO categorization_jobs (user_id, date_from, date_to)
+            VALUES ($1, $2, $3)
+            RETURNING {JOB_COLUMNS}
+        """, user_id, date_from, date_to)
+    return dict(row)
+
+
+async def get_job(job_id: int):
+    pool = await get_pool()
+    async with pool.acquire() as conn, time_db("categorization_job_get"):
+        row = await conn.fetchrow(f"SELECT {JOB_COLUMNS} FROM categorization_jobs WHERE id = $1", job_id)
+    return dict(row) if row else None
+
+
+async def cancel_job(job_id: int):
+    # The worker notices at its next batch; what it already wrote back stays
+    pool = await get_pool()
+    async with pool.acquire() as conn, time_db("categorization_job_cancel"):
+        row = await conn.fetchrow(f"""
+            UPDATE categorization_jobs SET status = 'cancelled', finished_at = now()
+            WHERE id = $1 AND status IN ('queued', 'running')
+            RETURNING {JOB_COLUMNS}
+        """, job_id)
+    return dict(row) if row else None
+
+
+async def resume_job(job_id: int):
+    # Picks up from the job's cursor, not from the start
+    pool = await get_pool()
+    async with pool.acquire() as conn, time_db("categorization_job_resume"):
+        row = await conn.fetchrow(f"""
+            UPDATE categorization_jobs SET status = 'queued', error = NULL, finished_at = NULL
+            WHERE id = $1 AND status IN ('failed', 'cancelled')
+            RETURNING {JOB_COLUMNS}
+        """, job_id)
+    return dict(row) if row else None
+
+
+class JobStopped(Exception):
+    pass
+
+
+class CategorizationJobWorker:
+    """Claims queued (or abandoned) jobs and categorizes them a batch at a time.
+
+    Its inference runs at BACKGROUND priority, so interactive requests queued at the same
+    time go first, and it backs off instead of failing when the queue is full.
+    """
+
+    def __init__(self, batch_size: int = JOB_BATCH_SIZE, poll_seconds: float = JOB_POLL_SECONDS,
+                 lease_seconds: float = JOB_LEASE_SECONDS):
+        self._batch_size = batch_size
+        self._poll_seconds = poll_seconds
+        self._lease_seconds = lease_seconds
+        self._token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Mid-batch work is lost, committed batches are not: the job resumes from its cursor
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        current_priority.set(BACKGROUND)
+        while True:
+            job = None
+            if warmup.is_ready():
+                try:
+                    job = await self._claim()
+                except Exception as e:
+                    logging.error(f"Claiming a categorization job failed: {str(e)}")
+            if job is None:
+                await asyncio.sleep(self._poll_seconds)
+                continue
+
+            # Checks in while batches wait for a worker or take long, not just between them
+            heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+            try:
+                await self._process(job)
+            except JobStopped:
+                logging.info(f"Categorization job {job['id']} stopped (cancelled or taken over)")
+            except Exception as e:
+                logging.error(f"Categorization job {job['id']} failed: {str(e)}")
+                await self._finish(job["id"], "failed", str(e))
+            finally:
+                heartbeat.cancel()
+
+    async def _claim(self):
+        pool = await get_pool()
+        async with pool.acquire() as conn, time_db("categorization_job_claim"):
+            return await conn.fetchrow("""
+                UPDATE categorization_jobs
+                SET status = 'running', started_at = COALESCE(started_at, now()), heartbeat_at = now(),
+                    claimed_by = $2
+                WHERE id = (
+                    SELECT id FROM categorization_jobs
+                    WHERE status = 'queued'
+                       OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => $1))
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING *
+            """, self._lease_seconds, self._token)
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(self._lease_seconds / 3)
+            try:
+                pool = await get_pool()
+                async with pool.acquire() as conn, time_db("categorization_job_heartbeat"):
+                    owned = await conn.fetchval(f"""
+                        UPDATE categorization_jobs SET heartbeat_at = now() WHERE {OWNED_JOB} RETURNING id
+                    """, job_id, self._token)
+            except Exception as e:
+                logging.warning(f"Categorization job {job_id} heartbeat failed: {str(e)}")
+                continue
+            if owned is None:
+                # Cancelled or taken over: the next write-back finds out and stops
+                return
+
+    async def _process(self, job):
+        job_id = job["id"]
+        scope = (job["user_id"], job["date_from"], job["date_to"])
+        pool = await get_pool()
+
+        if job["total"] is None:
+            async with pool.acquire() as conn, time_db("categorization_job_count"):
+                total = await conn.fetchval(f"SELECT count(*) FROM transactions WHERE {ROWS_FILTER}", *scope)
+                owned = await conn.fetchval(f"""
+                    UPDATE categorization_jobs SET total = $3 WHERE {OWNED_JOB} RETURNING id
+                """, job_id, self._token, total)
+            if owned is None:
+                raise JobStopped()
+            logging.info(f"Categorization job {job_id}: {total} uncategorized transactions")
+
+        cursor = (job["cursor_user_id"], job["cursor_id"])
+        while True:
+            async with pool.acquire() as conn, time_db("categorization_job_batch"):
+                rows = await conn.fetch(NEXT_BATCH_SQL, *scope, *cursor, self._batch_size)
+            if not rows:
+                await self._finish(job_id, "done")
+                logging.info(f"Categorization job {job_id} done")
+                return
+
+            transactions = [
+                {"id": row["id"], "description": row["description"], "amount": float(row["amount"]),
+                 "date": row["date"]}
+                for row in rows
+            ]
+            try:
+                result = await categorize_transactions(transactions)
+            except QueueFullError:
+                # Interactive traffic has the workers; try this batch again later
+                await asyncio.sleep(RETRY_AFTER_SECONDS)
+                continue
+
+            cursor = (rows[-1]["user_id"], rows[-1]["id"])
+            await self._write_back(job_id, rows, result["transactions"], cursor)
+
+    async def _write_back(self, job_id: int, rows: list, categorized: list, cursor: tuple):
+        # A guess that needs review is not written as if it were settled: the row stays
+        # uncategorized (for /categorize/ or a later job) and is counted as low_confidence
+        records = [(tx["id"], tx["category"]) for tx in categorized
+                   if tx["category"] in VALID_CATEGORIES and not tx["needs_review"]]
+        low_confidence = sum(1 for tx in categorized if tx["needs_review"])
+
+        pool = await get_pool()
+        async with pool.acquire() as conn, time_db("categorization_job_write"):
+            async with conn.transaction():
+                # COPY the batch into a temp table, then one UPDATE ... FROM, instead of a statement per row
+                await conn.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS categorized_batch (
+                        id INTEGER PRIMARY KEY, category TEXT NOT NULL
+                    ) ON COMMIT DELETE ROWS
+                """)
+                updated = 0
+                if records:
+                    await conn.copy_records_to_table("categorized_batch", records=records, columns=["id", "category"])
+                    # Never overwrite a category set (e.g. corrected by the user) since the batch was read
+                    status = await conn.execute("""
+                        UPDATE transactions t SET category = b.category
+                        FROM categorized_batch b
+                        WHERE t.id = b.id AND t.category IS NULL
+                    """)
+                    updated = int(status.split()[-1])
+
+                # Progress and cursor commit with the rows they describe
+                progress = await conn.fetchval(f"""
+                    UPDATE categorization_jobs
+                    SET processed = processed + $3, categorized = categorized + $4,
+                        low_confidence = low_confidence + $5, cursor_user_id = $6, cursor_id = $7,
+                        heartbeat_at = now()
+                    WHERE {OWNED_JOB}
+                    RETURNING id
+                """, job_id, self._token, len(rows), updated, low_confidence, *cursor)
+                if progress is None:
+                    # Cancelled or taken over meanwhile: roll this batch back too
+                    raise JobStopped()
+
+        # Scenario prompts read these categories
+        for user_id in {row["user_id"] for row in rows}:
+            scenario_cache.invalidate_user(user_id)
+
+    async def _finish(self, job_id: int, status: str, error: str = None):
+        pool = await get_pool()
+        async with pool.acquire() as conn, time_db("categorization_job_finish"):
+            await conn.execute(f"""
+                UPDATE categorization_jobs SET status = $3, error = $4, finished_at = now()
+                WHERE {OWNED_JOB}
+            """, job_id, self._token, status, error)
+
+
+_worker = None
+
+
+def get_job_worker() -> CategorizationJobWorker:
+    global _worker
+    if _worker is None:
+        _worker = CategorizationJobWorker()
+    return _worker
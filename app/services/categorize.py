@@ -1,32 +1,55 @@
-from llama_cpp import Llama
+import asyncio
 import json
+import logging
+import os
 import re
-from app.schemas import TransactionUpdate
+from typing import get_args
+from app.schemas import TransactionUpdate, CategoryPrediction, CategoryName
+from app.engine.executor import get_executor, run_completion, current_priority, INFERENCE_WORKERS, BACKGROUND
+from app.engine.generation import InferenceRequest
+from app.engine.prefix_cache import register_prefix
+from app.services.categorize_batcher import CategorizeBatcher
+from app.services.categorize_chunker import plan_chunks, output_tokens_per_tx
+from app.services import category_cache
+from app.services.category_index import get_category_index
+from app import metrics
 
 
-
-
-llm = Llama(
-    model_path="models/mistral-7b-instruct-v0.2.Q5_K_M.gguf",
-    n_ctx=4096,
-    n_threads=8
+CONFIDENCE_THRESHOLD = 0.7
+VALID_CATEGORIES = set(get_args(CategoryName))
+# Extra attempts for ids a chunk's output left out
+CHUNK_RETRIES = int(os.getenv("CATEGORIZE_CHUNK_RETRIES", "2"))
+
+# Static header first so its KV state is reused across requests
+CATEGORIZE_HEADER = (
+    "Categorize the following transactions.\n"
+    "Return a JSON array. Each object must include: id, category, confidence.\n"
+    "Categories must be one of: Grocery, Technology, Entertainment, Other.\n"
+    "Confidence must be a float between 0 and 1.\n\n"
 )
+register_prefix("categorize", CATEGORIZE_HEADER)
 
-CONFIDENCE_THRESHOLD = 0.7
+def format_transaction_line(tx: dict) -> str:
+    return f"{tx['id']}: {tx['description']} (£{tx['amount']})"
 
 def build_categorization_prompt(transactions: list) -> str:
     ids = [str(tx["id"]) for tx in transactions]
-    lines = [f"{tx['id']}: {tx['description']} (£{tx['amount']})" for tx in transactions]
+    lines = [format_transaction_line(tx) for tx in transactions]
     return (
-        f"Categorize the following transactions. Only return JSON for these IDs: {', '.join(ids)}.\n"
-        "Each object must include: id, category, confidence.\n"
-        "Categories must be one of: Grocery, Technology, Entertainment, Other.\n"
-        "Confidence must be a float between 0 and 1.\n\n"
+        CATEGORIZE_HEADER
+        + f"Only return JSON for these IDs: {', '.join(ids)}.\n\n"
         + "\n".join(lines)
     )
 
 
 
+def prediction_schema(ids: list) -> str:
+    # A JSON array of CategoryPrediction whose ids are restricted to this batch
+    item = CategoryPrediction.model_json_schema()
+    item["properties"]["id"] = {"enum": sorted(ids)}
+    return json.dumps({"type": "array", "items": item})
+
+
 def extract_json_objects(text: str) -> list:
     matches = re.findall(r'\{[^{}]+\}', text, re.DOTALL)
     parsed = []
@@ -67,11 +90,22 @@ def merge_predictions(original: list, predictions: list) -> list:
 
 
 
-async def categorize_transactions(transactions: list) -> list:
+async def _predict_chunk(transactions: list) -> list:
     DEBUG = True  # Toggle this to False in production
 
     prompt = build_categorization_prompt(transactions)
-    response = llm(prompt, max_tokens=512)
+    # The chunker already reserved this much of the context for the output
+    max_tokens = output_tokens_per_tx() * len(transactions) + 16
+    # Grammar-constrained: only valid prediction JSON can be sampled, and generation ends with the array.
+    # Sampling comes from the categorize profile (greedy by default).
+    response, _ = await get_executor().submit(run_completion, InferenceRequest(
+        task="categorize",
+        prompt=prompt,
+        max_tokens=max_tokens,
+        json_schema=prediction_schema([tx["id"] for tx in transactions]),
+        cache_grammar=False,
+        stop_at_json_end=True
+    ))
     raw_text = response["choices"][0]["text"]
 
     if DEBUG:
@@ -80,6 +114,7 @@ async def categorize_transactions(transactions: list) -> list:
     try:
         predictions = json.loads(raw_text)
     except json.JSONDecodeError:
+        metrics.json_parse_failed("categorize", response["model"])
         predictions = extract_json_objects(raw_text)
 
     if not predictions:
@@ -98,7 +133,6 @@ async def categorize_transactions(transactions: list) -> list:
 
     # ✅ Process predictions
     low_conf_count = 0
-    valid_categories = {"Grocery", "Technology", "Entertainment", "Other"}
 
     for tx in predictions:
         # Fallback confidence
@@ -118,7 +152,7 @@ async def categorize_transactions(transactions: list) -> list:
             low_conf_count += 1
 
         # Fallback category
-        if tx.get("category") not in valid_categories:
+        if tx.get("category") not in VALID_CATEGORIES:
             if DEBUG:
                 print(f"⚠️ Invalid or missing category for tx {tx.get('id')}, assigning 'Other'")
             tx["category"] = "Other"
@@ -126,4 +160,79 @@ async def categorize_transactions(transactions: list) -> list:
     if DEBUG:
         print(f"⚠️ Low-confidence transactions: {low_conf_count}")
 
-    return merge_predictions(transactions, predictions)
\ No newline at end of file
+    return merge_predictions(transactions, predictions)
+
+
+async def _categorize_chunk(transactions: list, retries: int = CHUNK_RETRIES) -> list:
+    predicted = await _predict_chunk(transactions)
+
+    # Only the ids this chunk missed are asked again
+    covered = {tx["id"] for tx in predicted}
+    missing = [tx for tx in transactions if tx["id"] not in covered]
+    if missing and retries > 0:
+        logging.debug(f"Retrying {len(missing)} of {len(transactions)} transactions missing from chunk output")
+        predicted += await _categorize_chunk(missing, retries - 1)
+    return predicted
+
+
+async def _categorize_with_llm(transactions: list) -> list:
+    chunks = await asyncio.to_thread(plan_chunks, transactions, CATEGORIZE_HEADER)
+    if len(chunks) > 1:
+        logging.debug(f"Split {len(transactions)} transactions into {len(chunks)} chunks")
+
+    # Fan out, but never hold more queue slots than there are workers to serve them
+    slots = asyncio.Semaphore(INFERENCE_WORKERS)
+
+    async def run(chunk):
+        async with slots:
+            return await _categorize_chunk(chunk)
+
+    results = await asyncio.gather(*(run(chunk) for chunk in chunks))
+    return [tx for chunk_result in results for tx in chunk_result]
+
+
+
+_batcher = CategorizeBatcher(_categorize_with_llm)
+
+
+async def categorize_transactions(transactions: list) -> dict:
+    if not transactions:
+        return {"transactions": [], "cache_hits": 0, "cache_misses": 0, "knn_hits": 0}
+
+    # Known merchants skip the model entirely
+    hits, misses = await category_cache.lookup(transactions)
+
+    # Then descriptions whose nearest user-confirmed examples agree
+    predicted, misses = await get_category_index().classify(misses, CONFIDENCE_THRESHOLD)
+    knn_hits = len(predicted)
+
+    if misses:
+        if current_priority.get() == BACKGROUND:
+            # Bulk jobs send full batches already, and must not share a generation with interactive callers
+            generated = await _categorize_with_llm(misses)
+        else:
+            # Concurrent callers share one prompt; see app/services/categorize_batcher.py
+            generated = await _batcher.submit(misses)
+        await category_cache.store(generated, CONFIDENCE_THRESHOLD)
+        predicted += generated
+
+    cached = []
+    for tx in transactions:
+        if tx["id"] not in hits:
+            continue
+        category, confidence = hits[tx["id"]]
+        cached.append(TransactionUpdate(**{
+            **tx,
+            "category": category,
+            "confidence": confidence,
+            "needs_review": confidence < CONFIDENCE_THRESHOLD
+        }).dict())
+
+    # Keep the caller's order
+    by_id = {tx["id"]: tx for tx in cached + predicted}
+    return {
+        "transactions": [by_id[tx["id"]] for tx in transactions if tx["id"] in by_id],
+        "cache_hits": len(hits),
+        "cache_misses": len(transactions) - len(hits),
+        "knn_hits": knn_hits
+    }
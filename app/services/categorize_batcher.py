@@ -0,0 +1,101 @@
+# app/services/categorize_batcher.py
+import asyncio
+import logging
+import os
+
+from app.engine.cancellation import SharedCancelToken, current_cancel
+
+BATCH_WINDOW_MS = int(os.getenv("CATEGORIZE_BATCH_WINDOW_MS", "25"))
+# Prompt + expected output tokens allowed in one combined generation
+BATCH_MAX_TOKENS = int(os.getenv("CATEGORIZE_BATCH_MAX_TOKENS", "3000"))
+# Roughly one {"id": .., "category": .., "confidence": ..} object
+OUTPUT_TOKENS_PER_TX = 32
+
+
+def estimate_tx_tokens(tx: dict) -> int:
+    # ~3 characters per token for short merchant strings, plus the prediction it produces
+    line = f"{tx['id']}: {tx['description']} (£{tx['amount']})"
+    return len(line) // 3 + 1 + OUTPUT_TOKENS_PER_TX
+
+
+class CategorizeBatcher:
+    """Coalesces concurrent categorize calls into one combined LLM request.
+
+    Requests arriving within the batching window (or until the token budget is hit)
+    are merged, re-keyed with batch-local ids so callers' ids cannot collide, and
+    the predictions are split back to each caller under their original ids.
+    """
+
+    def __init__(self, run_batch, window_ms: int = BATCH_WINDOW_MS, max_tokens: int = BATCH_MAX_TOKENS):
+        self._run_batch = run_batch
+        self._window = window_ms / 1000
+        self._max_tokens = max_tokens
+        self._pending = []
+        self._pending_tokens = 0
+        self._flush_handle = None
+        # Running batches: the loop only keeps weak references to tasks
+        self._running = set()
+
+    async def submit(self, transactions: list) -> list:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        cost = sum(estimate_tx_tokens(tx) for tx in transactions)
+
+        if self._pending and self._pending_tokens + cost > self._max_tokens:
+            self._flush()
+
+        self._pending.append((transactions, future, current_cancel.get()))
+        self._pending_tokens += cost
+
+        if self._pending_tokens >= self._max_tokens:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list):
+        # Whatever goes wrong, every caller's future is resolved: nothing else would
+        try:
+            # Runs in its own task: cancelled only if every caller in the batch is
+            current_cancel.set(SharedCancelToken([cancel for _, _, cancel in batch]))
+
+            combined = []
+            owners = {}
+            for index, (transactions, _, _) in enumerate(batch):
+                for tx in transactions:
+                    batch_id = len(combined) + 1
+                    owners[batch_id] = (index, tx["id"])
+                    combined.append({**tx, "id": batch_id})
+
+            if len(batch) > 1:
+                logging.debug(f"Coalesced {len(batch)} categorize requests ({len(combined)} transactions)")
+
+            results = await self._run_batch(combined)
+
+            split = [[] for _ in batch]
+            for result in results:
+                owner = owners.get(result["id"])
+                if owner is None:
+                    continue
+                index, original_id = owner
+                split[index].append({**result, "id": original_id})
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), predictions in zip(batch, split):
+            if not future.done():
+                future.set_result(predictions)
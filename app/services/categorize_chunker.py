@@ -0,0 +1,47 @@
+# app/services/categorize_chunker.py
+import os
+from functools import lru_cache
+
+from app.config.engine_config import TASK_PROFILES
+from app.engine.registry import get_tokenizer
+
+# Slack for the prompt template and grammar separators not counted per line
+CHUNK_CONTEXT_MARGIN = int(os.getenv("CATEGORIZE_CHUNK_MARGIN", "64"))
+# The longest prediction the grammar allows for a realistic id, used as the per-transaction output cost
+SAMPLE_PREDICTION = '{"id": 1000000, "category": "Entertainment", "confidence": 0.95}, '
+
+
+@lru_cache(maxsize=50000)
+def count_tokens(text: str) -> int:
+    # Merchant lines repeat a lot, so counts are cached per string
+    tokenizer = get_tokenizer("categorize")
+    return len(tokenizer.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+
+def output_tokens_per_tx() -> int:
+    return count_tokens(SAMPLE_PREDICTION)
+
+
+def tx_cost(tx: dict) -> int:
+    # The id appears in the ID list and on its line; the body is cached without it
+    id_tokens = count_tokens(f"{tx['id']}, ")
+    body_tokens = count_tokens(f": {tx['description']} (£{tx['amount']})\n")
+    return 2 * id_tokens + body_tokens + output_tokens_per_tx()
+
+
+def plan_chunks(transactions: list, header: str) -> list:
+    """Splits transactions so each chunk's prompt and expected output fit the context."""
+    budget = TASK_PROFILES["categorize"].n_ctx - count_tokens(header) - CHUNK_CONTEXT_MARGIN
+
+    chunks, current, used = [], [], 0
+    for tx in transactions:
+        cost = tx_cost(tx)
+        if current and used + cost > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(tx)
+        used += cost
+
+    if current:
+        chunks.append(current)
+    return chunks
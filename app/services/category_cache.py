@@ -0,0 +1,130 @@
+# app/services/category_cache.py
+import os
+import re
+import time
+from collections import OrderedDict
+
+from app.db.pool import get_pool
+from app.metrics import time_db
+
+CATEGORY_CACHE_SIZE = int(os.getenv("CATEGORY_CACHE_SIZE", "10000"))
+# Bounds how long another process's feedback override can go unseen by this process
+CATEGORY_CACHE_TTL_SECONDS = int(os.getenv("CATEGORY_CACHE_TTL_SECONDS", "300"))
+# Distinct users who must agree on a merchant's category before it applies to everyone
+CATEGORY_FEEDBACK_MIN_USERS = int(os.getenv("CATEGORY_FEEDBACK_MIN_USERS", "3"))
+
+# Card-terminal noise that varies between otherwise identical merchants
+_NOISE = re.compile(r"[^a-z ]+")
+_SUFFIXES = {"ltd", "limited", "plc", "llc", "inc", "uk", "gb", "com", "co", "www"}
+
+# description_key -> (category, confidence, expires_at), least recently used first
+_lru = OrderedDict()
+
+
+def normalize_description(description: str) -> str:
+    words = _NOISE.sub(" ", description.lower()).split()
+    words = [w for w in words if w not in _SUFFIXES and len(w) > 1]
+    return " ".join(words)
+
+
+def _remember(key: str, category: str, confidence: float):
+    _lru[key] = (category, confidence, time.monotonic() + CATEGORY_CACHE_TTL_SECONDS)
+    _lru.move_to_end(key)
+    while len(_lru) > CATEGORY_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+
+async def lookup(transactions: list) -> tuple:
+    """Splits transactions into cache hits {id: (category, confidence)} and misses."""
+    hits = {}
+    pending = {}
+    now = time.monotonic()
+    for tx in transactions:
+        key = normalize_description(tx["description"])
+        entry = _lru.get(key)
+        if entry and entry[2] > now:
+            _lru.move_to_end(key)
+            hits[tx["id"]] = entry[:2]
+        elif key:
+            pending.setdefault(key, []).append(tx)
+
+    if pending:
+        try:
+            pool = await get_pool()
+            async with pool.acquire() as conn, time_db("category_cache_lookup"):
+                rows = await conn.fetch("""
+                    SELECT description_key, category, confidence
+                    FROM merchant_category_cache
+                    WHERE description_key = ANY($1::text[])
+                """, list(pending.keys()))
+        except Exception as e:
+            # The cache only saves work; the LLM can still answer without it
+            print("⚠️ Category cache lookup failed:", e)
+            rows = []
+
+        for row in rows:
+            _remember(row["description_key"], row["category"], row["confidence"])
+            for tx in pending.pop(row["description_key"]):
+                hits[tx["id"]] = (row["category"], row["confidence"])
+
+    misses = [tx for tx in transactions if tx["id"] not in hits]
+    return hits, misses
+
+
+async def store(predictions: list, min_confidence: float):
+    # Only confident model answers are worth replaying; feedback rows are never overwritten
+    rows = {}
+    for tx in predictions:
+        key = normalize_description(tx["description"])
+        if key and tx["confidence"] >= min_confidence:
+            rows[key] = (tx["category"], tx["confidence"])
+    if not rows:
+        return
+
+    for key, (category, confidence) in rows.items():
+        _remember(key, category, confidence)
+
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as conn, time_db("category_cache_store"):
+            await conn.executemany("""
+                INSERT INTO merchant_category_cache (description_key, category, confidence, source)
+                VALUES ($1, $2, $3, 'llm')
+                ON CONFLICT (description_key) DO UPDATE
+                SET category = EXCLUDED.category, confidence = EXCLUDED.confidence, updated_at = now()
+                WHERE merchant_category_cache.source <> 'feedback'
+            """, [(key, category, confidence) for key, (category, confidence) in rows.items()])
+    except Exception as e:
+        print("⚠️ Category cache store failed:", e)
+
+
+async def promote_feedback(conn, description: str, category: str) -> bool:
+    """Makes category the shared answer for this merchant once enough users agree on it.
+
+    One user's correction only changes their own transaction: otherwise any tenant could decide
+    the category for everyone. Returns whether the correction was promoted.
+    """
+    key = normalize_description(description)
+    if not key:
+        return False
+    rows = await conn.fetch("""
+        SELECT category, count(DISTINCT user_id) AS users
+        FROM category_feedback
+        WHERE description_key = $1
+        GROUP BY category
+    """, key)
+    users = {row["category"]: row["users"] for row in rows}
+    agreeing = users.get(category, 0)
+    # Enough users, and more of them than for any other category
+    if agreeing < CATEGORY_FEEDBACK_MIN_USERS or any(n >= agreeing for c, n in users.items() if c != category):
+        return False
+
+    # Corroborated corrections win over anything the model said
+    await conn.execute("""
+        INSERT INTO merchant_category_cache (description_key, category, confidence, source)
+        VALUES ($1, $2, 1.0, 'feedback')
+        ON CONFLICT (description_key) DO UPDATE
+        SET category = EXCLUDED.category, confidence = 1.0, source = 'feedback', updated_at = now()
+    """, key, category)
+    _remember(key, category, 1.0)
+    return True
@@ -0,0 +1,357 @@
+# app/services/category_index.py
+#
+# kNN categorization from user-confirmed categories: every /feedback/category correction enough
+# users agree on is a labelled example, embedded once and kept in a NumPy matrix. Transactions whose nearest
+# examples agree are categorized without generation; the rest go to the LLM.
+#
+#   python -m app.services.category_index rebuild     # embed all labelled examples into CATEGORY_INDEX_DIR
+#   python -m app.services.category_index stats
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from typing import get_args
+
+import numpy as np
+
+from app.db.pool import get_pool
+from app.engine.cancellation import GenerationCancelled
+from app.engine.embeddings import embed_texts, embedding_model_name
+from app.engine.executor import get_executor
+from app.metrics import time_db
+from app.schemas import CategoryName, TransactionUpdate
+from app.services.category_cache import CATEGORY_FEEDBACK_MIN_USERS, normalize_description
+
+CATEGORY_KNN_K = int(os.getenv("CATEGORY_KNN_K", "5"))
+# Less similar examples do not vote
+CATEGORY_KNN_MIN_SIMILARITY = float(os.getenv("CATEGORY_KNN_MIN_SIMILARITY", "0.85"))
+# With fewer voting examples than this the LLM decides
+CATEGORY_KNN_MIN_VOTES = int(os.getenv("CATEGORY_KNN_MIN_VOTES", "2"))
+# When set, rebuilds are saved here and loaded (memory-mapped) at startup
+CATEGORY_INDEX_DIR = os.getenv("CATEGORY_INDEX_DIR")
+CATEGORY_INDEX_MMAP = os.getenv("CATEGORY_INDEX_MMAP", "true").lower() in ("1", "true", "yes")
+# Re-reads every labelled example; only descriptions not indexed yet are embedded. 0 disables.
+CATEGORY_INDEX_REBUILD_SECONDS = float(os.getenv("CATEGORY_INDEX_REBUILD_SECONDS", "3600"))
+EMBED_BATCH_SIZE = int(os.getenv("CATEGORY_INDEX_EMBED_BATCH_SIZE", "64"))
+
+VALID_CATEGORIES = list(get_args(CategoryName))
+
+# Like the shared merchant cache, only corrections enough users agree on ($1 distinct users,
+# and more of them than for any other category): one user's labels must not decide for everyone
+LABELLED_EXAMPLES_SQL = """
+    WITH votes AS (
+        SELECT description_key, category, count(DISTINCT user_id) AS users, max(created_at) AS last_at
+        FROM category_feedback
+        WHERE description_key IS NOT NULL
+        GROUP BY description_key, category
+    )
+    SELECT description_key, category
+    FROM (
+        SELECT description_key, category, users, last_at,
+               rank() OVER (PARTITION BY description_key ORDER BY users DESC) AS place,
+               count(*) OVER (PARTITION BY description_key, users) AS tied
+        FROM votes
+    ) ranked
+    WHERE place = 1 AND tied = 1 AND users >= $1
+    ORDER BY last_at
+"""
+
+
+class VectorIndex:
+    """Unit vectors, one row per normalized description, searched by cosine similarity.
+
+    A base matrix (possibly memory-mapped from a rebuild) plus a growable in-memory delta
+    for examples added since. Rows are only ever appended, so a search running in a
+    thread keeps a consistent view while the event loop adds.
+    """
+
+    def __init__(self, base: np.ndarray = None, keys: list = None, codes: list = None, model: str = None):
+        self.model = model
+        self._base = base
+        self._keys = list(keys or [])
+        self._rows = {key: row for row, key in enumerate(self._keys)}
+        self._codes = np.zeros(max(16, len(self._keys)), dtype=np.int8)
+        self._codes[:len(self._keys)] = codes or []
+        self._delta = None
+        self._delta_size = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def counts(self) -> dict:
+        codes = self._codes[:len(self._keys)]
+        return {category: int((codes == code).sum()) for code, category in enumerate(VALID_CATEGORIES)}
+
+    def vector(self, key: str):
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        base_size = 0 if self._base is None else len(self._base)
+        return self._base[row] if row < base_size else self._delta[row - base_size]
+
+    def add(self, keys: list, vectors: np.ndarray, categories: list):
+        for key, vector, category in zip(keys, vectors, categories):
+            code = VALID_CATEGORIES.index(category)
+            row = self._rows.get(key)
+            if row is not None:
+                # Same description, same embedding: only the label changes
+                self._codes[row] = code
+                continue
+            self._append(vector)
+            row = len(self._keys)
+            if row == len(self._codes):
+                self._codes = np.concatenate([self._codes, np.zeros(len(self._codes), dtype=np.int8)])
+            self._codes[row] = code
+            self._keys.append(key)
+            self._rows[key] = row
+
+    def _append(self, vector: np.ndarray):
+        if self._delta is None or self._delta_size == len(self._delta):
+            # Doubling; searches holding the old buffer keep reading it
+            grown = np.empty((max(64, 2 * self._delta_size), len(vector)), dtype=np.float32)
+            if self._delta is not None:
+                grown[:self._delta_size] = self._delta[:self._delta_size]
+            self._delta = grown
+        self._delta[self._delta_size] = vector
+        self._delta_size += 1
+
+    def search(self, queries: np.ndarray, k: int) -> tuple:
+        """(similarities, category codes) of the k nearest rows per query, most similar first."""
+        size = len(self._keys)
+        segments = [m for m in (self._base, None if self._delta is None else self._delta[:self._delta_size])
+                    if m is not None and len(m)]
+        similarities = np.hstack([queries @ m.T for m in segments])[:, :size]
+        codes = self._codes[:size]
+
+        k = min(k, size)
+        nearest = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        nearest_sims = np.take_along_axis(similarities, nearest, axis=1)
+        order = np.argsort(-nearest_sims, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        return np.take_along_axis(nearest_sims, order, axis=1), codes[nearest]
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        vectors = np.vstack([m for m in (self._base, None if self._delta is None else self._delta[:self._delta_size])
+                             if m is not None])
+        # Written aside and swapped in; load() checks the two files agree
+        np.save(os.path.join(directory, "vectors.tmp.npy"), vectors)
+        with open(os.path.join(directory, "labels.tmp.json"), "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "categories": VALID_CATEGORIES, "min_users": CATEGORY_FEEDBACK_MIN_USERS,
+                       "keys": self._keys,
+                       "codes": self._codes[:len(self._keys)].tolist()}, f)
+        os.replace(os.path.join(directory, "vectors.tmp.npy"), os.path.join(directory, "vectors.npy"))
+        os.replace(os.path.join(directory, "labels.tmp.json"), os.path.join(directory, "labels.json"))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = CATEGORY_INDEX_MMAP):
+        """The saved index, or None if there is none or it is not usable with the current model."""
+        labels_path = os.path.join(directory, "labels.json")
+        vectors_path = os.path.join(directory, "vectors.npy")
+        if not (os.path.exists(labels_path) and os.path.exists(vectors_path)):
+            return None
+        with open(labels_path, encoding="utf-8") as f:
+            labels = json.load(f)
+        vectors = np.load(vectors_path, mmap_mode="r" if mmap else None)
+        if labels["model"] != embedding_model_name() or labels["categories"] != VALID_CATEGORIES:
+            logging.warning(f"Category index in {directory} was built for another model or category set, ignoring it")
+            return None
+        if labels.get("min_users") != CATEGORY_FEEDBACK_MIN_USERS:
+            # Built from corrections with less (or other) agreement than examples need now
+            logging.warning(f"Category index in {directory} was built with other feedback agreement, ignoring it")
+            return None
+        if len(vectors) != len(labels["keys"]):
+            logging.warning(f"Category index in {directory} is incomplete, ignoring it")
+            return None
+        return cls(vectors, labels["keys"], labels["codes"], labels["model"])
+
+
+def vote(similarities, codes) -> tuple:
+    """(category, confidence) from one row of neighbours, or None if too few are similar enough."""
+    weights = {}
+    voters = 0
+    for similarity, code in zip(similarities, codes):
+        if similarity >= CATEGORY_KNN_MIN_SIMILARITY:
+            weights[code] = weights.get(code, 0.0) + float(similarity)
+            voters += 1
+    if voters < CATEGORY_KNN_MIN_VOTES:
+        return None
+    code = max(weights, key=weights.get)
+    # Similarity-weighted share of the neighbours that agree
+    return VALID_CATEGORIES[code], weights[code] / sum(weights.values())
+
+
+async def _embed(texts: list) -> np.ndarray:
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        # On an inference worker, like generation: the embedding model is a llama.cpp context too
+        batch, _ = await get_executor().submit(embed_texts, texts[i:i + EMBED_BATCH_SIZE])
+        vectors.extend(batch)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+class CategoryIndex:
+    """The process's kNN index: classify(), learn() from corrections, and periodic rebuilds."""
+
+    def __init__(self, directory: str = CATEGORY_INDEX_DIR, rebuild_seconds: float = CATEGORY_INDEX_REBUILD_SECONDS):
+        self._directory = directory
+        self._rebuild_seconds = rebuild_seconds
+        self._index = VectorIndex(model=embedding_model_name())
+        self._task = None
+        self._learning = set()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    async def classify(self, transactions: list, min_confidence: float) -> tuple:
+        """Splits transactions into kNN predictions (TransactionUpdate dicts) and the ones left for the LLM."""
+        if not len(self._index):
+            return [], transactions
+
+        keys = {tx["id"]: normalize_description(tx["description"]) for tx in transactions}
+        unique = sorted({key for key in keys.values() if key})
+        try:
+            vectors = await _embed(unique)
+            similarities, codes = await asyncio.to_thread(self._index.search, vectors, CATEGORY_KNN_K)
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            # The index only saves work; the LLM can still answer without it
+            print("⚠️ Category kNN lookup failed:", e)
+            return [], transactions
+
+        votes = {key: vote(similarities[i], codes[i]) for i, key in enumerate(unique)}
+        predicted, misses = [], []
+        for tx in transactions:
+            result = votes.get(keys[tx["id"]])
+            if result is None or result[1] < min_confidence:
+                misses.append(tx)
+                continue
+            category, confidence = result
+            predicted.append(TransactionUpdate(**{
+                **tx, "category": category, "confidence": confidence, "needs_review": False
+            }).dict())
+        return predicted, misses
+
+    def learn(self, description: str, category: str):
+        """Adds a confirmed category in the background; the embedding waits for a free worker."""
+        key = normalize_description(description)
+        if not key or category not in VALID_CATEGORIES:
+            return
+        task = asyncio.ensure_future(self._learn(key, category))
+        self._learning.add(task)
+        task.add_done_callback(self._learning.discard)
+
+    async def _learn(self, key: str, category: str):
+        try:
+            vector = self._index.vector(key)
+            vectors = np.asarray([vector]) if vector is not None else await _embed([key])
+            self._index.add([key], vectors, [category])
+        except Exception as e:
+            logging.warning(f"Adding a category example to the kNN index failed: {str(e)}")
+
+    async def rebuild(self, embed=_embed) -> int:
+        """Rebuilds from every labelled example, re-using vectors already indexed. Returns the row count."""
+        pool = await get_pool()
+        async with pool.acquire() as conn, time_db("category_index_examples"):
+            rows = await conn.fetch(LABELLED_EXAMPLES_SQL, CATEGORY_FEEDBACK_MIN_USERS)
+
+        examples = {row["description_key"]: row["category"] for row in rows if row["category"] in VALID_CATEGORIES}
+
+        current = self._index
+        known = {key: current.vector(key) for key in examples if current.vector(key) is not None}
+        new_keys = [key for key in examples if key not in known]
+        new_vectors = await embed(new_keys) if new_keys else None
+
+        index = VectorIndex(model=embedding_model_name())
+        if known:
+            index.add(list(known), np.asarray(list(known.values()), dtype=np.float32), [examples[k] for k in known])
+        if new_keys:
+            index.add(new_keys, new_vectors, [examples[k] for k in new_keys])
+        self._index = index
+
+        if self._directory and len(index):
+            await asyncio.to_thread(index.save, self._directory)
+            # Serve from the mmap'd copy rather than holding the vectors twice
+            self._index = await asyncio.to_thread(VectorIndex.load, self._directory) or index
+        logging.info(f"Category kNN index rebuilt: {len(index)} examples ({len(new_keys)} newly embedded)")
+        return len(index)
+
+    def start(self):
+        if self._directory:
+            loaded = VectorIndex.load(self._directory)
+            if loaded is not None:
+                self._index = loaded
+                logging.info(f"Loaded category kNN index with {len(loaded)} examples from {self._directory}")
+        if self._task is None and self._rebuild_seconds > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        # Straight away if there is nothing loaded, then on the interval
+        if len(self._index):
+            await asyncio.sleep(self._rebuild_seconds)
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logging.error(f"Category kNN index rebuild failed: {str(e)}")
+            await asyncio.sleep(self._rebuild_seconds)
+
+
+_category_index = None
+
+
+def get_category_index() -> CategoryIndex:
+    global _category_index
+    if _category_index is None:
+        _category_index = CategoryIndex()
+    return _category_index
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the category kNN index")
+    parser.add_argument("command", choices=["rebuild", "stats"])
+    parser.add_argument("--dir", default=CATEGORY_INDEX_DIR, help="index directory (default: CATEGORY_INDEX_DIR)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if not args.dir:
+        print("❌ Set CATEGORY_INDEX_DIR or pass --dir")
+        return 2
+
+    if args.command == "stats":
+        index = VectorIndex.load(args.dir, mmap=True)
+        if index is None:
+            print(f"❌ No usable index in {args.dir}")
+            return 1
+        counts = ", ".join(f"{category} {n}" for category, n in index.counts().items())
+        print(f"✅ {len(index)} examples ({index.model}): {counts}")
+        return 0
+
+    index = CategoryIndex(directory=args.dir, rebuild_seconds=0)
+    index.start()
+    try:
+        # Embeds in this process rather than through an inference worker
+        rows = await index.rebuild(embed=lambda texts: asyncio.to_thread(
+            lambda: np.asarray(embed_texts(texts), dtype=np.float32)
+        ))
+    finally:
+        from app.db.pool import close_pool
+
+        await close_pool()
+    print(f"✅ Rebuilt category kNN index with {rows} examples in {args.dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
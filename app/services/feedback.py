@@ -0,0 +1,82 @@
+from app.db.pool import get_pool
+from app.metrics import time_db
+from app.schemas import FeedbackItemStatus
+from app.services import category_cache
+from app.services.category_index import get_category_index
+from app.services.scenario_cache import scenario_cache
+
+FEEDBACK_COLUMNS = ["user_id", "conversation_id", "feedback_text", "rating"]
+
+
+async def submit_feedback(payload) -> bool:
+    pool = await get_pool()
+
+    # Ownership check and insert in one round-trip; nothing is inserted for someone else's conversation
+    async with pool.acquire() as conn, time_db("feedback_insert"):
+        status = await conn.execute("""
+            INSERT INTO conversation_feedback (user_id, conversation_id, feedback_text, rating)
+            SELECT $1, $2, $3, $4
+            WHERE EXISTS (
+                SELECT 1 FROM conversation_logs WHERE id = $2 AND user_id = $1
+            )
+        """, payload.user_id, payload.conversation_id, payload.feedback_text, payload.rating)
+
+    return int(status.split()[-1]) == 1
+
+
+async def submit_feedback_batch(items: list) -> list:
+    pool = await get_pool()
+
+    async with pool.acquire() as conn, time_db("feedback_batch"):
+        async with conn.transaction():
+            # One set-based ownership check for the whole batch
+            owned_rows = await conn.fetch("""
+                SELECT c.id, c.user_id
+                FROM conversation_logs c
+                JOIN unnest($1::bigint[], $2::bigint[]) AS i(conversation_id, user_id)
+                  ON c.id = i.conversation_id AND c.user_id = i.user_id
+            """, [item.conversation_id for item in items], [item.user_id for item in items])
+            owned = {(row["id"], row["user_id"]) for row in owned_rows}
+
+            records = [
+                (item.user_id, item.conversation_id, item.feedback_text, item.rating)
+                for item in items if (item.conversation_id, item.user_id) in owned
+            ]
+            if records:
+                await conn.copy_records_to_table("conversation_feedback", records=records, columns=FEEDBACK_COLUMNS)
+
+    return [
+        FeedbackItemStatus(index=i, conversation_id=item.conversation_id, status="success")
+        if (item.conversation_id, item.user_id) in owned
+        else FeedbackItemStatus(index=i, conversation_id=item.conversation_id, status="not_found",
+                                message="Conversation not found")
+        for i, item in enumerate(items)
+    ]
+
+
+async def submit_category_feedback(payload) -> None:
+    pool = await get_pool()
+
+    async with pool.acquire() as conn, time_db("category_feedback"):
+        async with conn.transaction():
+            await conn.execute("""
+                INSERT INTO category_feedback (user_id, transaction_id, description, category, description_key)
+                VALUES ($1, $2, $3, $4, $5)
+            """, payload.user_id, payload.transaction_id, payload.description, payload.category,
+                category_cache.normalize_description(payload.description))
+
+            if payload.transaction_id is not None:
+                await conn.execute("""
+                    UPDATE transactions SET category = $1 WHERE id = $2 AND user_id = $3
+                """, payload.category, payload.transaction_id, payload.user_id)
+
+            # Once enough users agree, later categorizations of this merchant use it instead of the model
+            promoted = await category_cache.promote_feedback(conn, payload.description, payload.category)
+
+    if promoted:
+        # A labelled example for the kNN classifier from now on, not just after the next rebuild
+        get_category_index().learn(payload.description, payload.category)
+
+    if payload.transaction_id is not None:
+        # The user's transactions changed, so cached scenarios are stale
+        scenario_cache.invalidate_user(payload.user_id)
@@ -1,77 +1,181 @@
-from llama_cpp import Llama
 import re
 import json
-
-llm = Llama(
-    model_path="models/mistral-7b-instruct-v0.2.Q5_K_M.gguf",
-    n_ctx=4096,
-    n_threads=8,
-    n_gpu_layers=0
-)
+import os
+from functools import lru_cache
+from app.engine.executor import get_executor, run_completion, stream_completion, current_affinity
+from app.engine.generation import InferenceRequest
+from app.engine.grammar import SCHEMA_STRING_TOKENS, schema_token_budget
+from app.engine.registry import get_tokenizer
+from app.engine.prefix_cache import register_prefix
+from app.schemas import Scenario
+from app.config.engine_config import TASK_PROFILES
+from app.services.scenario_cache import scenario_cache
+from app.services.scenario_packer import Section, count_tokens, pack_sections, PACK_MARGIN
+from app import metrics
 
 SOURCE_MODEL = "Mistral-7B-Q4"
+# Decoding is constrained to this schema, so output is exactly one Scenario object
+SCENARIO_SCHEMA = json.dumps(Scenario.model_json_schema())
+# The schema-derived budget never goes below this: long recommendations must not be cut off
+SCENARIO_MIN_OUTPUT_TOKENS = int(os.getenv("LLM_SCENARIO_MIN_OUTPUT_TOKENS", "1024"))
+# Anything that changes the output for the same prompt belongs in the cache key
+MODEL_IDENTITY = (f"{TASK_PROFILES['scenario']}:{SCHEMA_STRING_TOKENS}:{SCENARIO_MIN_OUTPUT_TOKENS}:"
+                  f"{SCENARIO_SCHEMA}")
+
+# Static instructions first so their KV state is reused across requests
+SCENARIO_INSTRUCTIONS = (
+    "Instructions:\n"
+    "- Provide scenario analysis based on actual transactions and hypothetical changes.\n"
+    "- Highlight potential tax implications.\n"
+    "- Suggest strategies for cash flow, savings, or expense management.\n"
+    "- Simulate the impact of any proposed changes the user mentions.\n"
+    "- Return your response as a flat JSON object with the following keys:\n"
+    "  - recommendations: string\n"
+    "  - tax_implications: string\n"
+    "  - cash_flow_projection: object with keys:\n"
+    "      - initial_impact: float\n"
+    "      - estimated_tax_savings: float or null\n"
+    "      - net_effect: float or null\n"
+    "Do not include nested objects, lists, or additional fields. Do not format as dialogue or markdown.\n\n"
+)
+register_prefix("scenario", SCENARIO_INSTRUCTIONS)
 
 def build_scenario_prompt(user_request: str, recent_summary: str, agg_summary: str, hypothetical_summary: str, summary_text: str) -> str:
     return (
-        f"User request: {user_request}\n\n"
+        SCENARIO_INSTRUCTIONS
+        + f"User request:\n{user_request}\n\n"
         f"Recent transactions (detailed):\n{recent_summary}\n\n"
         f"Older transactions (aggregated by month/category):\n{agg_summary}\n\n"
         f"Hypothetical changes:\n{hypothetical_summary}\n\n"
-        f"Summary:\n{summary_text}\n\n"
-        "Instructions:\n"
-        "- Provide scenario analysis based on actual transactions and hypothetical changes.\n"
-        "- Highlight potential tax implications.\n"
-        "- Suggest strategies for cash flow, savings, or expense management.\n"
-        "- Simulate the impact of any proposed changes the user mentions.\n"
-        "- Return your response as a flat JSON object with the following keys:\n"
-        "  - recommendations: string\n"
-        "  - tax_implications: string\n"
-        "  - cash_flow_projection: object with keys:\n"
-        "      - initial_impact: float\n"
-        "      - estimated_tax_savings: float or null\n"
-        "      - net_effect: float or null\n"
-        "Do not include nested objects, lists, or additional fields. Do not format as dialogue or markdown."
+        f"Summary:\n{summary_text}\n"
+        "Response (flat JSON object):\n"
     )
 
-async def generate_scenario(full_prompt: str) -> dict:
-    response = llm(full_prompt, max_tokens=1024)
-
-    def extract_json_block(text: str) -> dict:
-        start = text.find('{')
-        if start == -1:
-            return {}
-
-        brace_count = 0
-        for i in range(start, len(text)):
-            if text[i] == '{':
-                brace_count += 1
-            elif text[i] == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    try:
-                        return json.loads(text[start:i+1])
-                    except json.JSONDecodeError as e:
-                        print("⚠️ JSON parse error:", e)
-                    break
+def pack_scenario_prompt(transactions: list, recent_rows: list, aggregate_rows: list,
+                         hypothetical_changes: list, summary_text: str) -> str:
+    """Builds the prompt with as much detail as the context leaves room for.
+
+    Priority: hypothetical changes, recent transactions, older aggregates, then the
+    client's own transactions. Sections that do not fit in full are summarised by category.
+    """
+    hypothetical = Section(
+        hypothetical_changes,
+        lambda c: f"- {c.description} (£{c.amount}) [{(c.category or 'uncategorized').lower()}]",
+        lambda c: (c.category or "uncategorized").lower(), lambda c: c.amount,
+        "changes", "No hypothetical changes."
+    )
+    recent = Section(
+        recent_rows,
+        lambda tx: f"- {tx['date'].strftime('%Y-%m-%d')}: {tx['description']} (£{tx['amount']}) [{tx['category']}]",
+        lambda tx: tx["category"], lambda tx: tx["amount"],
+        "transactions", "No recent transactions."
+    )
+    aggregates = Section(
+        aggregate_rows,
+        lambda row: f"- {row['month']} | {row['category']}: £{row['total_amount']}",
+        lambda row: row["category"], lambda row: row["total_amount"],
+        "months", "No older transactions."
+    )
+    client = Section(
+        transactions,
+        lambda tx: f"- {tx.date}: {tx.description} (£{tx.amount}) [{tx.tax_category}]",
+        lambda tx: tx.tax_category, lambda tx: tx.amount,
+        "transactions", "No transactions provided."
+    )
+
+    # Whatever the instructions, summary and the schema-sized answer leave over
+    frame = build_scenario_prompt("", "", "", "", summary_text)
+    budget = TASK_PROFILES["scenario"].n_ctx - count_tokens(frame) - scenario_output_budget() - PACK_MARGIN
+
+    hypothetical_text, recent_text, aggregate_text, client_text = pack_sections(
+        [hypothetical, recent, aggregates, client], budget
+    )
+    return build_scenario_prompt(client_text, recent_text, aggregate_text, hypothetical_text, summary_text)
+
+
+def extract_json_block(text: str) -> dict:
+    start = text.find('{')
+    if start == -1:
         return {}
 
+    brace_count = 0
+    for i in range(start, len(text)):
+        if text[i] == '{':
+            brace_count += 1
+        elif text[i] == '}':
+            brace_count -= 1
+            if brace_count == 0:
+                try:
+                    return json.loads(text[start:i+1])
+                except json.JSONDecodeError as e:
+                    print("⚠️ JSON parse error:", e)
+                break
+    return {}
+
+
+def fallback_scenario() -> dict:
+    return {
+        "recommendations": "Unable to generate scenario.",
+        "tax_implications": "Please try again or refine your request.",
+        "cash_flow_projection": {
+            "initial_impact": -900.0,
+            "estimated_tax_savings": None,
+            "net_effect": None
+        }
+    }
+
+
+@lru_cache(maxsize=1)
+def scenario_output_budget() -> int:
+    return max(schema_token_budget(get_tokenizer("scenario"), SCENARIO_SCHEMA), SCENARIO_MIN_OUTPUT_TOKENS)
+
+
+def scenario_request(full_prompt: str, session_id: str = None) -> InferenceRequest:
+    # The prompt was packed to leave this much; generation usually ends earlier, when the object closes
+    return InferenceRequest(task="scenario", prompt=full_prompt, max_tokens=scenario_output_budget(),
+                            json_schema=SCENARIO_SCHEMA, stop_at_json_end=True, session_id=session_id)
+
+
+async def generate_scenario(full_prompt: str, session_id: str = None) -> dict:
+    # A session's turns run where its previous turn's KV state is
+    reset = current_affinity.set(session_id)
+    try:
+        response, timings = await get_executor().submit(run_completion, scenario_request(full_prompt, session_id))
+    finally:
+        current_affinity.reset(reset)
 
     raw_text = response["choices"][0]["text"]
     parsed = extract_json_block(raw_text)
-
     if not parsed:
-        parsed = {
-            "recommendations": "Unable to generate scenario.",
-            "tax_implications": "Please try again or refine your request.",
-            "cash_flow_projection": {
-                "initial_impact": -900.0,
-                "estimated_tax_savings": None,
-                "net_effect": None
-            }
-        }
+        metrics.json_parse_failed("scenario", response["model"])
 
     return {
-        "response": parsed,
+        "response": parsed or fallback_scenario(),
+        "parsed": bool(parsed),
         "source_model": SOURCE_MODEL,
-        "confidence": None
-    }
\ No newline at end of file
+        "confidence": None,
+        "timings": timings
+    }
+
+
+def scenario_cache_key(full_prompt: str) -> str:
+    return scenario_cache.key(full_prompt, MODEL_IDENTITY)
+
+
+async def generate_scenario_cached(user_id: int, full_prompt: str, session_id: str = None) -> dict:
+    # Identical prompts share one generation and reuse its result until the TTL expires
+    return await scenario_cache.get_or_generate(
+        scenario_cache_key(full_prompt),
+        user_id,
+        lambda: generate_scenario(full_prompt, session_id),
+        cacheable=lambda result: result["parsed"]
+    )
+
+
+def stream_scenario(full_prompt: str, session_id: str = None):
+    # Yields raw text pieces as llama.cpp produces them; callers parse the joined text
+    reset = current_affinity.set(session_id)
+    try:
+        return get_executor().stream(stream_completion, scenario_request(full_prompt, session_id))
+    finally:
+        current_affinity.reset(reset)
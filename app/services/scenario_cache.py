@@ -0,0 +1,87 @@
+# app/services/scenario_cache.py
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from app.engine.cancellation import SharedCancelToken, current_cancel
+
+SCENARIO_CACHE_TTL_SECONDS = int(os.getenv("SCENARIO_CACHE_TTL_SECONDS", "900"))
+SCENARIO_CACHE_SIZE = int(os.getenv("SCENARIO_CACHE_SIZE", "1000"))
+
+
+class ScenarioCache:
+    """Caches scenario generations by prompt + model and shares in-flight generations.
+
+    The prompt embeds the user's recent and aggregated transactions, so new DB rows
+    already change the key; invalidate_user() drops entries eagerly when this
+    service rewrites a user's transactions itself.
+    """
+
+    def __init__(self, ttl: int = SCENARIO_CACHE_TTL_SECONDS, max_entries: int = SCENARIO_CACHE_SIZE):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, user_id, result)
+        self._inflight = {}  # key -> (asyncio.Task, SharedCancelToken)
+
+    @staticmethod
+    def key(full_prompt: str, model_identity: str) -> str:
+        return hashlib.sha256(f"{model_identity}\0{full_prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: str, user_id: int, result: dict):
+        self._entries[key] = (time.monotonic() + self._ttl, user_id, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_generate(self, key: str, user_id: int, generate, cacheable) -> dict:
+        result = self.get(key)
+        if result is not None:
+            print("♻️ Scenario cache hit")
+            return result
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            # The generation is only abandoned once every caller waiting on it is gone
+            cancel = SharedCancelToken([current_cancel.get()])
+
+            async def run():
+                current_cancel.set(cancel)
+                return await generate()
+
+            task = asyncio.ensure_future(run())
+            self._inflight[key] = (task, cancel)
+            task.add_done_callback(lambda t: self._finish(key, user_id, t, cacheable))
+        else:
+            print("🔗 Joining in-flight scenario generation")
+            task, cancel = inflight
+            cancel.join(current_cancel.get())
+
+        # Shielded so one caller going away does not cancel the generation for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, user_id: int, task: asyncio.Task, cacheable):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if cacheable(task.result()):
+            self.put(key, user_id, task.result())
+
+    def invalidate_user(self, user_id: int):
+        for key in [k for k, (_, owner, _) in self._entries.items() if owner == user_id]:
+            del self._entries[key]
+
+
+scenario_cache = ScenarioCache()
@@ -0,0 +1,129 @@
+# app/services/scenario_packer.py
+import os
+from functools import lru_cache
+
+from app.engine.registry import get_tokenizer
+
+# Slack for separators and token merges across line boundaries
+PACK_MARGIN = int(os.getenv("SCENARIO_PACK_MARGIN", "64"))
+
+
+@lru_cache(maxsize=50000)
+def count_tokens(text: str) -> int:
+    # Rows and category totals repeat across requests, so counts are cached per line
+    tokenizer = get_tokenizer("scenario")
+    return len(tokenizer.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+
+def lines_cost(lines: list) -> int:
+    return sum(count_tokens(line + "\n") for line in lines)
+
+
+class Section:
+    """Rows for one prompt section, renderable in full or as per-category totals."""
+
+    def __init__(self, rows: list, format_row, category_of, amount_of, unit: str, empty: str):
+        self.rows = rows
+        self.format_row = format_row
+        self.category_of = category_of
+        self.amount_of = amount_of
+        self.unit = unit
+        self.empty = empty
+
+    def full(self) -> list:
+        return [self.format_row(row) for row in self.rows]
+
+    def compact(self, rows: list = None) -> list:
+        rows = self.rows if rows is None else rows
+        totals, counts = {}, {}
+        for row in rows:
+            category = self.category_of(row)
+            totals[category] = totals.get(category, 0) + float(self.amount_of(row))
+            counts[category] = counts.get(category, 0) + 1
+        # Largest categories first, so trimming drops the least significant ones
+        ordered = sorted(totals, key=lambda c: abs(totals[c]), reverse=True)
+        return [f"- {c}: £{totals[c]:.2f} total ({counts[c]} {self.unit})" for c in ordered]
+
+    def mixed(self, detailed: int, full: list = None) -> list:
+        # The first rows in detail, the rest folded into totals
+        full = self.full() if full is None else full
+        rest = self.compact(self.rows[detailed:])
+        if not rest:
+            return full
+        return full[:detailed] + [f"Remaining {len(self.rows) - detailed} {self.unit}, totals by category:"] + rest
+
+
+def _best_mixed(section: Section, budget: int) -> list:
+    """The most detailed rendering of section that fits budget, or None."""
+    full = section.full()
+    if lines_cost(full) <= budget:
+        return full
+
+    # More detail costs more tokens, so binary search the number of detailed rows
+    best, low, high = None, 0, len(full) - 1
+    while low <= high:
+        detailed = (low + high) // 2
+        lines = section.mixed(detailed, full)
+        if lines_cost(lines) <= budget:
+            best, low = lines, detailed + 1
+        else:
+            high = detailed - 1
+    return best
+
+
+def _trim(lines: list, budget: int, note) -> list:
+    """The most of lines that fits budget together with note(count left out), or nothing."""
+    for kept in range(len(lines) - 1, -1, -1):
+        trimmed = lines[:kept] + [note(len(lines) - kept)]
+        if lines_cost(trimmed) <= budget:
+            return trimmed
+    return []
+
+
+def pack_sections(sections: list, budget: int) -> list:
+    """Renders sections (highest priority first) to fit budget tokens; returns one text per section.
+
+    Every section starts in its cheaper rendering, usually the per-category totals; the remaining
+    budget then upgrades compacted sections to full detail in priority order. Only if that does
+    not fit are rows left out of the lowest-priority sections, with a note that counts against
+    the budget too.
+    """
+    rendered, compacted = [], []
+    for section in sections:
+        full, compact = section.full(), section.compact()
+        # Totals are usually shorter, but not for a few rows in as many categories
+        cheaper_full = lines_cost(full) <= lines_cost(compact)
+        rendered.append(full if cheaper_full else compact)
+        compacted.append(not cheaper_full)
+    # A section without rows renders its placeholder, which takes room as well
+    remaining = budget - sum(lines_cost(lines) if section.rows else count_tokens(section.empty + "\n")
+                             for lines, section in zip(rendered, sections))
+
+    trimmed = [False] * len(sections)
+    for i in range(len(sections) - 1, -1, -1):
+        # Over budget: trim from the lowest priority up
+        if remaining >= 0:
+            break
+        if not rendered[i]:
+            continue
+        if compacted[i]:
+            note = lambda omitted: f"- ({omitted} smaller categories omitted)"
+        else:
+            note = lambda omitted, unit=sections[i].unit: f"- ({omitted} more {unit} omitted)"
+        current = lines_cost(rendered[i])
+        rendered[i] = _trim(rendered[i], current + remaining, note)
+        remaining += current - lines_cost(rendered[i])
+        trimmed[i] = True
+
+    for i, section in enumerate(sections):
+        if remaining <= 0 or trimmed[i] or not compacted[i]:
+            continue
+        current = lines_cost(rendered[i])
+        upgraded = _best_mixed(section, current + remaining)
+        if upgraded is not None:
+            remaining -= lines_cost(upgraded) - current
+            rendered[i] = upgraded
+
+    # Rows that did not fit at all leave the section blank rather than claiming there are none
+    return ["\n".join(lines) if lines else ("" if section.rows else section.empty)
+            for lines, section in zip(rendered, sections)]
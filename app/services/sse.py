@@ -0,0 +1,6 @@
+import json
+
+
+def sse_event(event: str, data) -> str:
+    # One Server-Sent Events frame; data is always a single JSON line
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,321 @@
+# bench/fakes.py
+#
+# Deterministic stand-ins for llama.cpp and Postgres so the benchmarks run anywhere:
+# no GPU, no model download, no database.
+import asyncio
+import json
+import random
+import time
+import zlib
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+CHARS_PER_TOKEN = 4
+EMBEDDING_DIM = 256
+# Size of a saved state per token in the context: K and V, f16, of a 7B model with 8 KV heads
+STATE_BYTES_PER_TOKEN = 2 * 2 * 32 * 8 * 128
+FILLER = "the quick brown fox jumps over the lazy dog while the budget holds steady "
+MERCHANTS = ["Tesco", "Sainsbury's", "Amazon", "Apple Store", "Netflix", "Spotify", "Uber", "Odeon", "Currys", "Boots"]
+CATEGORIES = ["groceries", "technology", "entertainment", "transport", "utilities"]
+# Extra cost of each additional token in a verification batch, relative to decoding one token:
+# CPU decoding is bound by reading the weights, which a short batch does only once
+VERIFY_TOKEN_COST = 0.15
+# Fake "draft" mode: chance the small model guesses each next token, and its cost per guess
+DRAFT_ACCEPT_RATE = 0.6
+DRAFT_TOKEN_COST = 0.15
+
+
+class FakeGrammar:
+    """Stands in for LlamaGrammar: keeps the schema so the fake can emit matching JSON."""
+
+    def __init__(self, schema_json: str, cache: bool = True):
+        self.schema = json.loads(schema_json)
+
+
+class FakeLlama:
+    """Mimics the parts of llama_cpp.Llama the app uses, with configurable latency.
+
+    Prompt evaluation costs prompt_token_latency per token, except for the leading tokens
+    already in the context (as llama.cpp keeps them), and each generated token costs
+    token_latency. Output is deterministic for a given prompt, speculative or not:
+    speculation only changes how many tokens each (slightly dearer) decoding step yields.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int, token_latency: float = 0.02,
+                 prompt_token_latency: float = 0.0005, completion_tokens: int = 128, string_tokens: int = 48,
+                 speculative: str = "off"):
+        self.model_path = model_path
+        self.context_params = SimpleNamespace(n_ctx=n_ctx)
+        self.metadata = {"general.name": "fake-llama"}
+        self.cache = None
+        self.speculative = speculative
+        self.draft_model = None if speculative == "off" else speculative
+        self.token_latency = token_latency
+        self.prompt_token_latency = prompt_token_latency
+        self.completion_tokens = completion_tokens
+        self.string_tokens = string_tokens
+        self._input_ids = []
+
+    @property
+    def input_ids(self):
+        import numpy as np
+
+        return np.array(self._input_ids, dtype=np.intc)
+
+    def save_state(self):
+        return SimpleNamespace(input_ids=self.input_ids, scores=None,
+                               llama_state_size=len(self._input_ids) * STATE_BYTES_PER_TOKEN)
+
+    def load_state(self, state):
+        time.sleep(state.llama_state_size / 1e10)
+        self._input_ids = state.input_ids.tolist()
+
+    def n_ctx(self) -> int:
+        return self.context_params.n_ctx
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> list:
+        count = -(-len(text) // CHARS_PER_TOKEN)
+        return ([1] if add_bos else []) + [2 + (sum(text[i:i + CHARS_PER_TOKEN]) % 31000)
+                                           for i in range(0, count * CHARS_PER_TOKEN, CHARS_PER_TOKEN)]
+
+    def embed(self, texts, normalize: bool = False, truncate: bool = True) -> list:
+        # Hashed character trigrams: similar descriptions get similar vectors
+        vectors = []
+        for text in [texts] if isinstance(texts, str) else texts:
+            time.sleep(len(self.tokenize(text.encode("utf-8"))) * self.prompt_token_latency)
+            vector = [0.0] * EMBEDDING_DIM
+            padded = f"  {text.lower()} "
+            for i in range(len(padded) - 2):
+                vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % EMBEDDING_DIM] += 1.0
+            norm = sum(v * v for v in vector) ** 0.5 or 1.0
+            vectors.append([v / norm for v in vector] if normalize else vector)
+        return vectors
+
+    def __call__(self, prompt, max_tokens: int = 16, stop=None, stream: bool = False, grammar=None, **kwargs):
+        chunks = self._generate(prompt, max_tokens, stop, grammar)
+        if stream:
+            return ({"choices": [{"text": piece}]} for piece in chunks)
+        return {"choices": [{"text": "".join(chunks)}], "model": self.model_path}
+
+    def _generate(self, prompt, max_tokens, stop, grammar):
+        # Token lists are accepted as well as text, like llama.cpp
+        tokens = prompt if isinstance(prompt, list) else self.tokenize(prompt.encode("utf-8"))
+        # llama.cpp re-evaluates at least the last prompt token
+        kept = 0
+        while kept < min(len(tokens) - 1, len(self._input_ids)) and self._input_ids[kept] == tokens[kept]:
+            kept += 1
+        time.sleep((len(tokens) - kept) * self.prompt_token_latency)
+        self._input_ids = list(tokens)
+
+        seed = sum(prompt) if isinstance(prompt, list) else sum(prompt.encode("utf-8"))
+        rng = random.Random(seed)
+        if grammar is not None:
+            text = json.dumps(self._instance(grammar.schema, grammar.schema, rng))
+        else:
+            text = self._filler(self.completion_tokens, rng)
+        for s in stop or []:
+            if s in text:
+                text = text[:text.index(s)]
+
+        pieces = [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)][:max_tokens]
+        i = 0
+        while i < len(pieces):
+            drafted, accepted = self._speculate(pieces, i, rng)
+            # One decoding step verifies the drafted tokens and yields the accepted ones plus one
+            time.sleep(self.token_latency * (1 + VERIFY_TOKEN_COST * drafted))
+            for piece in pieces[i:i + accepted + 1]:
+                self._input_ids += self.tokenize(piece.encode("utf-8"), add_bos=False)
+                yield piece
+            i += accepted + 1
+
+    def _speculate(self, pieces: list, i: int, rng: random.Random) -> tuple:
+        """(tokens drafted, tokens of them the model would have produced) at output piece i."""
+        from app.config.engine_config import DRAFT_TOKENS, PROMPT_LOOKUP_NGRAM, PROMPT_LOOKUP_TOKENS
+
+        if self.speculative == "draft":
+            time.sleep(self.token_latency * DRAFT_TOKEN_COST * DRAFT_TOKENS)
+            accepted = 0
+            while accepted < DRAFT_TOKENS and rng.random() < DRAFT_ACCEPT_RATE:
+                accepted += 1
+            return DRAFT_TOKENS, min(accepted, len(pieces) - i - 1)
+
+        if self.speculative != "prompt-lookup" or i < PROMPT_LOOKUP_NGRAM:
+            return 0, 0
+        # Character-level n-gram lookup over the output so far (the fake tokens cannot be
+        # mapped back to prompt text): repeated JSON structure is what it finds
+        done = "".join(pieces[:i])
+        ngram = done[-PROMPT_LOOKUP_NGRAM * CHARS_PER_TOKEN:]
+        found = done.rfind(ngram, 0, len(done) - 1)
+        if found < 0:
+            return 0, 0
+        start = found + len(ngram)
+        proposal = done[start:start + PROMPT_LOOKUP_TOKENS * CHARS_PER_TOKEN]
+        drafted = len(proposal) // CHARS_PER_TOKEN
+        accepted = 0
+        while (accepted < drafted and i + accepted + 1 < len(pieces)
+               and proposal[accepted * CHARS_PER_TOKEN:(accepted + 1) * CHARS_PER_TOKEN] == pieces[i + accepted]):
+            accepted += 1
+        return drafted, accepted
+
+    def _filler(self, tokens: int, rng: random.Random) -> str:
+        start = rng.randrange(len(FILLER))
+        text = (FILLER * (tokens * CHARS_PER_TOKEN // len(FILLER) + 2))[start:]
+        return text[:tokens * CHARS_PER_TOKEN].strip()
+
+    def _instance(self, schema: dict, root: dict, rng: random.Random):
+        # Just enough JSON Schema for the app's pydantic-generated schemas
+        if "$ref" in schema:
+            return self._instance(root["$defs"][schema["$ref"].split("/")[-1]], root, rng)
+        if "anyOf" in schema:
+            return self._instance(schema["anyOf"][0], root, rng)
+        if "enum" in schema:
+            return rng.choice(schema["enum"])
+        kind = schema.get("type")
+        if kind == "object":
+            return {name: self._instance(prop, root, rng) for name, prop in schema.get("properties", {}).items()}
+        if kind == "array":
+            items = schema.get("items", {})
+            ids = items.get("properties", {}).get("id", {}).get("enum")
+            if ids is not None:
+                # A categorization batch: one prediction per allowed id
+                return [dict(self._instance(items, root, rng), id=i) for i in ids]
+            return [self._instance(items, root, rng) for _ in range(3)]
+        if kind == "string":
+            return self._filler(self.string_tokens, rng)
+        if kind == "integer":
+            return rng.randint(0, 1000)
+        if kind == "number":
+            return round(rng.uniform(0.5, 1.0), 2)
+        if kind == "boolean":
+            return True
+        return None
+
+
+class FakeStatement:
+    def __init__(self, conn, sql: str):
+        self._conn = conn
+        self._sql = sql
+
+    async def fetch(self, *args):
+        return await self._conn.fetch(self._sql, *args)
+
+
+class FakeConnection:
+    """Answers the app's queries with deterministic per-user rows after a fixed latency."""
+
+    def __init__(self, latency: float, recent_rows: int, rollup_rows: int, examples: list):
+        self._latency = latency
+        self._recent_rows = recent_rows
+        self._rollup_rows = rollup_rows
+        self._examples = examples
+        self._statements = {}
+
+    def statements(self) -> dict:
+        return self._statements
+
+    async def prepare(self, sql: str):
+        return FakeStatement(self, sql)
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def fetch(self, sql: str, *args):
+        await asyncio.sleep(self._latency)
+        if "monthly_category_rollup" in sql:
+            return self._rollup(args[0])[:args[3]]
+        if "FROM transactions" in sql:
+            return self._recent(args[0])[:args[2]]
+        if "FROM category_feedback" in sql:
+            return self._examples
+        if "FROM conversation_logs" in sql:
+            # Ownership check: everything the batch asks about belongs to its user
+            return [{"id": c, "user_id": u} for c, u in zip(args[0], args[1])]
+        return []
+
+    async def fetchrow(self, sql: str, *args):
+        # No categorization jobs are ever queued
+        await asyncio.sleep(self._latency)
+        return None
+
+    async def fetchval(self, sql: str, *args):
+        await asyncio.sleep(self._latency)
+        return None
+
+    async def execute(self, sql: str, *args):
+        await asyncio.sleep(self._latency)
+        return "INSERT 0 1"
+
+    async def executemany(self, sql: str, args):
+        await asyncio.sleep(self._latency)
+
+    async def copy_records_to_table(self, table: str, records, columns=None):
+        await asyncio.sleep(self._latency)
+
+    def _recent(self, user_id: int) -> list:
+        rng = random.Random(user_id)
+        now = datetime.now()
+        return [
+            {
+                "date": now - timedelta(days=i),
+                "description": f"{rng.choice(MERCHANTS)} #{rng.randint(100, 999)}",
+                "amount": Decimal(rng.uniform(-120, 60)).quantize(Decimal("0.01")),
+                "category": rng.choice(CATEGORIES),
+            }
+            for i in range(self._recent_rows)
+        ]
+
+    def _rollup(self, user_id: int) -> list:
+        rng = random.Random(-user_id)
+        rows = []
+        for i in range(self._rollup_rows):
+            # Whole months before the current one, newest first, one row per category
+            month = datetime.now().replace(day=1)
+            for _ in range(i // len(CATEGORIES) + 1):
+                month = (month - timedelta(days=1)).replace(day=1)
+            rows.append({
+                "month": month.strftime("%Y-%m"),
+                "category": CATEGORIES[i % len(CATEGORIES)],
+                "total_amount": Decimal(rng.uniform(-900, 300)).quantize(Decimal("0.01")),
+            })
+        return rows
+
+
+class FakePool:
+    def __init__(self, latency: float = 0.002, recent_rows: int = 20, rollup_rows: int = 12, examples: list = None):
+        self._latency = latency
+        self._recent_rows = recent_rows
+        self._rollup_rows = rollup_rows
+        # category_feedback rows ({"description", "category"}) for the kNN index
+        self._examples = examples or []
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConnection(self._latency, self._recent_rows, self._rollup_rows, self._examples)
+
+    async def close(self):
+        pass
+
+
+def install_fake_engine(**llama_kwargs):
+    """Routes every model load (and the tokenizer) to FakeLlama."""
+    from app.engine import embeddings, generation, registry
+
+    registry._load = lambda model_path, n_ctx, speculative="off", *args: FakeLlama(
+        model_path, n_ctx, speculative=speculative, **llama_kwargs
+    )
+    registry._load_tokenizer = lambda model_path: FakeLlama(model_path, 0, **llama_kwargs)
+    embeddings._load = lambda model_path, n_ctx: FakeLlama(model_path, n_ctx, **llama_kwargs)
+    generation.grammar_from_schema = FakeGrammar
+
+
+def install_fake_db(**pool_kwargs):
+    # The lifespan's init_pool() keeps an existing pool, so this one is used throughout
+    from app.db import pool
+
+    pool._pool = FakePool(**pool_kwargs)
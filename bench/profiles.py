@@ -0,0 +1,125 @@
+# bench/profiles.py
+#
+# Engine profile A/B: runs the same prompts through two profiles (see LLM_ENGINE_PROFILES) and
+# reports latency for each and how often their answers agree. Categorize answers are compared
+# per transaction, everything else on the whole output.
+#
+#   python -m bench.profiles --profiles profiles.json --task categorize --b categorize-small
+#   python -m bench.profiles --profiles profiles.json --task scenario --a scenario --b scenario-q4 --prompts 20
+#
+# The fake engine answers the same whatever the profile; it only exercises the harness.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from bench.run import log, percentile
+from bench.speculative import TASKS, build_request
+
+
+def timed_generation(llm, request) -> tuple:
+    from app.engine.generation import generate_tokens
+
+    pieces = []
+    start = time.perf_counter()
+    for text in generate_tokens(llm, request):
+        pieces.append(text)
+    return "".join(pieces), len(pieces), time.perf_counter() - start
+
+
+def answers(task: str, text: str) -> dict:
+    """What counts as one answer: each transaction's category, or the whole output."""
+    if task != "categorize":
+        return {None: text.strip()}
+    try:
+        return {item["id"]: item["category"] for item in json.loads(text)}
+    except (ValueError, TypeError, KeyError):
+        return {}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare latency and agreement of two engine profiles")
+    parser.add_argument("--task", choices=TASKS, default="categorize")
+    parser.add_argument("--a", help="baseline profile (default: the task's current profile)")
+    parser.add_argument("--b", required=True, help="candidate profile")
+    parser.add_argument("--profiles", help="JSON profiles file (sets LLM_ENGINE_PROFILES)")
+    parser.add_argument("--prompts", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=20, help="transactions per prompt")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--fake", action="store_true", help="use the fake engine instead of the profiles' GGUFs")
+    parser.add_argument("--token-latency-ms", type=float, default=20.0)
+    parser.add_argument("--prompt-token-latency-ms", type=float, default=0.5)
+    parser.add_argument("--min-agreement", type=float, default=0.0, help="exit 1 below this agreement (0-1)")
+    parser.add_argument("--output", help="write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    if args.profiles:
+        # Read by app.config.engine_config at import time
+        os.environ["LLM_ENGINE_PROFILES"] = args.profiles
+    if args.fake:
+        from bench.fakes import install_fake_engine
+
+        install_fake_engine(token_latency=args.token_latency_ms / 1000,
+                            prompt_token_latency=args.prompt_token_latency_ms / 1000)
+
+    from app.config.engine_config import TASK_PROFILE_NAMES, engine_profile
+    from app.engine import registry
+
+    names = {"a": args.a or TASK_PROFILE_NAMES[args.task], "b": args.b}
+    profiles = {side: engine_profile(name, args.task) for side, name in names.items()}
+    models = {side: registry._load(*profile.load_key()) for side, profile in profiles.items()}
+
+    latencies = {side: [] for side in profiles}
+    tokens = {side: 0 for side in profiles}
+    compared = agreed = 0
+    for i in range(args.prompts):
+        outputs = {}
+        # Alternate which profile goes first so neither always inherits warm caches
+        for side in (["a", "b"] if i % 2 == 0 else ["b", "a"]):
+            request = build_request(args.task, i, random.Random(args.seed + i), args.batch_size, greedy=False)
+            request.profile = profiles[side]
+            text, count, elapsed = timed_generation(models[side], request)
+            outputs[side] = answers(args.task, text)
+            latencies[side].append(elapsed)
+            tokens[side] += count
+
+        # An answer one side is missing (unparseable output) counts as a disagreement
+        keys = set(outputs["a"]) | set(outputs["b"])
+        compared += len(keys)
+        agreed += sum(1 for key in keys if key in outputs["a"] and outputs["a"][key] == outputs["b"].get(key))
+        if outputs["a"] != outputs["b"]:
+            log(f"Prompt {i}: profiles disagree")
+
+    results = {"task": args.task, "engine": "fake" if args.fake else "gguf", "prompts": args.prompts,
+               "agreement": agreed / compared if compared else None}
+    for side, profile in profiles.items():
+        total = sum(latencies[side])
+        results[side] = {
+            "profile": names[side],
+            "model_path": profile.path,
+            "p50_ms": percentile(latencies[side], 50) * 1000,
+            "p95_ms": percentile(latencies[side], 95) * 1000,
+            "tokens_per_sec": tokens[side] / total if total else 0.0,
+        }
+
+    print(f"{'':<3}{'profile':<24}{'p50 ms':>10}{'p95 ms':>10}{'tok/s':>9}  model")
+    for side in profiles:
+        r = results[side]
+        print(f"{side:<3}{r['profile']:<24}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['tokens_per_sec']:>9.1f}"
+              f"  {r['model_path']}")
+    if results["agreement"] is not None:
+        print(f"agreement {results['agreement']:.1%} ({agreed}/{compared} answers), "
+              f"b's p50 is x{results['b']['p50_ms'] / results['a']['p50_ms']:.2f} a's")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if results["agreement"] is not None and results["agreement"] < args.min_agreement:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
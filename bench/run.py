@@ -0,0 +1,444 @@
+# bench/run.py
+#
+# Load and latency benchmarks for /llm/infer, /categorize/ and /scenario/.
+#
+#   python -m bench.run                                   # all workloads, in-process, fake llama + fake DB
+#   python -m bench.run --workloads categorize --concurrency 16 --requests 200
+#   python -m bench.run --gguf models/tiny.gguf           # real llama.cpp, fake DB
+#   python -m bench.run --url http://localhost:8000       # a server that is already running
+#   python -m bench.run --output results.json --baseline bench/baseline.json
+#
+# Exits 1 when a metric regresses past --tolerance against the baseline.
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import string
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from bench.fakes import MERCHANTS, CATEGORIES
+
+# name -> (path, streams SSE, metrics endpoint label)
+WORKLOADS = {
+    "infer": ("/llm/infer", False, "infer"),
+    "infer-stream": ("/llm/infer/stream", True, "infer"),
+    "categorize": ("/categorize/", False, "categorize"),
+    "scenario": ("/scenario/", False, "scenario"),
+    "scenario-stream": ("/scenario/stream", True, "scenario"),
+}
+
+# (metric path, better direction) compared against the baseline
+CHECKS = [
+    ("rps", "higher"),
+    ("latency_ms.p50", "lower"),
+    ("latency_ms.p95", "lower"),
+    ("latency_ms.p99", "lower"),
+    ("ttft_ms.p95", "lower"),
+    ("tokens_per_sec", "higher"),
+]
+# Settings that must match for a baseline comparison to mean anything
+COMPARABLE_SETTINGS = ["mode", "concurrency", "requests", "batch_size", "repeat_merchants", "token_latency_ms",
+                       "prompt_token_latency_ms", "completion_tokens", "db_latency_ms"]
+
+
+def log(message: str):
+    # stdout may be silenced while the app runs in-process
+    print(message, file=sys.stderr, flush=True)
+
+
+def merchant(rng: random.Random, unique: bool) -> str:
+    name = rng.choice(MERCHANTS)
+    if not unique:
+        return f"{name} #{rng.randint(1000, 9999)}"
+    # The merchant cache ignores digits, so a letters-only suffix is what makes a description new
+    return f"{name} {''.join(rng.choice(string.ascii_lowercase) for _ in range(8))}"
+
+
+def build_body(workload: str, i: int, rng: random.Random, args):
+    if workload.startswith("infer"):
+        return {
+            "prompt": f"Request {i}: what happens if I spend £{rng.randint(20, 400)} a month at {rng.choice(MERCHANTS)}?",
+            "caller": "bench"
+        }
+    if workload == "categorize":
+        return [
+            {
+                "id": i * 1000 + j,
+                "description": merchant(rng, unique=not args.repeat_merchants),
+                "amount": round(rng.uniform(-200, -1), 2),
+                "date": "2025-08-01"
+            }
+            for j in range(args.batch_size)
+        ]
+    # Distinct users give distinct prompts, so the scenario cache does not answer for the model
+    return {
+        "user_id": i + 1,
+        "request": [
+            {
+                "date": "2025-08-01",
+                "amount": round(rng.uniform(-200, -1), 2),
+                "description": merchant(rng, unique=False),
+                "tax_category": rng.choice(CATEGORIES)
+            }
+            for _ in range(args.batch_size)
+        ],
+        "scenario_type": "general",
+        "session_id": f"bench-{i}"
+    }
+
+
+async def send(client: httpx.AsyncClient, workload: str, body) -> dict:
+    path, streams, _ = WORKLOADS[workload]
+    sample = {"ok": False, "status": None, "latency": None, "ttft": None, "tokens": 0, "decode": None}
+    start = time.perf_counter()
+    try:
+        if streams:
+            first_token_at = None
+            async with client.stream("POST", path, json=body) as response:
+                sample["status"] = response.status_code
+                ok = response.status_code == 200
+                async for line in response.aiter_lines():
+                    if line == "event: token":
+                        first_token_at = first_token_at or time.perf_counter()
+                        sample["tokens"] += 1
+                    elif line == "event: error":
+                        ok = False
+            end = time.perf_counter()
+            if first_token_at is not None:
+                sample["ttft"] = first_token_at - start
+                sample["decode"] = end - first_token_at
+        else:
+            response = await client.post(path, json=body)
+            end = time.perf_counter()
+            sample["status"] = response.status_code
+            ok = response.status_code == 200
+        sample["ok"] = ok
+        sample["latency"] = end - start
+    except httpx.HTTPError as e:
+        sample["error"] = str(e) or type(e).__name__
+    return sample
+
+
+async def drive(client: httpx.AsyncClient, workload: str, args) -> tuple:
+    """Closed loop: `concurrency` clients each send their next request as soon as the last returns."""
+    # Each workload gets its own request numbers, so e.g. /scenario/stream never hits what /scenario/ cached
+    offset = list(WORKLOADS).index(workload) * 100000
+    counter = iter(range(offset, offset + args.warmup + args.requests))
+    samples = []
+
+    def body(i: int):
+        return build_body(workload, i, random.Random(args.seed + i), args)
+
+    async def worker():
+        for i in counter:
+            samples.append(await send(client, workload, body(i)))
+
+    # Warm-up requests load the model and fill the prefix cache; they are not measured
+    for i in [next(counter) for _ in range(args.warmup)]:
+        await send(client, workload, body(i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def distribution_ms(values: list) -> dict:
+    return {
+        "p50": _ms(percentile(values, 50)),
+        "p95": _ms(percentile(values, 95)),
+        "p99": _ms(percentile(values, 99)),
+        "mean": _ms(sum(values) / len(values) if values else None),
+        "max": _ms(max(values) if values else None),
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+async def scrape_token_stats(client: httpx.AsyncClient, endpoint: str):
+    """(completion tokens, completion count, generation seconds) summed from /metrics, or None."""
+    try:
+        from prometheus_client.parser import text_string_to_metric_families
+
+        response = await client.get("/metrics")
+        response.raise_for_status()
+    except Exception:
+        return None
+
+    totals = {"llm_completion_tokens_sum": 0.0, "llm_completion_tokens_count": 0.0, "llm_generation_seconds_sum": 0.0}
+    for family in text_string_to_metric_families(response.text):
+        for sample in family.samples:
+            if sample.name in totals and sample.labels.get("endpoint") == endpoint:
+                totals[sample.name] += sample.value
+    return (totals["llm_completion_tokens_sum"], totals["llm_completion_tokens_count"],
+            totals["llm_generation_seconds_sum"])
+
+
+def summarize(samples: list, duration: float, server_tokens) -> dict:
+    ok = [s for s in samples if s["ok"]]
+    streamed = [s for s in ok if s["decode"]]
+
+    tokens_per_sec = None
+    if server_tokens and server_tokens[2] > 0:
+        # The first token of each completion belongs to prompt evaluation
+        tokens_per_sec = (server_tokens[0] - server_tokens[1]) / server_tokens[2]
+    elif streamed:
+        tokens_per_sec = sum(s["tokens"] - 1 for s in streamed) / sum(s["decode"] for s in streamed)
+
+    statuses = {}
+    for s in samples:
+        key = str(s["status"]) if s["status"] is not None else "transport_error"
+        statuses[key] = statuses.get(key, 0) + 1
+
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": len(samples) - len(ok),
+        "error_rate": round((len(samples) - len(ok)) / len(samples), 4) if samples else 0.0,
+        "statuses": statuses,
+        "duration_s": round(duration, 3),
+        "rps": round(len(ok) / duration, 3) if duration > 0 else None,
+        "latency_ms": distribution_ms([s["latency"] for s in ok]),
+        "ttft_ms": distribution_ms([s["ttft"] for s in ok if s["ttft"] is not None]) if streamed else None,
+        "tokens_per_sec": round(tokens_per_sec, 2) if tokens_per_sec is not None else None,
+    }
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float):
+    # Models load in the background after startup; measuring before that would time the load
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            response = await client.get("/health/ready")
+            if response.status_code == 200:
+                return
+            if response.json().get("status") == "failed":
+                raise RuntimeError(f"Server failed to load its models: {response.json().get('error')}")
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("Server did not become ready in time")
+        await asyncio.sleep(0.2)
+
+
+async def run_workloads(base_url: str, args) -> dict:
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        await wait_ready(client, args.timeout)
+        for workload in args.workloads:
+            endpoint = WORKLOADS[workload][2]
+            log(f"▶️ {workload}: {args.requests} requests at concurrency {args.concurrency}")
+            before = await scrape_token_stats(client, endpoint)
+            samples, duration = await drive(client, workload, args)
+            after = await scrape_token_stats(client, endpoint)
+            # Warm-up requests are inside the delta too, but only shift the token rate, not its meaning
+            server_tokens = tuple(a - b for a, b in zip(after, before)) if before and after else None
+            results[workload] = summarize(samples, duration, server_tokens)
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def in_process_server(args):
+    """Runs the app under uvicorn on a background thread with the fakes installed."""
+    if args.gguf:
+        # Read by app.config.engine_config at import time
+        os.environ["LLM_MODEL_PATH"] = args.gguf
+
+    from bench.fakes import install_fake_db, install_fake_engine
+
+    if not args.gguf:
+        install_fake_engine(
+            token_latency=args.token_latency_ms / 1000,
+            prompt_token_latency=args.prompt_token_latency_ms / 1000,
+            completion_tokens=args.completion_tokens,
+        )
+    install_fake_db(latency=args.db_latency_ms / 1000)
+
+    import logging
+    import uvicorn
+    from app.main import app
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("In-process server failed to start")
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def settings(args) -> dict:
+    return {
+        "mode": "url" if args.url else ("gguf" if args.gguf else "fake"),
+        "url": args.url,
+        "gguf": args.gguf,
+        "workloads": args.workloads,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "warmup": args.warmup,
+        "batch_size": args.batch_size,
+        "repeat_merchants": args.repeat_merchants,
+        "seed": args.seed,
+        "token_latency_ms": args.token_latency_ms,
+        "prompt_token_latency_ms": args.prompt_token_latency_ms,
+        "completion_tokens": args.completion_tokens,
+        "db_latency_ms": args.db_latency_ms,
+    }
+
+
+def _lookup(result: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(result, dict):
+            return None
+        result = result.get(part)
+    return result
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Returns a description of every metric that regressed by more than tolerance."""
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        if current["error_rate"] > previous["error_rate"] + 0.01:
+            regressions.append(f"{name} error_rate {previous['error_rate']:.2%} -> {current['error_rate']:.2%}")
+        for path, better in CHECKS:
+            old, new = _lookup(previous, path), _lookup(current, path)
+            if old is None or new is None or old == 0:
+                continue
+            if (better == "higher" and new < old * (1 - tolerance)) or (better == "lower" and new > old * (1 + tolerance)):
+                regressions.append(f"{name} {path} {old} -> {new} ({(new - old) / old:+.1%})")
+    return regressions
+
+
+def print_summary(report: dict):
+    log(f"{'workload':<16} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttft p95':>9} {'tok/s':>8} {'errors':>7}")
+    for name, r in report["results"].items():
+        ttft = (r["ttft_ms"] or {}).get("p95")
+        log(f"{name:<16} {r['rps'] or 0:>8.2f} {r['latency_ms']['p50'] or 0:>9.1f} {r['latency_ms']['p95'] or 0:>9.1f} "
+            f"{r['latency_ms']['p99'] or 0:>9.1f} {ttft if ttft is not None else '-':>9} "
+            f"{r['tokens_per_sec'] if r['tokens_per_sec'] is not None else '-':>8} {r['errors']:>7}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark server-d endpoints")
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=40, help="measured requests per workload")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=10, help="transactions per categorize/scenario request")
+    parser.add_argument("--repeat-merchants", action="store_true",
+                        help="reuse merchant names so /categorize/ is mostly answered by the merchant cache")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--timeout", type=float, default=300)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="benchmark a running server instead of an in-process one")
+    target.add_argument("--gguf", help="use a real (small) GGUF model instead of the fake engine")
+    parser.add_argument("--token-latency-ms", type=float, default=5.0, help="fake engine: per generated token")
+    parser.add_argument("--prompt-token-latency-ms", type=float, default=0.05, help="fake engine: per prompt token")
+    parser.add_argument("--completion-tokens", type=int, default=64, help="fake engine: free-text completion length")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0, help="fake DB: per statement")
+    parser.add_argument("--output", help="write results as JSON here ('-' for stdout)")
+    parser.add_argument("--baseline", help="fail if results regress against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    if args.url:
+        results = asyncio.run(run_workloads(args.url, args))
+    else:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                # The app prints per request; keep stdout for the JSON report
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            base_url = stack.enter_context(in_process_server(args))
+            results = asyncio.run(run_workloads(base_url, args))
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "settings": settings(args),
+        "results": results,
+    }
+    print_summary(report)
+
+    if args.output == "-":
+        print(json.dumps(report, indent=2))
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        log(f"📝 Results written to {args.output}")
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    mismatched = [k for k in COMPARABLE_SETTINGS if baseline.get("settings", {}).get(k) != report["settings"][k]]
+    if mismatched:
+        log(f"⚠️ Baseline was recorded with different settings: {', '.join(mismatched)}")
+
+    regressions = compare(report, baseline, args.tolerance)
+    for regression in regressions:
+        log(f"❌ {regression}")
+    log(f"{'❌' if regressions else '✅'} {len(regressions)} regressions against {args.baseline} "
+        f"(tolerance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
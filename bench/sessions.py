@@ -0,0 +1,109 @@
+# bench/sessions.py
+#
+# Session KV state reuse: several multi-turn scenario conversations take turns on one context,
+# each turn resending its session's transaction context with a new question. Reports prompt
+# evaluation time (time to first token) per turn, with session states and without.
+#
+#   python -m bench.sessions                          # fake engine
+#   python -m bench.sessions --gguf models/mistral-7b-instruct-v0.2.Q5_K_M.gguf --sessions 3 --turns 4
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from bench.fakes import CATEGORIES
+from bench.run import merchant
+
+QUESTIONS = [
+    "What happens to my cash flow if I cut discretionary spending by 10%?",
+    "And if I also cancel two subscriptions?",
+    "How would a £200 monthly pension contribution change the tax picture?",
+    "What if groceries go up by 5% next quarter?",
+    "Should I move my savings to cover the gap instead?",
+]
+
+
+def session_context(rng: random.Random, transactions: int) -> tuple:
+    lines = [f"- 2025-08-{j % 28 + 1:02d}: {merchant(rng, unique=False)} (£{rng.uniform(-200, -1):.2f}) "
+             f"[{rng.choice(CATEGORIES)}]" for j in range(transactions)]
+    months = [f"- 2025-{m:02d} | {category}: £{rng.uniform(-900, -50):.2f}"
+              for m in range(1, 8) for category in CATEGORIES]
+    return "\n".join(lines[:transactions // 2]), "\n".join(lines[transactions // 2:]), "\n".join(months)
+
+
+def timed_turn(llm, request) -> tuple:
+    from app.engine.generation import generate_tokens
+
+    start = time.perf_counter()
+    first_token_at = None
+    for _ in generate_tokens(llm, request):
+        first_token_at = first_token_at or time.perf_counter()
+    return (first_token_at or time.perf_counter()) - start, len(request.tokens)
+
+
+def run(llm, args, use_sessions: bool) -> list:
+    from app.services.scenario import build_scenario_prompt, scenario_request
+
+    contexts = [session_context(random.Random(args.seed + s), args.transactions) for s in range(args.sessions)]
+    turns = [[] for _ in range(args.turns)]
+    for turn in range(args.turns):
+        # Round robin: by the time a session comes back, the context holds someone else's prompt
+        for s, (client, recent, months) in enumerate(contexts):
+            prompt = build_scenario_prompt(client, recent, months, f"- Turn {turn} change (£-{25 * turn}.00) [other]",
+                                           QUESTIONS[turn % len(QUESTIONS)])
+            request = scenario_request(prompt, f"bench-{args.seed}-{s}" if use_sessions else None)
+            turns[turn].append(timed_turn(llm, request))
+    return turns
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure prompt evaluation of follow-up turns with session state reuse")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--transactions", type=int, default=60, help="transactions in each session's context")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--gguf", help="use a real GGUF model instead of the fake engine")
+    parser.add_argument("--token-latency-ms", type=float, default=5.0)
+    parser.add_argument("--prompt-token-latency-ms", type=float, default=0.5)
+    parser.add_argument("--output", help="write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    if args.gguf:
+        # Read by app.config.engine_config at import time
+        os.environ["LLM_MODEL_PATH"] = args.gguf
+    else:
+        from bench.fakes import install_fake_engine
+
+        install_fake_engine(token_latency=args.token_latency_ms / 1000,
+                            prompt_token_latency=args.prompt_token_latency_ms / 1000)
+
+    from app.config.engine_config import TASK_PROFILES
+    from app.engine import registry
+    from app.engine.session_cache import get_session_cache
+
+    llm = registry._load(*TASK_PROFILES["scenario"].load_key())
+    results = {"engine": args.gguf or "fake", "sessions": args.sessions, "turns": []}
+    baseline = run(llm, args, use_sessions=False)
+    reused = run(llm, args, use_sessions=True)
+
+    print(f"{'turn':<6}{'prompt tokens':>14}{'eval ms, no session':>21}{'eval ms, session':>18}")
+    for turn in range(args.turns):
+        tokens = sum(t for _, t in reused[turn]) / args.sessions
+        without = sum(s for s, _ in baseline[turn]) / args.sessions * 1000
+        with_sessions = sum(s for s, _ in reused[turn]) / args.sessions * 1000
+        results["turns"].append({"turn": turn, "prompt_tokens": tokens, "prompt_eval_ms": without,
+                                 "prompt_eval_ms_session": with_sessions})
+        print(f"{turn:<6}{tokens:>14.0f}{without:>21.1f}{with_sessions:>18.1f}")
+    results["session_cache"] = get_session_cache().stats()
+    print(f"session states: {results['session_cache']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# bench/speculative.py
+#
+# Speculative decoding A/B: greedy-generates the same prompts with speculation off and on,
+# fails if any output differs, and reports decoding tokens/sec for both.
+#
+#   python -m bench.speculative                                    # categorize prompts, fake engine
+#   python -m bench.speculative --gguf models/mistral-7b-instruct-v0.2.Q5_K_M.gguf
+#   LLM_DRAFT_MODEL_PATH=models/tiny.gguf python -m bench.speculative --task scenario --mode draft --gguf ...
+#
+# The fake engine only models the cost of verification batches; real numbers need --gguf.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from bench.fakes import CATEGORIES, MERCHANTS
+from bench.run import log, merchant
+
+TASKS = ("categorize", "scenario", "infer")
+
+
+def build_request(task: str, i: int, rng: random.Random, batch_size: int, greedy: bool = True):
+    from app.engine.generation import InferenceRequest
+
+    if task == "categorize":
+        from app.services.categorize import build_categorization_prompt, prediction_schema
+        from app.services.categorize_chunker import output_tokens_per_tx
+
+        transactions = [
+            {"id": i * 1000 + j, "description": merchant(rng, unique=True), "amount": round(rng.uniform(-200, -1), 2)}
+            for j in range(batch_size)
+        ]
+        request = InferenceRequest(
+            task="categorize",
+            prompt=build_categorization_prompt(transactions),
+            max_tokens=output_tokens_per_tx() * batch_size + 16,
+            json_schema=prediction_schema([tx["id"] for tx in transactions]),
+            cache_grammar=False,
+            stop_at_json_end=True,
+        )
+    elif task == "scenario":
+        from app.services.scenario import build_scenario_prompt, scenario_request
+
+        lines = [f"- 2025-08-{j % 28 + 1:02d}: {merchant(rng, unique=False)} £{rng.uniform(-200, -1):.2f} "
+                 f"({rng.choice(CATEGORIES)})" for j in range(batch_size)]
+        request = scenario_request(build_scenario_prompt(
+            "\n".join(lines), "\n".join(lines), "No older transactions.", "No hypothetical changes.",
+            "What happens to my cash flow if I cut discretionary spending by 10%?"
+        ))
+    else:
+        from app.routers.llm_router import _build_prompt, _infer_request
+
+        request = _infer_request(_build_prompt(
+            f"What happens if I spend £{rng.randint(20, 400)} a month at {rng.choice(MERCHANTS)}?"
+        ))
+    if greedy:
+        # Identical output is only defined for greedy decoding
+        request.temperature = 0.0
+    return request
+
+
+def timed_generation(llm, request) -> tuple:
+    from app.engine.generation import generate_tokens
+
+    pieces = []
+    first_token_at = None
+    for text in generate_tokens(llm, request):
+        first_token_at = first_token_at or time.perf_counter()
+        pieces.append(text)
+    end = time.perf_counter()
+    return "".join(pieces), len(pieces), end - (first_token_at or end)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare generation with and without speculative decoding")
+    parser.add_argument("--task", choices=TASKS, default="categorize")
+    parser.add_argument("--mode", choices=["prompt-lookup", "draft"], default="prompt-lookup")
+    parser.add_argument("--prompts", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=20, help="transactions per prompt")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--gguf", help="use a real GGUF model instead of the fake engine")
+    parser.add_argument("--token-latency-ms", type=float, default=20.0)
+    parser.add_argument("--prompt-token-latency-ms", type=float, default=0.5)
+    parser.add_argument("--output", help="write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    if args.gguf:
+        # Read by app.config.engine_config at import time
+        os.environ["LLM_MODEL_PATH"] = args.gguf
+    else:
+        from bench.fakes import install_fake_engine
+
+        install_fake_engine(token_latency=args.token_latency_ms / 1000,
+                            prompt_token_latency=args.prompt_token_latency_ms / 1000)
+
+    from app.config.engine_config import TASK_PROFILES
+    from app.engine import registry
+
+    profile = TASK_PROFILES[args.task]
+    models = {mode: registry._load(profile.path, profile.n_ctx, mode, profile.n_threads, profile.n_batch)
+              for mode in ("off", args.mode)}
+
+    totals = {mode: {"tokens": 0, "decode_s": 0.0} for mode in models}
+    mismatches = 0
+    for i in range(args.prompts):
+        outputs = {}
+        # Alternate which mode goes first so neither always inherits warm caches
+        for mode in (list(models) if i % 2 == 0 else list(reversed(models))):
+            request = build_request(args.task, i, random.Random(args.seed + i), args.batch_size)
+            text, tokens, decode = timed_generation(models[mode], request)
+            outputs[mode] = text
+            totals[mode]["tokens"] += tokens
+            totals[mode]["decode_s"] += decode
+        if outputs["off"] != outputs[args.mode]:
+            mismatches += 1
+            log(f"❌ Prompt {i}: outputs differ")
+
+    results = {"task": args.task, "mode": args.mode, "engine": args.gguf or "fake", "prompts": args.prompts,
+               "mismatches": mismatches}
+    for mode, total in totals.items():
+        total["tokens_per_sec"] = total["tokens"] / total["decode_s"] if total["decode_s"] else 0.0
+        results[mode] = total
+    results["speedup"] = (results[args.mode]["tokens_per_sec"] / results["off"]["tokens_per_sec"]
+                          if results["off"]["tokens_per_sec"] else None)
+
+    print(f"{'mode':<15}{'tokens':>8}{'decode s':>10}{'tok/s':>9}")
+    for mode in models:
+        print(f"{mode:<15}{totals[mode]['tokens']:>8}{totals[mode]['decode_s']:>10.2f}"
+              f"{totals[mode]['tokens_per_sec']:>9.1f}")
+    if results["speedup"] is not None:
+        print(f"speedup x{results['speedup']:.2f}, {mismatches} of {args.prompts} outputs differ")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import time
+
+from app.engine.cancellation import CancelToken, SharedCancelToken
+
+
+def test_caller_without_token_means_no_deadline():
+    shared = SharedCancelToken([None, CancelToken(deadline=time.time() - 1)])
+    assert shared.deadline is None
+    assert not shared.cancelled()
+
+
+def test_only_none_tokens():
+    shared = SharedCancelToken([None])
+    assert shared.deadline is None
+    assert shared.endpoint is None
+    assert not shared.cancelled()
+
+
+def test_latest_deadline_wins():
+    now = time.time()
+    shared = SharedCancelToken([CancelToken(deadline=now + 5, endpoint="categorize"), CancelToken(deadline=now + 9)])
+    assert shared.deadline == now + 9
+    assert shared.endpoint == "categorize"
+
+
+def test_join_without_deadline_clears_it():
+    shared = SharedCancelToken([CancelToken(deadline=time.time() + 5)])
+    shared.join(CancelToken())
+    assert shared.deadline is None
+    shared = SharedCancelToken([CancelToken(deadline=time.time() + 5)])
+    shared.join(None)
+    assert shared.deadline is None
+
+
+def test_cancelled_only_once_every_caller_is():
+    a, b = CancelToken(), CancelToken()
+    shared = SharedCancelToken([a, b])
+    a.cancel("disconnect")
+    assert not shared.cancelled()
+    b.cancel("deadline")
+    assert shared.cancelled()
+    assert shared.reason == "deadline"
+
+
+def test_expired_deadlines_cancel():
+    past = time.time() - 1
+    shared = SharedCancelToken([CancelToken(deadline=past), CancelToken(deadline=past)])
+    assert shared.cancelled()
+    assert shared.reason == "deadline"
@@ -0,0 +1,111 @@
+import asyncio
+
+from app.engine.cancellation import current_cancel
+from app.services.categorize_batcher import CategorizeBatcher
+
+
+def tx(id_, description):
+    return {"id": id_, "description": description, "amount": -1.0}
+
+
+def test_callers_without_cancel_token_get_results():
+    # e.g. a script, outside request_cancellation
+    async def run_batch(transactions):
+        return [{"id": t["id"], "category": "x"} for t in transactions]
+
+    async def main():
+        assert current_cancel.get() is None
+        batcher = CategorizeBatcher(run_batch, window_ms=10)
+        return await asyncio.wait_for(asyncio.gather(batcher.submit([tx(1, "a")]), batcher.submit([tx(2, "b")])), 5)
+
+    assert asyncio.run(main()) == [[{"id": 1, "category": "x"}], [{"id": 2, "category": "x"}]]
+
+
+def test_malformed_output_fails_callers_instead_of_hanging():
+    async def run_batch(transactions):
+        return [{"category": "x"}]
+
+    async def main():
+        batcher = CategorizeBatcher(run_batch, window_ms=10)
+        return await asyncio.wait_for(asyncio.gather(batcher.submit([tx(1, "a")]), batcher.submit([tx(2, "b")]),
+                                                     return_exceptions=True), 5)
+
+    assert all(isinstance(result, KeyError) for result in asyncio.run(main()))
+
+
+def test_coalesced_requests_get_their_own_ids_back():
+    seen = []
+
+    async def run_batch(transactions):
+        seen.append(transactions)
+        return [{"id": t["id"], "category": t["description"].upper()} for t in transactions]
+
+    async def main():
+        batcher = CategorizeBatcher(run_batch, window_ms=10)
+        return await asyncio.gather(batcher.submit([tx(1, "a"), tx(2, "b")]), batcher.submit([tx(1, "c")]))
+
+    first, second = asyncio.run(main())
+    # One generation, with batch-local ids that cannot collide
+    assert len(seen) == 1
+    assert [t["id"] for t in seen[0]] == [1, 2, 3]
+    assert first == [{"id": 1, "category": "A"}, {"id": 2, "category": "B"}]
+    assert second == [{"id": 1, "category": "C"}]
+
+
+def test_unknown_and_missing_predictions_are_dropped():
+    async def run_batch(transactions):
+        return [{"id": 99, "category": "X"}, {"id": 2, "category": "B"}]
+
+    async def main():
+        batcher = CategorizeBatcher(run_batch, window_ms=10)
+        return await asyncio.gather(batcher.submit([tx(7, "a")]), batcher.submit([tx(8, "b")]))
+
+    assert asyncio.run(main()) == [[], [{"id": 8, "category": "B"}]]
+
+
+def test_failure_reaches_every_caller():
+    async def run_batch(transactions):
+        raise RuntimeError("boom")
+
+    async def main():
+        batcher = CategorizeBatcher(run_batch, window_ms=10)
+        return await asyncio.gather(batcher.submit([tx(1, "a")]), batcher.submit([tx(2, "b")]),
+                                    return_exceptions=True)
+
+    assert [str(r) for r in asyncio.run(main())] == ["boom", "boom"]
+
+
+def test_token_budget_splits_batches():
+    sizes = []
+
+    async def run_batch(transactions):
+        sizes.append(len(transactions))
+        return [{"id": t["id"], "category": "x"} for t in transactions]
+
+    async def main():
+        # Each transaction alone nearly fills the budget
+        batcher = CategorizeBatcher(run_batch, window_ms=10, max_tokens=40)
+        await asyncio.gather(*(batcher.submit([tx(i, "shop")]) for i in range(3)))
+
+    asyncio.run(main())
+    assert sizes == [1, 1, 1]
+
+
+def test_running_batches_are_referenced_until_done():
+    async def main():
+        release = asyncio.Event()
+
+        async def run_batch(transactions):
+            await release.wait()
+            return []
+
+        batcher = CategorizeBatcher(run_batch, window_ms=1)
+        pending = asyncio.ensure_future(batcher.submit([tx(1, "a")]))
+        await asyncio.sleep(0.05)
+        assert len(batcher._running) == 1
+        release.set()
+        await pending
+        await asyncio.sleep(0)
+        assert not batcher._running
+
+    asyncio.run(main())
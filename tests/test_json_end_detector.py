@@ -0,0 +1,36 @@
+from app.engine.generation import JsonEndDetector
+
+
+def feed_all(pieces):
+    detector = JsonEndDetector()
+    for n, piece in enumerate(pieces):
+        end = detector.feed(piece)
+        if end >= 0:
+            return n, end
+    return None
+
+
+def test_object_in_one_piece():
+    assert feed_all(['{"a": 1}  \n\n']) == (0, 8)
+
+
+def test_end_found_in_the_piece_that_closes_it():
+    assert feed_all(['[{"id": 1', ', "x": [1, 2]', '}', ']', "garbage"]) == (3, 1)
+
+
+def test_brackets_inside_strings_do_not_count():
+    text = '{"a": "} ] { [", "b": "\\"}"}'
+    assert feed_all([text + " tail"]) == (0, len(text))
+
+
+def test_escape_split_across_pieces():
+    # The backslash ends one piece; the quote it escapes starts the next
+    assert feed_all(['{"a": "x\\', '"}', '"}']) == (2, 2)
+
+
+def test_leading_text_and_stray_closers_are_ignored():
+    assert feed_all(["Sure! ] } ", '{"a": {}}']) == (1, 9)
+
+
+def test_open_value_never_ends():
+    assert feed_all(['{"a": [1, 2', ', 3]']) is None
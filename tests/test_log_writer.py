@@ -0,0 +1,105 @@
+import asyncio
+import json
+import os
+
+from app.db import log_writer
+from app.db.log_writer import ConversationLogWriter
+
+
+class FakeConnection:
+    def __init__(self, rows: list):
+        self._rows = rows
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def copy_records_to_table(self, table, records, columns):
+        self._rows.extend(records)
+
+
+class FakePool:
+    def __init__(self):
+        self.rows = []
+
+    def acquire(self):
+        return FakeConnection(self.rows)
+
+
+def record(n):
+    return (n, "prompt", "response", "scenario", "model", None)
+
+
+def install_pool(monkeypatch) -> FakePool:
+    pool = FakePool()
+
+    async def get_pool():
+        return pool
+
+    monkeypatch.setattr(log_writer, "get_pool", get_pool)
+    return pool
+
+
+def run_writer(writer, submit=()):
+    async def main():
+        writer.start()
+        for r in submit:
+            writer.submit(r)
+        await asyncio.sleep(0.1)
+        await writer.stop()
+
+    asyncio.run(main())
+
+
+def test_torn_orphan_spill_is_replayed_and_dead_lettered(tmp_path, monkeypatch):
+    pool = install_pool(monkeypatch)
+    # A process that died mid-write: pid 999999 is not running
+    orphan = tmp_path / "conversation_logs-999999.spill.jsonl"
+    orphan.write_text(json.dumps(list(record(1))) + "\n" + '[2, "prom')
+
+    writer = ConversationLogWriter(flush_interval=0.01, spill_dir=str(tmp_path))
+    run_writer(writer, [record(3)])
+
+    assert sorted(r[0] for r in pool.rows) == [1, 3]
+    assert os.listdir(tmp_path) == [f"conversation_logs-{os.getpid()}.dead.jsonl"]
+    assert (tmp_path / f"conversation_logs-{os.getpid()}.dead.jsonl").read_text() == '[2, "prom\n'
+
+
+def test_writer_survives_failing_spill(tmp_path, monkeypatch):
+    async def unreachable():
+        raise OSError("database down")
+
+    monkeypatch.setattr(log_writer, "get_pool", unreachable)
+    # Spilling fails too: the spill directory is a file
+    blocked = tmp_path / "blocked"
+    blocked.write_text("")
+    writer = ConversationLogWriter(flush_interval=0.01, spill_dir=str(blocked))
+
+    async def main():
+        writer.start()
+        writer.submit(record(1))
+        await asyncio.sleep(0.05)
+        assert not writer._task.done()
+        pool = install_pool(monkeypatch)
+        writer.submit(record(2))
+        await asyncio.sleep(0.05)
+        await writer.stop()
+        return pool
+
+    assert [r[0] for r in asyncio.run(main()).rows] == [2]
+
+
+def test_overflow_is_capped(tmp_path, monkeypatch):
+    install_pool(monkeypatch)
+    writer = ConversationLogWriter(queue_size=1, overflow_size=2, spill_dir=str(tmp_path))
+
+    async def main():
+        # Not started: nothing drains the queue
+        for n in range(10):
+            writer.submit(record(n))
+
+    asyncio.run(main())
+    assert len(writer._overflow) == 2
+    assert writer._dropped == 7
@@ -0,0 +1,83 @@
+import pytest
+
+from app.services import scenario_packer
+from app.services.scenario_packer import Section, lines_cost, pack_sections
+
+
+@pytest.fixture(autouse=True)
+def word_tokenizer(monkeypatch):
+    # One token per whitespace-separated word: no model needed
+    monkeypatch.setattr(scenario_packer, "count_tokens", lambda text: len(text.split()))
+
+
+def section(rows, unit="transactions", empty="None."):
+    return Section(rows, lambda r: f"- {r[0]} {r[2]}", lambda r: r[1], lambda r: r[2], unit, empty)
+
+
+def shops(n, categories=("food", "rent", "fun")):
+    return [(f"shop{i}", categories[i % len(categories)], -10.0 - i) for i in range(n)]
+
+
+def cost(texts):
+    return sum(lines_cost(text.split("\n")) for text in texts if text)
+
+
+def test_everything_in_full_when_it_fits():
+    rows = shops(6)
+    [text] = pack_sections([section(rows)], 1000)
+    assert text.split("\n") == section(rows).full()
+
+
+def test_totals_then_detail_by_priority():
+    high, low = section(shops(12)), section(shops(12))
+    budget = lines_cost(high.full()) + lines_cost(low.compact())
+    first, second = pack_sections([high, low], budget)
+    assert first.split("\n") == high.full()
+    assert second.split("\n") == low.compact()
+
+
+@pytest.mark.parametrize("budget", range(0, 120, 3))
+def test_never_over_budget(budget):
+    texts = pack_sections([section(shops(10)), section(shops(30, categories=[f"c{i}" for i in range(15)]))], budget)
+    assert cost(texts) <= budget
+
+
+def test_small_budget_counts_the_omission_note():
+    # Few tokens left: the note must fit along with whatever rows stay, or the section is left blank
+    texts = pack_sections([section(shops(20, categories=[f"c{i}" for i in range(20)]))], 5)
+    assert cost(texts) <= 5
+    assert texts[0] == "" or "omitted" in texts[0]
+
+
+def test_lowest_priority_trimmed_first():
+    high = section(shops(9))
+    # Four rows per category, so totals are the cheaper rendering
+    low = section(shops(40, categories=[f"c{i}" for i in range(10)]))
+    budget = lines_cost(high.compact()) + 20
+    first, second = pack_sections([high, low], budget)
+    assert first.split("\n") == high.compact()
+    assert second.endswith("smaller categories omitted)")
+    assert cost([first, second]) <= budget
+
+
+def test_rows_trimmed_when_full_is_the_cheaper_rendering():
+    # One row per category: full detail beats totals, and trimming drops rows
+    low = section(shops(40, categories=[f"c{i}" for i in range(40)]))
+    [text] = pack_sections([low], 30)
+    assert text.endswith("more transactions omitted)")
+    assert cost([text]) <= 30
+
+
+def test_full_kept_when_cheaper_than_totals_even_without_budget_left():
+    # One row per category: the totals line is longer than the row itself
+    rows = [("a", "groceries", -1.0), ("b", "travel", -2.0)]
+    s = section(rows)
+    assert lines_cost(s.full()) < lines_cost(s.compact())
+    [text] = pack_sections([s], lines_cost(s.full()))
+    assert text.split("\n") == s.full()
+
+
+def test_empty_section_placeholder_and_blank_when_nothing_fits():
+    texts = pack_sections([section([], empty="No rows."), section(shops(5))], 2)
+    assert texts[0] == "No rows."
+    assert texts[1] == ""